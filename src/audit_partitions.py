@@ -0,0 +1,158 @@
+import logging
+from datetime import datetime
+from sqlalchemy import text
+from src.models.database import db, AuditLog, AUDIT_ROLLUP_DDL
+
+logger = logging.getLogger(__name__)
+
+# Monthly partitions are named audit_logs_YYYY_MM; rows outside every month
+# land in the default partition instead of failing the insert
+PARTITION_PREFIX = 'audit_logs_'
+DEFAULT_PARTITION = 'audit_logs_default'
+
+def _month_start(value):
+    """First instant of value's month"""
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def _add_months(value, months):
+    """Shift a month start by a number of months"""
+    year, month = divmod(value.month - 1 + months, 12)
+    return value.replace(year=value.year + year, month=month + 1)
+
+def _partition_name(month):
+    """Partition table name for a month start"""
+    return f"{PARTITION_PREFIX}{month:%Y_%m}"
+
+def _partition_month(name):
+    """Month start encoded in a partition name, or None for other tables"""
+    try:
+        return datetime.strptime(name[len(PARTITION_PREFIX):], '%Y_%m')
+    except ValueError:
+        return None
+
+def is_partitioned():
+    """Whether audit_logs is a PostgreSQL range-partitioned table"""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'audit_logs' AND pg_table_is_visible(c.oid))"
+    )).scalar()
+
+def create_partitions(months_ahead=1):
+    """
+    Make sure monthly partitions exist through months_ahead months from now
+
+    Args:
+        months_ahead: Number of future months to pre-create
+    """
+    _create_partitions(datetime.utcnow(), months_ahead)
+    db.session.commit()
+
+def _create_partitions(start, months_ahead):
+    """
+    Create any missing monthly partitions from start's month onwards
+
+    PostgreSQL refuses to add a partition while the default partition holds
+    rows in its range, which happens whenever the scheduled task ran late.
+    Each missing month is therefore built as a plain table, its rows are
+    moved out of the default partition, and only then is it attached.
+    """
+    month = _month_start(start)
+    last = _add_months(_month_start(datetime.utcnow()), months_ahead)
+
+    while month <= last:
+        end = _add_months(month, 1)
+        name = _partition_name(month)
+        if db.session.execute(text("SELECT to_regclass(:name)"), {'name': name}).scalar() is None:
+            bounds = {'start': month, 'end': end}
+            db.session.execute(text(f"CREATE TABLE {name} (LIKE audit_logs INCLUDING DEFAULTS)"))
+            moved = db.session.execute(text(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+                "WHERE timestamp >= :start AND timestamp < :end RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved"
+            ), bounds).rowcount
+            db.session.execute(text(
+                f"ALTER TABLE audit_logs ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+            ))
+            if moved:
+                logger.info(f"Moved {moved} audit log rows from {DEFAULT_PARTITION} into {name}")
+        month = end
+
+def drop_partitions_before(cutoff):
+    """
+    Drop every monthly partition that ends on or before cutoff
+
+    Dropping a partition removes its rows without per-row deletes or WAL.
+
+    Returns:
+        Number of rows removed
+    """
+    partitions = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'audit_logs'"
+    )).scalars().all()
+
+    removed = 0
+    for name in partitions:
+        month = _partition_month(name)
+        if month is None or _add_months(month, 1) > cutoff:
+            continue
+        removed += db.session.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+        db.session.execute(text(f"DROP TABLE {name}"))
+        logger.info(f"Dropped audit log partition {name}")
+    db.session.commit()
+    return removed
+
+def partition_audit_logs():
+    """
+    Convert a plain PostgreSQL audit_logs table to monthly range partitions
+
+    Runs in one transaction: the existing table is renamed, a partitioned
+    table with the same columns, keys and indexes takes its name, and the
+    rows are copied across. The hourly rollup trigger moves to the new table.
+    The primary key becomes (id, timestamp) because
+    PostgreSQL requires the partition key in every unique constraint; ids
+    keep coming from the original sequence.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        raise RuntimeError('Audit log partitioning requires PostgreSQL')
+    if is_partitioned():
+        logger.info('audit_logs is already partitioned')
+        return
+
+    session = db.session
+    session.execute(text("UPDATE audit_logs SET timestamp = now() AT TIME ZONE 'utc' WHERE timestamp IS NULL"))
+    session.execute(text("ALTER TABLE audit_logs RENAME TO audit_logs_legacy"))
+
+    # Free the index and constraint names for the new table
+    legacy_indexes = session.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'audit_logs_legacy'"
+    )).scalars().all()
+    for name in legacy_indexes:
+        session.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name}_legacy"'))
+
+    session.execute(text(
+        "CREATE TABLE audit_logs (LIKE audit_logs_legacy INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (timestamp)"
+    ))
+    session.execute(text("ALTER TABLE audit_logs ADD PRIMARY KEY (id, timestamp)"))
+    session.execute(text("ALTER TABLE audit_logs ADD FOREIGN KEY (user_id) REFERENCES users (id)"))
+    for index in AuditLog.__table__.indexes:
+        index.create(bind=session.connection())
+
+    session.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF audit_logs DEFAULT"))
+    oldest = session.execute(text("SELECT min(timestamp) FROM audit_logs_legacy")).scalar()
+    _create_partitions(oldest or datetime.utcnow(), months_ahead=1)
+
+    session.execute(text("INSERT INTO audit_logs SELECT * FROM audit_logs_legacy"))
+    # Re-attach the hourly rollup only after the copy; the rows are counted
+    for ddl in AUDIT_ROLLUP_DDL['postgresql']:
+        session.execute(ddl)
+    session.execute(text("ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id"))
+    session.execute(text("DROP TABLE audit_logs_legacy"))
+    session.commit()
@@ -0,0 +1,103 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from src.models.database import db, AuditLog
+
+logger = logging.getLogger(__name__)
+
+# Rows are written when this many are waiting or FLUSH_INTERVAL seconds after
+# the first one arrived, whichever comes first
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.1
+
+_audit_queue = queue.Queue()
+_start_lock = threading.Lock()
+_app = None
+
+def add_audit(action, details=None, user_id=None, ip_address=None):
+    """
+    Add an audit log entry to the current session's transaction
+
+    Use this for admin and security records: the row commits or rolls back
+    together with the change it describes, so a committed mutation always
+    has its audit entry. log_audit() is for access logs that may be lost.
+
+    Returns:
+        The pending AuditLog instance
+    """
+    entry = AuditLog(user_id=user_id, action=action, details=details, ip_address=ip_address)
+    db.session.add(entry)
+    return entry
+
+def log_audit(action, details=None, user_id=None, ip_address=None):
+    """
+    Queue an audit log entry for the background writer
+
+    The row is inserted shortly after the request returns, so callers must not
+    expect to read it back within the same request. Entries still queued when
+    the process dies are lost; record admin and security actions with
+    add_audit() instead.
+
+    Args:
+        action: Audit action name
+        details: Human readable description
+        user_id: ID of the affected user, if any
+        ip_address: Client IP address
+    """
+    _start_writer(current_app._get_current_object())
+    _audit_queue.put({
+        'user_id': user_id,
+        'action': action,
+        'details': details,
+        'ip_address': ip_address,
+        'timestamp': datetime.utcnow()
+    })
+
+def flush_audit_queue():
+    """Block until every queued entry has been written"""
+    if _app is not None:
+        _audit_queue.join()
+
+def _start_writer(app):
+    """Start the writer thread for app on first use"""
+    global _app
+    with _start_lock:
+        if _app is not None:
+            return
+        _app = app
+
+    threading.Thread(target=_run_writer, name='audit-writer', daemon=True).start()
+    atexit.register(flush_audit_queue)
+
+def _run_writer():
+    """Drain the queue forever, one bulk insert per batch"""
+    while True:
+        batch = [_audit_queue.get()]
+        deadline = time.monotonic() + FLUSH_INTERVAL
+
+        while len(batch) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_audit_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        _write_batch(batch)
+        for _ in batch:
+            _audit_queue.task_done()
+
+def _write_batch(batch):
+    """Insert a batch of audit rows in one transaction"""
+    with _app.app_context():
+        try:
+            db.session.bulk_insert_mappings(AuditLog, batch)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error writing {len(batch)} audit log entries: {e}")
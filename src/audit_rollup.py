@@ -0,0 +1,28 @@
+from sqlalchemy import delete, insert, select
+from src.models.database import db, AuditLog, AuditHourlyCount, AUDIT_ROLLUP_DDL
+
+def hour_bucket(column):
+    """SQL expression truncating a timestamp column to the start of its hour"""
+    if db.engine.dialect.name == 'sqlite':
+        return db.func.strftime('%Y-%m-%d %H:00:00.000000', column)
+    return db.func.date_trunc('hour', column)
+
+def rebuild_audit_rollup():
+    """
+    (Re)install the rollup trigger and recount audit_hourly_counts
+
+    New databases get the trigger from create_all; run this once on databases
+    created before the rollup existed, or after bulk-loading audit rows.
+    """
+    for ddl in AUDIT_ROLLUP_DDL.get(db.engine.dialect.name, ()):
+        db.session.execute(ddl)
+    
+    hour = hour_bucket(AuditLog.timestamp)
+    db.session.execute(delete(AuditHourlyCount))
+    db.session.execute(insert(AuditHourlyCount).from_select(
+        ['hour', 'count'],
+        select(hour, db.func.count(AuditLog.id))
+        .where(AuditLog.timestamp.isnot(None))
+        .group_by(hour)
+    ))
+    db.session.commit()
@@ -0,0 +1,40 @@
+from dogpile.cache import make_region
+
+# Per-process memoization for reads that are stable on the seconds timescale.
+# Entries expire after 10 seconds unless a decorator overrides it; writers
+# call .invalidate() on the cached function to drop stale entries sooner.
+region = make_region().configure(
+    'dogpile.cache.memory',
+    expiration_time=10
+)
+
+def table_version(model):
+    """
+    Fingerprint of a table that has id and updated_at columns, shared by every process
+
+    Inserts and deletes move the row count and max id, updates move the
+    newest updated_at. Versioned cached functions return the version they
+    were built from alongside their value, so a write in any worker is
+    picked up by every other worker on its next read rather than after the
+    TTL.
+    """
+    from sqlalchemy import func, select
+    from src.models.database import db
+
+    return tuple(db.session.execute(
+        select(func.count(model.id), func.max(model.id), func.max(model.updated_at))
+    ).one())
+
+def current_value(cached, version):
+    """
+    Return the value of a versioned cached function, rebuilding it if stale
+
+    Args:
+        cached: Cached function returning a (version, value) pair
+        version: The table's current version
+    """
+    cached_version, value = cached()
+    if cached_version != version:
+        cached.invalidate()
+        _, value = cached()
+    return value
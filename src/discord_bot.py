@@ -7,10 +7,11 @@ from datetime import datetime, timedelta
 from typing import Optional
 import json
 from dotenv import load_dotenv
+from sqlalchemy.orm import joinedload
 
 # Import database models
-from src.models.database import db, User, Transaction, Item, Purchase, BotConfig, MinecraftServer, ServerStatus
-from src.minecraft_integration import MinecraftIntegration
+from src.models.database import db, User, Transaction, Item, Purchase, MinecraftServer, ServerStatus
+from src.minecraft_integration import MinecraftIntegration, render_item_commands
 
 # Load environment variables
 load_dotenv()
@@ -107,7 +108,7 @@ class DiscordBot(commands.Bot):
         from flask import current_app
         
         with current_app.app_context():
-            user = User.query.filter_by(discord_id=str(discord_user.id)).first()
+            user = User.by_discord_id(discord_user.id)
             
             if not user:
                 user = User(
@@ -157,9 +158,10 @@ class DiscordBot(commands.Bot):
         """Get a configuration value from the database"""
         from flask import current_app
         
+        from src.routes.api import bot_config_values
+        
         with current_app.app_context():
-            config = BotConfig.query.filter_by(key=key).first()
-            return config.value if config else default_value
+            return bot_config_values().get(key, default_value)
             
     @tasks.loop(minutes=5)
     async def update_server_status(self):
@@ -179,8 +181,7 @@ class DiscordBot(commands.Bot):
                         is_online=status['online'],
                         players_online=status.get('players_online', 0),
                         max_players=status.get('max_players', 0),
-                        version=status.get('version', ''),
-                        timestamp=datetime.utcnow()
+                        version=status.get('version', '')
                     )
                     
                     db.session.add(server_status)
@@ -197,29 +198,29 @@ class DiscordBot(commands.Bot):
             from flask import current_app
             
             with current_app.app_context():
-                pending_purchases = Purchase.query.filter_by(status='pending').all()
+                # Load each purchase's user and item in the same SELECT
+                pending_purchases = Purchase.query.options(
+                    joinedload(Purchase.user), joinedload(Purchase.item)
+                ).filter_by(status='pending').all()
                 
                 for purchase in pending_purchases:
                     try:
-                        # Get user and item details
-                        user = User.query.get(purchase.user_id)
-                        item = Item.query.get(purchase.item_id)
+                        user, item = purchase.user, purchase.item
                         
                         if not user or not item:
                             continue
                             
-                        # Generate Minecraft command
-                        minecraft_command = item.minecraft_command_template.format(
-                            username=user.minecraft_uuid or user.username
-                        )
+                        # Generate Minecraft commands
+                        commands = render_item_commands(item, username=user.minecraft_uuid or user.username)
                         
-                        # Execute command on Minecraft server
-                        success = await self.minecraft.execute_command(minecraft_command)
+                        # Execute commands on Minecraft server
+                        results = await self.minecraft.execute_multiple_commands(commands)
+                        success = bool(results) and all(results.values())
                         
                         if success:
                             purchase.status = 'fulfilled'
                             purchase.fulfilled_at = datetime.utcnow()
-                            purchase.minecraft_command = minecraft_command
+                            purchase.minecraft_command = '; '.join(commands)
                             
                             # Notify user
                             discord_user = self.get_user(int(user.discord_id))
@@ -331,6 +332,9 @@ async def buy(ctx, item_id: int, quantity: int = 1):
                 status='pending'
             )
             
+            db.session.add(purchase)
+            db.session.flush()  # Get the ID
+            
             # Create transaction record
             transaction = Transaction(
                 user_id=user.id,
@@ -340,7 +344,6 @@ async def buy(ctx, item_id: int, quantity: int = 1):
                 reference_id=f"purchase_{purchase.id}"
             )
             
-            db.session.add(purchase)
             db.session.add(transaction)
             db.session.commit()
             
@@ -378,7 +381,7 @@ async def server_status(ctx):
             
             for server in servers:
                 # Get latest status
-                latest_status = ServerStatus.query.filter_by(server_id=server.id).order_by(ServerStatus.timestamp.desc()).first()
+                latest_status = ServerStatus.query.filter_by(server_id=server.id).order_by(ServerStatus.timestamp_ms.desc()).first()
                 
                 if latest_status:
                     status_text = "🟢 Online" if latest_status.is_online else "🔴 Offline"
@@ -78,10 +78,11 @@ class DiscordBotSlash(commands.Bot):
             
         try:
             with self.app.app_context():
-                from src.models.database import db, User, Transaction, BotConfig
+                from src.models.database import db, User, Transaction
+                from src.routes.api import bot_config_values
                 
                 # Get user
-                user = User.query.filter_by(discord_id=str(message.author.id)).first()
+                user = User.by_discord_id(message.author.id)
                 if not user:
                     # Create new user
                     user = User(
@@ -94,14 +95,11 @@ class DiscordBotSlash(commands.Bot):
                 # Check cooldown and daily limits
                 config = {}
                 try:
-                    coins_config = BotConfig.query.filter_by(key='coins_per_message').first()
-                    config['coins_per_message'] = int(coins_config.value) if coins_config else 1
-                    
-                    cooldown_config = BotConfig.query.filter_by(key='message_cooldown').first()
-                    config['message_cooldown'] = int(cooldown_config.value) if cooldown_config else 60
-                    
-                    daily_config = BotConfig.query.filter_by(key='max_daily_coins').first()
-                    config['max_daily_coins'] = int(daily_config.value) if daily_config else 100
+                    # Briefly cached key/value map instead of a query per setting
+                    values = bot_config_values()
+                    config['coins_per_message'] = int(values.get('coins_per_message', 1))
+                    config['message_cooldown'] = int(values.get('message_cooldown', 60))
+                    config['max_daily_coins'] = int(values.get('max_daily_coins', 100))
                 except Exception as e:
                     logger.error(f"Error loading bot config: {e}")
                     config = {
@@ -257,19 +255,23 @@ class DiscordBotSlash(commands.Bot):
     async def execute_minecraft_command(self, user, item, purchase):
         """Execute Minecraft command via RCON"""
         try:
-            from src.minecraft_integration import MinecraftIntegration
+            from src.minecraft_integration import MinecraftIntegration, render_item_commands
             
             integration = MinecraftIntegration()
             
-            # Replace placeholders in command template
-            command = item.minecraft_command_template.replace('{username}', user.username)
-            command = command.replace('{discord_id}', user.discord_id)
-            command = command.replace('{minecraft_uuid}', user.minecraft_uuid or user.username)
+            # Replace placeholders in command templates
+            commands = render_item_commands(
+                item,
+                username=user.username,
+                discord_id=user.discord_id,
+                minecraft_uuid=user.minecraft_uuid or user.username
+            )
             
-            success = await integration.execute_command(command)
+            results = await integration.execute_multiple_commands(commands)
+            success = bool(results) and all(results.values())
             
             if success:
-                purchase.minecraft_command = command
+                purchase.minecraft_command = '; '.join(commands)
                 logger.info(f"Executed Minecraft command for purchase {purchase.id}")
             
             return success
@@ -290,7 +292,7 @@ class DiscordBotSlash(commands.Bot):
             with self.app.app_context():
                 from src.models.database import User
                 
-                user = User.query.filter_by(discord_id=str(ctx.author.id)).first()
+                user = User.by_discord_id(ctx.author.id)
                 
                 if not user:
                     await ctx.respond(
@@ -388,7 +390,7 @@ async def buy_command(interaction: discord.Interaction, item_id: int, quantity:
             from src.models.database import db, User, Item, Purchase, Transaction
             
             # Get user
-            user = User.query.filter_by(discord_id=str(interaction.user.id)).first()
+            user = User.by_discord_id(interaction.user.id)
             if not user:
                 await interaction.response.send_message(
                     "❌ You don't have an account yet! Send a message to create one.",
@@ -425,6 +427,9 @@ async def buy_command(interaction: discord.Interaction, item_id: int, quantity:
                 status='pending'
             )
             
+            db.session.add(purchase)
+            db.session.flush()  # Get the ID
+            
             # Create transaction record
             transaction = Transaction(
                 user_id=user.id,
@@ -434,7 +439,6 @@ async def buy_command(interaction: discord.Interaction, item_id: int, quantity:
                 reference_id=f'purchase_{purchase.id}'
             )
             
-            db.session.add(purchase)
             db.session.add(transaction)
             db.session.commit()
             
@@ -477,7 +481,7 @@ async def status_command(interaction: discord.Interaction):
             
             for server in servers:
                 latest_status = ServerStatus.query.filter_by(server_id=server.id).order_by(
-                    ServerStatus.timestamp.desc()
+                    ServerStatus.timestamp_ms.desc()
                 ).first()
                 
                 if latest_status:
@@ -527,7 +531,7 @@ async def gift_command(interaction: discord.Interaction, recipient: discord.Memb
             from src.models.database import db, User, Gift, Transaction
             
             # Get sender
-            sender = User.query.filter_by(discord_id=str(interaction.user.id)).first()
+            sender = User.by_discord_id(interaction.user.id)
             if not sender:
                 await interaction.response.send_message(
                     "❌ You don't have an account yet! Send a message to create one.",
@@ -544,7 +548,7 @@ async def gift_command(interaction: discord.Interaction, recipient: discord.Memb
                 return
             
             # Get or create recipient
-            recipient_user = User.query.filter_by(discord_id=str(recipient.id)).first()
+            recipient_user = User.by_discord_id(recipient.id)
             if not recipient_user:
                 recipient_user = User(
                     discord_id=str(recipient.id),
@@ -562,6 +566,8 @@ async def gift_command(interaction: discord.Interaction, recipient: discord.Memb
                 status='completed',
                 processed_at=datetime.utcnow()
             )
+            db.session.add(gift)
+            db.session.flush()  # Get the ID
             
             # Transfer coins
             sender.coins -= amount
@@ -584,7 +590,6 @@ async def gift_command(interaction: discord.Interaction, recipient: discord.Memb
                 reference_id=f'gift_{gift.id}'
             )
             
-            db.session.add(gift)
             db.session.add(sender_transaction)
             db.session.add(recipient_transaction)
             db.session.commit()
@@ -662,8 +667,12 @@ async def help_command(interaction: discord.Interaction):
     
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
-def run_bot(app):
-    """Run the Discord bot with Flask app context"""
+def run_bot(app, loop=None):
+    """Run the Discord bot with Flask app context
+    
+    When ``loop`` is given the bot runs on it directly. ``bot.run`` installs
+    signal handlers, which only works on the main thread.
+    """
     bot.set_flask_app(app)
     
     token = os.getenv('DISCORD_BOT_TOKEN')
@@ -672,7 +681,10 @@ def run_bot(app):
         return
     
     try:
-        bot.run(token)
+        if loop is not None:
+            loop.run_until_complete(bot.start(token))
+        else:
+            bot.run(token)
     except Exception as e:
         logger.error(f"Error running bot: {e}")
 
@@ -14,17 +14,25 @@ class GiftCommands(commands.Cog):
         return hasattr(self.bot, 'app') and self.bot.app is not None
 
     @discord.slash_command(name="gift", description="Send coins to another user")
-    async def gift_coins(self, ctx, user: discord.Member, amount: int, message: str = ""):
+    async def gift_coins(
+        self,
+        ctx: discord.ApplicationContext,
+        user: discord.Option(discord.Member, "Who receives the coins"),
+        amount: discord.Option(int, "How many coins to send"),
+        message: discord.Option(str, "Optional note for the recipient", default="")
+    ):
         """Send coins to another user"""
+        from src.models.database import db
+        
         try:
-            await interaction.response.defer()
+            await ctx.defer()
             
             # Validation
             if amount <= 0:
                 await ctx.followup.send("❌ Amount must be positive!", ephemeral=True)
                 return
             
-            if user.id == interaction.user.id:
+            if user.id == ctx.author.id:
                 await ctx.followup.send("❌ You cannot send coins to yourself!", ephemeral=True)
                 return
             
@@ -33,83 +41,88 @@ class GiftCommands(commands.Cog):
                 return
             
             with self.bot.app.app_context():
-                from src.models.database import db, User, Gift, Transaction, AuditLog
+                from src.models.database import User, Gift, Transaction, AuditLog
                 
                 # Get or create users
-                sender = User.query.filter_by(discord_id=str(ctx.author.id)).first()
-            if not sender:
-                await ctx.followup.send("❌ You need to use the bot first to send gifts!", ephemeral=True)
-                return
-            
-            recipient = User.query.filter_by(discord_id=str(user.id)).first()
-            if not recipient:
-                # Create recipient user
-                recipient = User(
-                    discord_id=str(user.id),
-                    username=user.display_name,
-                    coins=0
+                sender = User.by_discord_id(ctx.author.id)
+                if not sender:
+                    await ctx.followup.send("❌ You need to use the bot first to send gifts!", ephemeral=True)
+                    return
+                
+                recipient = User.by_discord_id(user.id)
+                if not recipient:
+                    # Create recipient user
+                    recipient = User(
+                        discord_id=str(user.id),
+                        username=user.display_name,
+                        coins=0
+                    )
+                    db.session.add(recipient)
+                    db.session.flush()  # Get the ID
+                
+                # Check if sender has enough coins
+                if sender.coins < amount:
+                    await ctx.followup.send(
+                        f"❌ Insufficient coins! You have {sender.coins:,} coins but need {amount:,}.",
+                        ephemeral=True
+                    )
+                    return
+                
+                # Create gift record
+                gift = Gift(
+                    sender_id=sender.id,
+                    recipient_id=recipient.id,
+                    amount=amount,
+                    message=message,
+                    status='completed',
+                    processed_at=datetime.utcnow()
                 )
-                db.session.add(recipient)
+                db.session.add(gift)
                 db.session.flush()  # Get the ID
-            
-            # Check if sender has enough coins
-            if sender.coins < amount:
-                await ctx.followup.send(
-                    f"❌ Insufficient coins! You have {sender.coins:,} coins but need {amount:,}.",
-                    ephemeral=True
+                
+                # Transfer coins
+                sender.coins -= amount
+                recipient.coins += amount
+                
+                # Create transaction records
+                sender_transaction = Transaction(
+                    user_id=sender.id,
+                    transaction_type='gift_sent',
+                    amount=-amount,
+                    description=f'Gift sent to {recipient.username}',
+                    reference_id=f'gift_{gift.id}'
                 )
-                return
-            
-            # Create gift record
-            gift = Gift(
-                sender_id=sender.id,
-                recipient_id=recipient.id,
-                amount=amount,
-                message=message,
-                status='completed',
-                processed_at=datetime.utcnow()
-            )
-            
-            # Transfer coins
-            sender.coins -= amount
-            recipient.coins += amount
-            
-            # Create transaction records
-            sender_transaction = Transaction(
-                user_id=sender.id,
-                transaction_type='gift_sent',
-                amount=-amount,
-                description=f'Gift sent to {recipient.username}',
-                reference_id=f'gift_{gift.id}'
-            )
-            
-            recipient_transaction = Transaction(
-                user_id=recipient.id,
-                transaction_type='gift_received',
-                amount=amount,
-                description=f'Gift received from {sender.username}',
-                reference_id=f'gift_{gift.id}'
-            )
-            
-            # Create audit log entries
-            sender_audit = AuditLog(
-                user_id=sender.id,
-                action='gift_sent',
-                details=f'{{"amount": {amount}, "recipient": "{recipient.username}", "message": "{message}"}}'
-            )
-            
-            recipient_audit = AuditLog(
-                user_id=recipient.id,
-                action='gift_received',
-                details=f'{{"amount": {amount}, "sender": "{sender.username}", "message": "{message}"}}'
-            )
-            
-            db.session.add(gift)
-            db.session.add(sender_transaction)
-            db.session.add(recipient_transaction)
-            db.session.add(sender_audit)
-            db.session.add(recipient_audit)
-            db.session.commit()
+                
+                recipient_transaction = Transaction(
+                    user_id=recipient.id,
+                    transaction_type='gift_received',
+                    amount=amount,
+                    description=f'Gift received from {sender.username}',
+                    reference_id=f'gift_{gift.id}'
+                )
+                
+                # Create audit log entries
+                sender_audit = AuditLog(
+                    user_id=sender.id,
+                    action='gift_sent',
+                    details=f'{{"amount": {amount}, "recipient": "{recipient.username}", "message": "{message}"}}'
+                )
+                
+                recipient_audit = AuditLog(
+                    user_id=recipient.id,
+                    action='gift_received',
+                    details=f'{{"amount": {amount}, "sender": "{sender.username}", "message": "{message}"}}'
+                )
+                
+                db.session.add(sender_transaction)
+                db.session.add(recipient_transaction)
+                db.session.add(sender_audit)
+                db.session.add(recipient_audit)
+                db.session.commit()
+                
+                gift_id = gift.id
+                sender_coins = sender.coins
+                recipient_coins = recipient.coins
             
             # Create success embed
             embed = discord.Embed(
@@ -120,13 +133,13 @@ class GiftCommands(commands.Cog):
             
             embed.add_field(
                 name="From",
-                value=f"{ctx.author.mention}\n💰 {sender.coins:,} coins remaining",
+                value=f"{ctx.author.mention}\n💰 {sender_coins:,} coins remaining",
                 inline=True
             )
             
             embed.add_field(
                 name="To",
-                value=f"{user.mention}\n💰 {recipient.coins:,} coins total",
+                value=f"{user.mention}\n💰 {recipient_coins:,} coins total",
                 inline=True
             )
             
@@ -143,9 +156,9 @@ class GiftCommands(commands.Cog):
                     inline=False
                 )
             
-            embed.set_footer(text=f"Gift ID: {gift.id}")
+            embed.set_footer(text=f"Gift ID: {gift_id}")
             
-            await interaction.followup.send(embed=embed)
+            await ctx.followup.send(embed=embed)
             
             # Send DM to recipient if possible
             try:
@@ -161,7 +174,7 @@ class GiftCommands(commands.Cog):
                 
                 dm_embed.add_field(
                     name="Your Balance",
-                    value=f"💰 {recipient.coins:,} coins",
+                    value=f"💰 {recipient_coins:,} coins",
                     inline=True
                 )
                 
@@ -171,97 +184,98 @@ class GiftCommands(commands.Cog):
             
         except Exception as e:
             logger.error(f"Error in gift command: {e}")
+            with self.bot.app.app_context():
+                db.session.rollback()
             await ctx.followup.send("❌ An error occurred while sending the gift.", ephemeral=True)
-            db.session.rollback()
 
-    @app_commands.command(name="gifts", description="View your gift history")
-    async def gift_history(self, interaction: discord.Interaction):
+    @discord.slash_command(name="gifts", description="View your gift history")
+    async def gift_history(self, ctx: discord.ApplicationContext):
         """View gift history for the user"""
         if not self.bot.app:
-            await interaction.response.send_message("❌ Bot is not properly configured.", ephemeral=True)
+            await ctx.respond("❌ Bot is not properly configured.", ephemeral=True)
             return
             
         try:
-            await interaction.response.defer()
+            await ctx.defer()
             
             with self.bot.app.app_context():
                 from src.models.database import User, Gift
                 
                 # Get user
-                user = User.query.filter_by(discord_id=str(interaction.user.id)).first()
+                user = User.by_discord_id(ctx.author.id)
                 if not user:
-                    await interaction.followup.send("❌ You haven't used the bot yet!", ephemeral=True)
+                    await ctx.followup.send("❌ You haven't used the bot yet!", ephemeral=True)
                     return
                 
                 # Get sent and received gifts
                 sent_gifts = Gift.query.filter_by(sender_id=user.id).order_by(Gift.created_at.desc()).limit(10).all()
                 received_gifts = Gift.query.filter_by(recipient_id=user.id).order_by(Gift.created_at.desc()).limit(10).all()
             
-            embed = discord.Embed(
-                title="🎁 Your Gift History",
-                color=0x0099ff,
-                timestamp=datetime.utcnow()
-            )
-            
-            # Sent gifts
-            if sent_gifts:
-                sent_text = ""
-                for gift in sent_gifts[:5]:  # Show last 5
-                    recipient_name = gift.recipient.username if gift.recipient else "Unknown"
-                    sent_text += f"• **{gift.amount:,}** coins to **{recipient_name}**\n"
-                    if gift.message:
-                        sent_text += f"  💬 _{gift.message}_\n"
-                    sent_text += f"  📅 {gift.created_at.strftime('%m/%d/%Y')}\n\n"
-                
-                embed.add_field(
-                    name="📤 Recently Sent",
-                    value=sent_text or "No gifts sent yet",
-                    inline=False
+                embed = discord.Embed(
+                    title="🎁 Your Gift History",
+                    color=0x0099ff,
+                    timestamp=datetime.utcnow()
                 )
             
-            # Received gifts
-            if received_gifts:
-                received_text = ""
-                for gift in received_gifts[:5]:  # Show last 5
-                    sender_name = gift.sender.username if gift.sender else "Admin"
-                    received_text += f"• **{gift.amount:,}** coins from **{sender_name}**\n"
-                    if gift.message:
-                        received_text += f"  💬 _{gift.message}_\n"
-                    received_text += f"  📅 {gift.created_at.strftime('%m/%d/%Y')}\n\n"
+                # Sent gifts
+                if sent_gifts:
+                    sent_text = ""
+                    for gift in sent_gifts[:5]:  # Show last 5
+                        recipient_name = gift.recipient.username if gift.recipient else "Unknown"
+                        sent_text += f"• **{gift.amount:,}** coins to **{recipient_name}**\n"
+                        if gift.message:
+                            sent_text += f"  💬 _{gift.message}_\n"
+                        sent_text += f"  📅 {gift.created_at.strftime('%m/%d/%Y')}\n\n"
+                
+                    embed.add_field(
+                        name="📤 Recently Sent",
+                        value=sent_text or "No gifts sent yet",
+                        inline=False
+                    )
+            
+                # Received gifts
+                if received_gifts:
+                    received_text = ""
+                    for gift in received_gifts[:5]:  # Show last 5
+                        sender_name = gift.sender.username if gift.sender else "Admin"
+                        received_text += f"• **{gift.amount:,}** coins from **{sender_name}**\n"
+                        if gift.message:
+                            received_text += f"  💬 _{gift.message}_\n"
+                        received_text += f"  📅 {gift.created_at.strftime('%m/%d/%Y')}\n\n"
                 
+                    embed.add_field(
+                        name="📥 Recently Received",
+                        value=received_text or "No gifts received yet",
+                        inline=False
+                    )
+            
+                # Statistics
+                total_sent = sum(gift.amount for gift in sent_gifts)
+                total_received = sum(gift.amount for gift in received_gifts)
+            
                 embed.add_field(
-                    name="📥 Recently Received",
-                    value=received_text or "No gifts received yet",
+                    name="📊 Statistics",
+                    value=f"**Sent:** {len(sent_gifts)} gifts ({total_sent:,} coins)\n**Received:** {len(received_gifts)} gifts ({total_received:,} coins)",
                     inline=False
                 )
             
-            # Statistics
-            total_sent = sum(gift.amount for gift in sent_gifts)
-            total_received = sum(gift.amount for gift in received_gifts)
-            
-            embed.add_field(
-                name="📊 Statistics",
-                value=f"**Sent:** {len(sent_gifts)} gifts ({total_sent:,} coins)\n**Received:** {len(received_gifts)} gifts ({total_received:,} coins)",
-                inline=False
-            )
-            
-            embed.set_footer(text=f"Current Balance: {user.coins:,} coins")
+                embed.set_footer(text=f"Current Balance: {user.coins:,} coins")
             
-            await interaction.followup.send(embed=embed, ephemeral=True)
+            await ctx.followup.send(embed=embed, ephemeral=True)
             
         except Exception as e:
             logger.error(f"Error in gift history command: {e}")
-            await interaction.followup.send("❌ An error occurred while fetching gift history.", ephemeral=True)
+            await ctx.followup.send("❌ An error occurred while fetching gift history.", ephemeral=True)
 
-    @app_commands.command(name="leaderboard", description="View the top coin holders and gift givers")
-    async def leaderboard(self, interaction: discord.Interaction):
+    @discord.slash_command(name="leaderboard", description="View the top coin holders and gift givers")
+    async def leaderboard(self, ctx: discord.ApplicationContext):
         """Show leaderboards for coins and gifts"""
         if not self.bot.app:
-            await interaction.response.send_message("❌ Bot is not properly configured.", ephemeral=True)
+            await ctx.respond("❌ Bot is not properly configured.", ephemeral=True)
             return
             
         try:
-            await interaction.response.defer()
+            await ctx.defer()
             
             with self.bot.app.app_context():
                 from src.models.database import db, User, Gift
@@ -311,12 +325,12 @@ class GiftCommands(commands.Cog):
                     inline=True
                 )
             
-            await interaction.followup.send(embed=embed)
+            await ctx.followup.send(embed=embed)
             
         except Exception as e:
             logger.error(f"Error in leaderboard command: {e}")
-            await interaction.followup.send("❌ An error occurred while fetching leaderboards.", ephemeral=True)
+            await ctx.followup.send("❌ An error occurred while fetching leaderboards.", ephemeral=True)
 
-async def setup(bot):
-    await bot.add_cog(GiftCommands(bot))
+def setup(bot):
+    bot.add_cog(GiftCommands(bot))
 
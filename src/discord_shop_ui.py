@@ -206,7 +206,7 @@ class ShopView(discord.ui.View):
             with self.bot.app.app_context():
                 from src.models.database import User
                 
-                user = User.query.filter_by(discord_id=str(interaction.user.id)).first()
+                user = User.by_discord_id(interaction.user.id)
                 
                 if not user:
                     await interaction.response.send_message(
@@ -278,7 +278,7 @@ class QuickBuyModal(discord.ui.Modal):
                 from src.models.database import db, User, Item, Purchase, Transaction
                 
                 # Get user
-                user = User.query.filter_by(discord_id=str(interaction.user.id)).first()
+                user = User.by_discord_id(interaction.user.id)
                 if not user:
                     await interaction.response.send_message(
                         "❌ You don't have an account yet! Send a message to create one.",
@@ -315,6 +315,9 @@ class QuickBuyModal(discord.ui.Modal):
                     status='pending'
                 )
                 
+                db.session.add(purchase)
+                db.session.flush()  # Get the ID
+                
                 # Create transaction record
                 transaction = Transaction(
                     user_id=user.id,
@@ -324,7 +327,6 @@ class QuickBuyModal(discord.ui.Modal):
                     reference_id=f'purchase_{purchase.id}'
                 )
                 
-                db.session.add(purchase)
                 db.session.add(transaction)
                 db.session.commit()
                 
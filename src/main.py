@@ -1,8 +1,14 @@
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
+from flask_compress import Compress
 import os
+import asyncio
+import sqlite3
 import threading
 from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import NullPool
 
 # Load environment variables
 load_dotenv()
@@ -17,126 +23,258 @@ from src.routes.bot_config import bot_config_bp
 from src.routes.gifts import gifts_bp
 from src.routes.audit import audit_bp
 from src.routes.servers import servers_bp
+from src.tasks import celery_init_app, optimize_database
+from src.responses import OrjsonProvider
 
-# Create Flask app
-app = Flask(__name__, static_folder='static')
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every new SQLite connection for concurrent reads and cheap commits"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    
+    # WAL lets readers run alongside the writer; NORMAL skips the fsync per commit
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
 
-# Enable CORS
-CORS(app)
+def engine_options(database_uri):
+    """
+    Build SQLALCHEMY_ENGINE_OPTIONS for the configured database
+    
+    File-backed SQLite opens a fresh connection per checkout (WAL makes that
+    cheap) so threads never wait on a pooled handle; other backends get a
+    pre-pinged QueuePool sized to the web worker concurrency.
+    """
+    # Room for every statement shape the routes issue, so repeat requests
+    # reuse compiled SQL instead of recompiling it
+    options = {'query_cache_size': 1200}
+    url = make_url(database_uri)
+    
+    if url.get_backend_name() == 'sqlite':
+        # In-memory databases must keep Flask-SQLAlchemy's single shared connection
+        if url.database and url.database != ':memory:':
+            options['poolclass'] = NullPool
+            options['connect_args'] = {'check_same_thread': False, 'timeout': 30}
+        return options
+    
+    concurrency = int(os.getenv('WEB_CONCURRENCY', 1)) * int(os.getenv('WEB_THREADS', 1))
+    options.update(
+        pool_size=max(10, concurrency),
+        max_overflow=20,
+        pool_pre_ping=True,
+        pool_recycle=1800
+    )
+    return options
 
-# Configuration
-app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///database/app.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+def create_app():
+    """Create and configure the Flask application"""
+    app = Flask(__name__, static_folder='static')
+    
+    # Enable CORS
+    CORS(app)
+    
+    # Configuration
+    app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///database/app.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # List endpoints skip COUNT(*) unless asked; set true for clients that need totals
+    app.config['LIST_INCLUDE_TOTAL'] = os.getenv('LIST_INCLUDE_TOTAL', 'false').lower() == 'true'
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    # Background jobs (purchase fulfillment); unset runs them inline
+    app.config['CELERY_BROKER_URL'] = os.getenv('CELERY_BROKER_URL', os.getenv('REDIS_URL'))
+    
+    # Compress JSON bodies for clients that accept it; repeated keys make list
+    # responses shrink ~10x, and zstd at level 3 is cheap to produce
+    app.config['COMPRESS_ALGORITHM'] = ['zstd', 'br', 'gzip']
+    app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/html', 'text/css', 'application/javascript']
+    app.config['COMPRESS_MIN_SIZE'] = 500
+    app.config['COMPRESS_LEVEL'] = 3
+    app.config['COMPRESS_BR_LEVEL'] = 3
+    app.config['COMPRESS_ZSTD_LEVEL'] = 3
+    Compress(app)
+    
+    # jsonify() encodes with orjson
+    app.json = OrjsonProvider(app)
+    
+    # Register blueprints
+    app.register_blueprint(api_bp, url_prefix='/api')
+    app.register_blueprint(admin_bp, url_prefix='/admin')
+    app.register_blueprint(payments_bp, url_prefix='/payments')
+    app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.register_blueprint(bot_config_bp, url_prefix='/api')
+    app.register_blueprint(gifts_bp, url_prefix='/api')
+    app.register_blueprint(audit_bp, url_prefix='/api')
+    app.register_blueprint(servers_bp, url_prefix='/api')
+    
+    app.add_url_rule('/', 'index', index)
+    app.add_url_rule('/health', 'health', health)
+    
+    # Initialize database
+    db.init_app(app)
+    celery_init_app(app)
+    
+    # Production deployments seed once with `flask seed` instead of on every boot
+    app.cli.command('seed')(seed_command)
+    app.cli.command('partition-audit-logs')(partition_audit_logs_command)
+    app.cli.command('rebuild-audit-rollup')(rebuild_audit_rollup_command)
+    app.cli.command('upgrade-server-status')(upgrade_server_status_command)
+    app.cli.command('upgrade-indexes')(upgrade_indexes_command)
+    
+    return app
 
-# Register blueprints
-app.register_blueprint(api_bp, url_prefix='/api')
-app.register_blueprint(admin_bp, url_prefix='/admin')
-app.register_blueprint(payments_bp, url_prefix='/payments')
-app.register_blueprint(auth_bp, url_prefix='/auth')
-app.register_blueprint(bot_config_bp, url_prefix='/api')
-app.register_blueprint(gifts_bp, url_prefix='/api')
-app.register_blueprint(audit_bp, url_prefix='/api')
-app.register_blueprint(servers_bp, url_prefix='/api')
+def index():
+    """Basic index page"""
+    return "Discord Bot Ecosystem API is running! Check /api endpoints for API access."
 
-# Initialize database
-db.init_app(app)
+def health():
+    """Health check endpoint"""
+    return {"status": "healthy", "message": "Discord Bot Ecosystem is running"}
+
+def seed_command():
+    """Create tables and seed default data."""
+    seed_database()
+
+def partition_audit_logs_command():
+    """Convert audit_logs to monthly range partitions (PostgreSQL only)."""
+    from src.audit_partitions import partition_audit_logs
+    partition_audit_logs()
+
+def rebuild_audit_rollup_command():
+    """Install the audit hourly rollup trigger and recount existing logs."""
+    from src.audit_rollup import rebuild_audit_rollup
+    rebuild_audit_rollup()
+
+def upgrade_server_status_command():
+    """Move server_status from the DateTime timestamp column to timestamp_ms."""
+    from src.schema_upgrade import upgrade_server_status
+    upgrade_server_status()
+
+def upgrade_indexes_command():
+    """Create declared indexes that existing tables are missing."""
+    from src.schema_upgrade import upgrade_indexes
+    upgrade_indexes()
 
 # Initialize database
 def init_database():
     """Initialize database with default data"""
     with app.app_context():
-        # Create all tables
-        db.create_all()
-        
-        # Initialize default configuration if not exists
-        from src.models.database import BotConfig, Item, MinecraftServer
-        
-        # Default bot configuration
-        default_configs = [
-            ('coins_per_message', '1', 'Coins earned per message'),
-            ('message_cooldown', '60', 'Cooldown between coin earnings (seconds)'),
-            ('max_daily_coins', '100', 'Maximum coins per day from messages'),
-            ('welcome_message', 'Welcome to the server! You can earn coins by chatting and use them to buy items!', 'Bot welcome message'),
-            ('purchase_channel', '', 'Channel ID for purchase notifications'),
-            ('status_update_interval', '300', 'Server status update interval (seconds)'),
-        ]
-        
-        for key, value, description in default_configs:
-            if not BotConfig.query.filter_by(key=key).first():
-                config = BotConfig(key=key, value=value, description=description)
-                db.session.add(config)
-        
-        # Default items
-        default_items = [
-            ('Diamond Sword', 'A sharp diamond sword', 50, 'weapons', 'minecraft', None, 'give {username} diamond_sword 1'),
-            ('Iron Armor Set', 'Full set of iron armor', 100, 'armor', 'minecraft', None, 'give {username} iron_helmet 1; give {username} iron_chestplate 1; give {username} iron_leggings 1; give {username} iron_boots 1'),
-            ('VIP Rank', 'VIP rank with special permissions', 500, 'ranks', 'minecraft', None, 'lp user {username} parent set vip'),
-            ('Premium Rank', 'Premium rank with exclusive perks', 1000, 'ranks', 'minecraft', None, 'lp user {username} parent set premium'),
-            ('Stack of Diamonds', '64 diamonds', 200, 'resources', 'minecraft', None, 'give {username} diamond 64'),
-            ('Enchanted Book (Sharpness V)', 'Book with Sharpness V enchantment', 150, 'enchantments', 'minecraft', None, 'give {username} enchanted_book{StoredEnchantments:[{id:sharpness,lvl:5}]} 1'),
-        ]
-        
-        for name, description, price, category, item_type, discord_role_id, command_template in default_items:
-            if not Item.query.filter_by(name=name).first():
-                item = Item(
-                    name=name,
-                    description=description,
-                    price=price,
-                    category=category,
-                    item_type=item_type,
-                    discord_role_id=discord_role_id,
-                    minecraft_command_template=command_template,
-                    is_available=True
-                )
-                db.session.add(item)
-        
-        # Default Minecraft server
-        if not MinecraftServer.query.first():
-            server = MinecraftServer(
-                name='Main Server',
-                host=os.getenv('MINECRAFT_SERVER_HOST', 'localhost'),
-                port=int(os.getenv('MINECRAFT_SERVER_PORT', 25565)),
-                rcon_host=os.getenv('MINECRAFT_RCON_HOST', 'localhost'),
-                rcon_port=int(os.getenv('MINECRAFT_RCON_PORT', 25575)),
-                rcon_password=os.getenv('MINECRAFT_RCON_PASSWORD', ''),
-                is_active=True
+        seed_database()
+        # Planner statistics; celery beat refreshes them daily after this
+        optimize_database()
+
+def seed_database():
+    """Create tables and insert default data (requires an app context)"""
+    # Create all tables
+    db.create_all()
+    
+    # Initialize default configuration if not exists
+    from src.models.database import BotConfig, Item, MinecraftServer
+    
+    # Fast path: an already-seeded database has at least one config row
+    if db.session.query(BotConfig.id).limit(1).scalar() is not None:
+        return
+    
+    # Default bot configuration
+    default_configs = [
+        ('coins_per_message', '1', 'Coins earned per message'),
+        ('message_cooldown', '60', 'Cooldown between coin earnings (seconds)'),
+        ('max_daily_coins', '100', 'Maximum coins per day from messages'),
+        ('welcome_message', 'Welcome to the server! You can earn coins by chatting and use them to buy items!', 'Bot welcome message'),
+        ('purchase_channel', '', 'Channel ID for purchase notifications'),
+        ('status_update_interval', '300', 'Server status update interval (seconds)'),
+    ]
+    
+    for key, value, description in default_configs:
+        if not db.session.query(db.exists().where(BotConfig.key == key)).scalar():
+            config = BotConfig(key=key, value=value, description=description)
+            db.session.add(config)
+    
+    # Default items
+    default_items = [
+        ('Diamond Sword', 'A sharp diamond sword', 50, 'weapons', 'minecraft', None, 'give {username} diamond_sword 1'),
+        ('Iron Armor Set', 'Full set of iron armor', 100, 'armor', 'minecraft', None, 'give {username} iron_helmet 1; give {username} iron_chestplate 1; give {username} iron_leggings 1; give {username} iron_boots 1'),
+        ('VIP Rank', 'VIP rank with special permissions', 500, 'ranks', 'minecraft', None, 'lp user {username} parent set vip'),
+        ('Premium Rank', 'Premium rank with exclusive perks', 1000, 'ranks', 'minecraft', None, 'lp user {username} parent set premium'),
+        ('Stack of Diamonds', '64 diamonds', 200, 'resources', 'minecraft', None, 'give {username} diamond 64'),
+        ('Enchanted Book (Sharpness V)', 'Book with Sharpness V enchantment', 150, 'enchantments', 'minecraft', None, 'give {username} enchanted_book{StoredEnchantments:[{id:sharpness,lvl:5}]} 1'),
+    ]
+    
+    for name, description, price, category, item_type, discord_role_id, command_template in default_items:
+        if not db.session.query(db.exists().where(Item.name == name)).scalar():
+            item = Item(
+                name=name,
+                description=description,
+                price=price,
+                category=category,
+                item_type=item_type,
+                discord_role_id=discord_role_id,
+                minecraft_command_template=command_template,
+                is_available=True
             )
-            db.session.add(server)
-        
-        try:
-            db.session.commit()
-            print("Database initialized successfully!")
-        except Exception as e:
-            db.session.rollback()
-            print(f"Error initializing database: {e}")
-
-@app.route('/')
-def index():
-    """Basic index page"""
-    return "Discord Bot Ecosystem API is running! Check /api endpoints for API access."
+            db.session.add(item)
+    
+    # Default Minecraft server
+    if not db.session.query(MinecraftServer.query.exists()).scalar():
+        server = MinecraftServer(
+            name='Main Server',
+            host=os.getenv('MINECRAFT_SERVER_HOST', 'localhost'),
+            port=int(os.getenv('MINECRAFT_SERVER_PORT', 25565)),
+            rcon_host=os.getenv('MINECRAFT_RCON_HOST', 'localhost'),
+            rcon_port=int(os.getenv('MINECRAFT_RCON_PORT', 25575)),
+            rcon_password=os.getenv('MINECRAFT_RCON_PASSWORD', ''),
+            is_active=True
+        )
+        db.session.add(server)
+    
+    try:
+        db.session.commit()
+        print("Database initialized successfully!")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error initializing database: {e}")
 
-@app.route('/health')
-def health():
-    """Health check endpoint"""
-    return {"status": "healthy", "message": "Discord Bot Ecosystem is running"}
+# Event loop owned by the Discord bot thread; other threads can schedule
+# coroutines on it with asyncio.run_coroutine_threadsafe(coro, bot_loop)
+bot_loop = None
 
 def start_discord_bot():
     """Start Discord bot in a separate thread"""
+    global bot_loop
+    
+    # Pin a dedicated event loop to this thread before the bot module is
+    # imported so the bot binds to it rather than the main thread's loop
+    bot_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(bot_loop)
+    
     try:
         from src.discord_bot_slash import run_bot
-        run_bot(app)
+        run_bot(app, loop=bot_loop)
     except Exception as e:
         print(f"Error starting Discord bot: {e}")
 
+# Application singleton shared by the bot thread, scripts and WSGI servers
+# (gunicorn --preload imports this once and forks workers from it)
+app = create_app()
+
+# Worker entry point: celery -A src.main.celery_app worker
+celery_app = app.extensions['celery']
+
 if __name__ == '__main__':
-    # Initialize database
-    init_database()
+    debug = os.getenv('FLASK_DEBUG', 'true').lower() == 'true'
     
-    # Start Discord bot in background thread
-    bot_thread = threading.Thread(target=start_discord_bot, daemon=True)
-    bot_thread.start()
+    # With debug on, the reloader re-executes this script in a child process.
+    # Only the serving child seeds the database and starts the bot, otherwise
+    # two bot instances would connect to the gateway.
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Initialize database
+        init_database()
+        
+        # Start Discord bot in background thread
+        bot_thread = threading.Thread(target=start_discord_bot, daemon=True)
+        bot_thread.start()
     
     # Start Flask app
-    app.run(host='0.0.0.0', port=5000, debug=True)
-
+    app.run(host='0.0.0.0', port=5000, debug=debug)
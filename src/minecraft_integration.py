@@ -1,15 +1,153 @@
 import asyncio
+import concurrent.futures
+import contextlib
+import functools
 import logging
-from typing import Dict, Optional, Any
+import re
+import select
+import socket
+import string
+import threading
+from typing import Dict, List, Optional, Tuple, Any
 from mcstatus import JavaServer
 from mcrcon import MCRcon
 import os
+import time
 from dotenv import load_dotenv
 from datetime import datetime
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared event loop, starting its thread on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='minecraft-loop', daemon=True).start()
+        return _loop
+
+def run_coroutine(coro, timeout: Optional[float] = 30.0):
+    """
+    Run a coroutine on the shared background event loop from synchronous code
+    
+    Flask views use this instead of ``asyncio.run`` so a loop is not created and
+    torn down on every request.
+    
+    Args:
+        coro: Coroutine to run
+        timeout: Seconds to wait for the result, or None to wait indefinitely
+        
+    Returns:
+        The coroutine's result
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, _background_loop())
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
+# Placeholders supported in item command templates, e.g. 'give {username} diamond 1'
+_PLACEHOLDER_RE = re.compile(r'\{(username|discord_id|minecraft_uuid)\}')
+
+@functools.lru_cache(maxsize=512)
+def split_command_template(template: Optional[str]) -> Tuple[str, ...]:
+    """
+    Split a ';'-separated command template into individual command templates
+    
+    Cached per template string, so repeat purchases of an item skip the split.
+    
+    Args:
+        template: Raw template as stored on the item
+        
+    Returns:
+        Tuple of non-empty command templates
+    """
+    if not template:
+        return ()
+    return tuple(command.strip() for command in template.split(';') if command.strip())
+
+@functools.lru_cache(maxsize=512)
+def _compile_command_template(template: str) -> string.Template:
+    """Compile a '{placeholder}' command template into a cached string.Template"""
+    # Only known placeholders are substituted; other braces (NBT data such as
+    # enchanted_book{StoredEnchantments:[...]}) are left untouched.
+    escaped = template.replace('$', '$$')
+    return string.Template(_PLACEHOLDER_RE.sub(r'${\1}', escaped))
+
+def render_command(template: str, **values: str) -> str:
+    """
+    Render a single command template
+    
+    Args:
+        template: Command template containing '{username}'-style placeholders
+        **values: Placeholder values
+        
+    Returns:
+        The command ready to be sent over RCON
+    """
+    return _compile_command_template(template).safe_substitute(values)
+
+def render_item_commands(item, **values: str) -> List[str]:
+    """
+    Render every command an item runs on purchase
+    
+    Args:
+        item: Item model instance
+        **values: Placeholder values
+        
+    Returns:
+        List of rendered commands
+    """
+    return [render_command(template, **values) for template in split_command_template(item.minecraft_command_template)]
+
+class _RconClient(MCRcon):
+    """
+    MCRcon client that is safe to use from worker threads
+    
+    MCRcon installs a SIGALRM handler in __init__ and arms alarm() around each
+    read, which raises ValueError outside the main thread; RCON calls run in
+    asyncio.to_thread workers. This client uses a socket timeout instead, and
+    treats an empty read as a closed connection rather than spinning on recv().
+    """
+    
+    def __init__(self, host: str, password: str, port: int = 25575, timeout: float = 5):
+        self.host = host
+        self.password = password
+        self.port = port
+        self.tlsmode = 0
+        self.timeout = timeout
+        
+    def connect(self):
+        self.socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._send(3, self.password)
+        
+    def _read(self, length: int) -> bytes:
+        data = b""
+        while len(data) < length:
+            chunk = self.socket.recv(length - len(data))
+            if not chunk:
+                raise ConnectionError("RCON connection closed by server")
+            data += chunk
+        return data
+        
+    def is_alive(self) -> bool:
+        """Return whether the connection is still open, without blocking"""
+        if self.socket is None:
+            return False
+        try:
+            # An idle session has nothing to read, so readable means EOF or an error
+            if not select.select([self.socket], [], [], 0)[0]:
+                return True
+            return self.socket.recv(1, socket.MSG_PEEK) != b""
+        except OSError:
+            return False
+
 class MinecraftIntegration:
     """Handle Minecraft server integration including status checking and RCON commands"""
     
@@ -19,6 +157,68 @@ class MinecraftIntegration:
         self.default_rcon_host = os.getenv('MINECRAFT_RCON_HOST', 'localhost')
         self.default_rcon_port = int(os.getenv('MINECRAFT_RCON_PORT', 25575))
         self.default_rcon_password = os.getenv('MINECRAFT_RCON_PASSWORD', '')
+        # Pause after a failed command in a batch, doubled per consecutive failure
+        self.rcon_command_gap = int(os.getenv('RCON_COMMAND_GAP_MS', 0)) / 1000
+        self._servers: Dict[Tuple[str, int], JavaServer] = {}
+        self._rcon_clients: Dict[Tuple[str, int], _RconClient] = {}
+        self._rcon_locks: Dict[Tuple[str, int], threading.Lock] = {}
+        # host -> (expires_at, address), so reconnects skip the resolver
+        self._dns_cache: Dict[str, Tuple[float, str]] = {}
+        self.dns_ttl = int(os.getenv('RCON_DNS_TTL', 60))
+        
+    def _server(self, host: str, port: int) -> JavaServer:
+        """Return the cached JavaServer for host:port, looking it up on first use"""
+        server = self._servers.get((host, port))
+        if server is None:
+            server = JavaServer.lookup(f"{host}:{port}")
+            self._servers[(host, port)] = server
+        return server
+        
+    def _resolve(self, host: str) -> str:
+        """Resolve host to an IPv4 address, caching the answer for dns_ttl seconds"""
+        now = time.monotonic()
+        cached = self._dns_cache.get(host)
+        if cached and cached[0] > now:
+            return cached[1]
+        
+        try:
+            address = socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+        except OSError as e:
+            # Let the connect attempt surface the real error
+            logger.warning(f"Could not resolve RCON host {host}: {e}")
+            return host
+        
+        self._dns_cache[host] = (now + self.dns_ttl, address)
+        return address
+        
+    @contextlib.contextmanager
+    def _rcon(self, host: str, port: int, password: str):
+        """
+        Yield a connected RCON client for host:port, reusing the cached session
+        
+        A cached client the server has since closed (e.g. after a restart) is
+        replaced before use. The client is disconnected and dropped from the
+        cache if the caller raises, so the next command opens a fresh connection.
+        """
+        key = (host, port)
+        with self._rcon_locks.setdefault(key, threading.Lock()):
+            client = self._rcon_clients.get(key)
+            if client is None or client.password != password or not client.is_alive():
+                if client is not None:
+                    client.disconnect()
+                client = _RconClient(self._resolve(host), password, port)
+                try:
+                    client.connect()
+                except Exception:
+                    client.disconnect()
+                    raise
+                self._rcon_clients[key] = client
+            try:
+                yield client
+            except Exception:
+                client.disconnect()
+                self._rcon_clients.pop(key, None)
+                raise
         
     async def get_server_status(self, host: str = None, port: int = None) -> Dict[str, Any]:
         """
@@ -35,8 +235,8 @@ class MinecraftIntegration:
         port = port or self.default_port
         
         try:
-            # Create server instance
-            server = JavaServer.lookup(f"{host}:{port}")
+            # Reuse the resolved server instance
+            server = self._server(host, port)
             
             # Get server status with timeout
             status = await asyncio.wait_for(
@@ -72,6 +272,18 @@ class MinecraftIntegration:
                 'port': port
             }
             
+    async def get_servers_status(self, addresses: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+        """
+        Check several Minecraft servers concurrently
+        
+        Args:
+            addresses: (host, port) pairs to check
+            
+        Returns:
+            Status dictionaries in the same order as addresses
+        """
+        return list(await asyncio.gather(*(self.get_server_status(host, port) for host, port in addresses)))
+        
     async def get_server_players(self, host: str = None, port: int = None) -> Dict[str, Any]:
         """
         Get detailed player information from a Minecraft server
@@ -87,7 +299,7 @@ class MinecraftIntegration:
         port = port or self.default_port
         
         try:
-            server = JavaServer.lookup(f"{host}:{port}")
+            server = self._server(host, port)
             
             # Get server query (more detailed info)
             query = await asyncio.wait_for(
@@ -176,32 +388,108 @@ class MinecraftIntegration:
         Returns:
             Command response string
         """
-        with MCRcon(host, password, port) as mcr:
-            response = mcr.command(command)
-            return response
+        with self._rcon(host, port, password) as mcr:
+            return mcr.command(command)
             
-    async def execute_multiple_commands(self, commands: list, rcon_host: str = None, rcon_port: int = None, rcon_password: str = None) -> Dict[str, bool]:
+    async def execute_multiple_commands(self, commands: list, rcon_host: str = None, rcon_port: int = None, rcon_password: str = None, timeout: float = 30.0) -> Dict[str, Optional[bool]]:
         """
-        Execute multiple commands on the Minecraft server
+        Execute multiple commands on the Minecraft server over a single RCON connection
+        
+        On timeout the commands not yet sent are cancelled, so nothing runs
+        after this returns. The command that was in flight may or may not have
+        reached the server and is reported as None.
         
         Args:
             commands: List of commands to execute
             rcon_host: RCON hostname (defaults to configured host)
             rcon_port: RCON port (defaults to configured port)
             rcon_password: RCON password (defaults to configured password)
+            timeout: Seconds to wait for the whole batch
             
         Returns:
-            Dictionary mapping commands to their success status
+            Dictionary mapping commands to their success status, or None when unknown
         """
-        results = {}
+        rcon_host = rcon_host or self.default_rcon_host
+        rcon_port = rcon_port or self.default_rcon_port
+        rcon_password = rcon_password or self.default_rcon_password
         
-        for command in commands:
-            success = await self.execute_command(command, rcon_host, rcon_port, rcon_password)
-            results[command] = success
+        results = {command: False for command in commands}
+        
+        if not commands:
+            return results
+        
+        if not rcon_password:
+            logger.error("RCON password not configured")
+            return results
+        
+        cancel = threading.Event()
+        progress_lock = threading.Lock()
+            
+        try:
+            await asyncio.wait_for(
+                asyncio.to_thread(
+                    self._execute_rcon_commands, commands, rcon_host, rcon_port, rcon_password,
+                    results, cancel, progress_lock
+                ),
+                timeout=timeout
+            )
+            
+        except asyncio.TimeoutError:
+            # Stop the worker before the next command and report where it got to
+            with progress_lock:
+                cancel.set()
+                results = dict(results)
+            unknown = [command for command, ok in results.items() if ok is None]
+            logger.error(f"Timeout while executing RCON commands: {commands}; outcome unknown for {unknown}")
+        except Exception as e:
+            logger.error(f"Error executing RCON commands {commands}: {e}")
             
-            # Small delay between commands to avoid overwhelming the server
-            await asyncio.sleep(0.1)
+        return results
+        
+    def _execute_rcon_commands(self, commands: list, host: str, port: int, password: str,
+                               results: Dict[str, Optional[bool]], cancel: threading.Event,
+                               progress_lock: threading.Lock) -> Dict[str, Optional[bool]]:
+        """
+        Execute several RCON commands synchronously on the cached connection (to be run in thread)
+        
+        Args:
+            commands: Commands to execute, in order
+            host: RCON hostname
+            port: RCON port
+            password: RCON password
+            results: Filled in as commands finish; None marks the one in flight
+            cancel: Once set, no further command is sent
+            progress_lock: Guards the cancel check against the caller's snapshot
             
+        Returns:
+            Dictionary mapping commands to their success status
+        """
+        failures = 0
+        
+        for command in commands:
+            with progress_lock:
+                if cancel.is_set():
+                    break
+                results[command] = None
+            try:
+                with self._rcon(host, port, password) as mcr:
+                    response = mcr.command(command)
+                logger.info(f"RCON command executed successfully: {command}")
+                logger.debug(f"RCON response: {response}")
+                ok = True
+                failures = 0
+            except Exception as e:
+                logger.error(f"Error executing RCON command '{command}': {e}")
+                ok = False
+                
+                # Back off only when the server is struggling
+                if self.rcon_command_gap and not cancel.is_set():
+                    time.sleep(self.rcon_command_gap * (2 ** failures))
+                failures += 1
+            
+            with progress_lock:
+                results[command] = ok
+                    
         return results
         
     async def give_item_to_player(self, player: str, item: str, amount: int = 1, rcon_host: str = None, rcon_port: int = None, rcon_password: str = None) -> bool:
@@ -295,6 +583,9 @@ class MinecraftIntegration:
             
             servers = MinecraftServer.query.all()
             
+            # One scan time shared by every server in this pass
+            now = datetime.utcnow()
+            
             for server in servers:
                 try:
                     status = await self.get_server_status(server.host, server.port)
@@ -305,7 +596,7 @@ class MinecraftIntegration:
                     server.max_players = status.get('max_players', 0)
                     server.version = status.get('version', '')
                     server.latency = status.get('latency', 0)
-                    server.last_checked = datetime.utcnow()
+                    server.last_checked = now
                     
                     if not status['online']:
                         server.error_message = status.get('error', 'Unknown error')
@@ -316,7 +607,7 @@ class MinecraftIntegration:
                     logger.error(f"Error updating status for server {server.name}: {e}")
                     server.is_online = False
                     server.error_message = str(e)
-                    server.last_checked = datetime.utcnow()
+                    server.last_checked = now
             
             db.session.commit()
             
@@ -336,23 +627,28 @@ class MinecraftIntegration:
             'errors': []
         }
         
-        # Test server status
-        try:
-            status = await self.get_server_status(host, port)
+        # Both probes use independent sockets, so run them concurrently
+        status, rcon_success = await asyncio.gather(
+            self.get_server_status(host, port),
+            self.execute_command("list", rcon_host, rcon_port, rcon_password),
+            return_exceptions=True
+        )
+        
+        # Server status result
+        if isinstance(status, Exception):
+            results['errors'].append(f"Server status test failed: {status}")
+        else:
             results['server_status'] = status['online']
             if not status['online']:
                 results['errors'].append(f"Server status error: {status.get('error', 'Unknown')}")
-        except Exception as e:
-            results['errors'].append(f"Server status test failed: {e}")
             
-        # Test RCON connection
-        try:
-            rcon_success = await self.execute_command("list", rcon_host, rcon_port, rcon_password)
+        # RCON connection result
+        if isinstance(rcon_success, Exception):
+            results['errors'].append(f"RCON test failed: {rcon_success}")
+        else:
             results['rcon_connection'] = rcon_success
             if not rcon_success:
                 results['errors'].append("RCON command execution failed")
-        except Exception as e:
-            results['errors'].append(f"RCON test failed: {e}")
             
         return results
 
@@ -1,15 +1,81 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from sqlalchemy import CheckConstraint
-import json
+from sqlalchemy import CheckConstraint, DDL, event, select
+import time
 
 db = SQLAlchemy()
 
-class User(db.Model):
+def _iso(value):
+    """Format an optional datetime as ISO 8601"""
+    return value.isoformat() if value else None
+
+def _epoch_ms():
+    """Current UTC time as integer milliseconds since the epoch"""
+    return int(time.time() * 1000)
+
+def _dict_factory(fields, datetime_fields=(), extra=()):
+    """
+    Build a to_dict function for a fixed tuple of attribute names
+    
+    The function is compiled from a dict literal (``{'id': obj.id, ...}``)
+    so each call is one BUILD_MAP with no per-field loop. It works on ORM
+    instances and on Core rows selected with the same column names.
+    
+    Args:
+        fields: Attribute names, in output order
+        datetime_fields: Subset of fields rendered with isoformat()
+        extra: Names of additional positional arguments whose values are
+            placed in the dict under the same keys, after the fields
+        
+    Returns:
+        Function mapping an object (and any extra values) to a dict
+    """
+    items = ', '.join(
+        [f"{field!r}: _iso(obj.{field})" if field in datetime_fields else f"{field!r}: obj.{field}"
+         for field in fields] +
+        [f"{name!r}: {name}" for name in extra]
+    )
+    params = ', '.join(('obj',) + tuple(extra))
+    namespace = {'_iso': _iso}
+    exec(f"def to_dict({params}):\n    return {{{items}}}", namespace)
+    
+    to_dict = namespace['to_dict']
+    to_dict.fields = fields
+    to_dict.datetime_fields = datetime_fields
+    return to_dict
+
+def upsert_insert(model):
+    """
+    INSERT construct supporting on_conflict_do_update for the active backend
+
+    SQLite and PostgreSQL share the ON CONFLICT syntax but SQLAlchemy exposes
+    it through dialect-specific insert() functions.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+class SerializerMixin:
+    """Bulk serialization helper shared by the models"""
+    
+    @classmethod
+    def rows_to_dicts(cls, rows):
+        """Serialize a list of instances or Core rows with cls.to_dict"""
+        to_dict = cls.to_dict
+        return [to_dict(row) for row in rows]
+    
+    @classmethod
+    def serialized_columns(cls):
+        """Mapped columns read by a factory-built to_dict, in output order"""
+        return tuple(getattr(cls, field) for field in cls.to_dict.fields)
+
+class User(SerializerMixin, db.Model):
     __tablename__ = 'users'
     
     id = db.Column(db.Integer, primary_key=True)
-    discord_id = db.Column(db.String(20), unique=True, nullable=False)
+    discord_id = db.Column(db.String(20), nullable=False)
     username = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(255))
     minecraft_uuid = db.Column(db.String(36))
@@ -20,30 +86,40 @@ class User(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     
     # Relationships
-    transactions = db.relationship('Transaction', backref='user', lazy=True, cascade='all, delete-orphan')
-    purchases = db.relationship('Purchase', backref='user', lazy=True, cascade='all, delete-orphan')
-    payment_records = db.relationship('PaymentRecord', backref='user', lazy=True, cascade='all, delete-orphan')
-    audit_logs = db.relationship('AuditLog', backref='user', lazy=True)
+    transactions = db.relationship('Transaction', back_populates='user', lazy='select', cascade='all, delete-orphan')
+    purchases = db.relationship('Purchase', back_populates='user', lazy='select', cascade='all, delete-orphan')
+    payment_records = db.relationship('PaymentRecord', back_populates='user', lazy='select', cascade='all, delete-orphan')
+    audit_logs = db.relationship('AuditLog', back_populates='user', lazy='select')
     
     __table_args__ = (
         CheckConstraint('coins >= 0', name='check_coins_non_negative'),
+        db.Index('ix_users_discord_id', 'discord_id', unique=True),
+        # Trigram indexes let PostgreSQL answer ILIKE '%term%' without a seq scan
+        db.Index('ix_users_username_trgm', 'username', postgresql_using='gin',
+                 postgresql_ops={'username': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_users_discord_id_trgm', 'discord_id', postgresql_using='gin',
+                 postgresql_ops={'discord_id': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
     )
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'discord_id': self.discord_id,
-            'username': self.username,
-            'email': self.email,
-            'minecraft_uuid': self.minecraft_uuid,
-            'coins': self.coins,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'is_admin': self.is_admin,
-            'is_active': self.is_active
-        }
+    to_dict = _dict_factory(
+        ('id', 'discord_id', 'username', 'email', 'minecraft_uuid', 'coins', 'created_at', 'updated_at', 'is_admin', 'is_active'),
+        ('created_at', 'updated_at')
+    )
+    
+    @classmethod
+    def by_discord_id(cls, discord_id):
+        """Look up a user by Discord ID through ix_users_discord_id"""
+        return db.session.execute(
+            select(cls).where(cls.discord_id == str(discord_id)).limit(1)
+        ).scalar_one_or_none()
 
-class Transaction(db.Model):
+event.listen(
+    User.__table__,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+class Transaction(SerializerMixin, db.Model):
     __tablename__ = 'transactions'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -55,26 +131,31 @@ class Transaction(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     reference_id = db.Column(db.String(100))
     
+    # Relationships
+    user = db.relationship('User', back_populates='transactions')
+    
     __table_args__ = (
         CheckConstraint("transaction_type IN ('earn', 'spend', 'purchase', 'admin_add', 'admin_remove', 'refund', 'gift_sent', 'gift_received')", 
                        name='check_transaction_type'),
         CheckConstraint("status IN ('pending', 'completed', 'failed', 'cancelled')", 
                        name='check_transaction_status'),
+        db.Index('ix_transactions_created_id', created_at.desc(), id.desc()),
+        # Per-user history, optionally narrowed by type, in listing order
+        db.Index('ix_transactions_user_type_created', 'user_id', 'transaction_type', created_at.desc(), id.desc()),
+        # One purchase/refund row per reference: a replayed payment webhook
+        # or refund cannot grant or deduct twice. Other ledger types are left
+        # out, and NULL references never collide.
+        db.Index('ix_transactions_reference_type', 'reference_id', 'transaction_type', unique=True,
+                 postgresql_where=transaction_type.in_(('purchase', 'refund')),
+                 sqlite_where=transaction_type.in_(('purchase', 'refund'))),
     )
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'transaction_type': self.transaction_type,
-            'amount': self.amount,
-            'description': self.description,
-            'status': self.status,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'reference_id': self.reference_id
-        }
+    to_dict = _dict_factory(
+        ('id', 'user_id', 'transaction_type', 'amount', 'description', 'status', 'created_at', 'reference_id'),
+        ('created_at',)
+    )
 
-class Item(db.Model):
+class Item(SerializerMixin, db.Model):
     __tablename__ = 'items'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -99,30 +180,19 @@ class Item(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
-    purchases = db.relationship('Purchase', backref='item', lazy=True)
+    purchases = db.relationship('Purchase', back_populates='item', lazy='select')
     
     __table_args__ = (
         CheckConstraint('price > 0', name='check_price_positive'),
         CheckConstraint("item_type IN ('discord', 'minecraft', 'both')", name='check_item_type'),
     )
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'price': self.price,
-            'category': self.category,
-            'item_type': self.item_type,
-            'discord_role_id': self.discord_role_id,
-            'minecraft_command_template': self.minecraft_command_template,
-            'image_url': self.image_url,
-            'is_available': self.is_available,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
+    to_dict = _dict_factory(
+        ('id', 'name', 'description', 'price', 'category', 'item_type', 'discord_role_id', 'minecraft_command_template', 'image_url', 'is_available', 'created_at', 'updated_at'),
+        ('created_at', 'updated_at')
+    )
 
-class Purchase(db.Model):
+class Purchase(SerializerMixin, db.Model):
     __tablename__ = 'purchases'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -136,60 +206,73 @@ class Purchase(db.Model):
     minecraft_command = db.Column(db.Text)
     discord_role_assigned = db.Column(db.Boolean, default=False)
     
+    # Relationships
+    user = db.relationship('User', back_populates='purchases')
+    item = db.relationship('Item', back_populates='purchases')
+    
     __table_args__ = (
         CheckConstraint('quantity > 0', name='check_quantity_positive'),
         CheckConstraint('total_cost > 0', name='check_total_cost_positive'),
         CheckConstraint("status IN ('pending', 'processing', 'fulfilled', 'failed', 'refunded')", 
                        name='check_purchase_status'),
+        db.Index('ix_purchases_created_id', created_at.desc(), id.desc()),
+        # Lets the "item has purchases" EXISTS probe stop at the first entry
+        db.Index('ix_purchases_item_id', 'item_id'),
+        # Per-user and per-status listings, and the pending-purchase sweep
+        db.Index('ix_purchases_user_status_created', 'user_id', 'status', created_at.desc(), id.desc()),
+        db.Index('ix_purchases_status_created', 'status', created_at.desc(), id.desc()),
     )
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'item_id': self.item_id,
-            'quantity': self.quantity,
-            'total_cost': self.total_cost,
-            'status': self.status,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'fulfilled_at': self.fulfilled_at.isoformat() if self.fulfilled_at else None,
-            'minecraft_command': self.minecraft_command,
-            'discord_role_assigned': self.discord_role_assigned
-        }
+    to_dict = _dict_factory(
+        ('id', 'user_id', 'item_id', 'quantity', 'total_cost', 'status', 'created_at', 'fulfilled_at', 'minecraft_command', 'discord_role_assigned'),
+        ('created_at', 'fulfilled_at')
+    )
 
-class PaymentRecord(db.Model):
+class PaymentRecord(SerializerMixin, db.Model):
     __tablename__ = 'payment_records'
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    stripe_payment_id = db.Column(db.String(100), unique=True, nullable=False)
+    stripe_payment_id = db.Column(db.String(100), nullable=False)
     amount_cents = db.Column(db.Integer, nullable=False)
     currency = db.Column(db.String(3), default='USD')
     status = db.Column(db.String(20), default='pending')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    payment_metadata = db.Column(db.Text)  # JSON string
+    payment_metadata = db.Column(db.JSON)
+    
+    # Relationships
+    user = db.relationship('User', back_populates='payment_records')
     
     __table_args__ = (
         CheckConstraint('amount_cents > 0', name='check_amount_positive'),
         CheckConstraint("status IN ('pending', 'succeeded', 'failed', 'cancelled', 'refunded')", 
                        name='check_payment_status'),
+        db.Index('ix_payment_records_stripe_payment_id', 'stripe_payment_id', unique=True),
+        # Payment history per user, newest first
+        db.Index('ix_payment_records_user_created', 'user_id', created_at.desc()),
+        # Covers the succeeded-payments revenue rollup without touching rows
+        db.Index('ix_payment_records_status_created', 'status', 'created_at', 'amount_cents'),
+    )
+    
+    _base_dict = _dict_factory(
+        ('id', 'user_id', 'stripe_payment_id', 'amount_cents', 'currency', 'status', 'created_at', 'updated_at'),
+        ('created_at', 'updated_at')
     )
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'stripe_payment_id': self.stripe_payment_id,
-            'amount_cents': self.amount_cents,
-            'currency': self.currency,
-            'status': self.status,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'metadata': json.loads(self.payment_metadata) if self.payment_metadata else None
-        }
+        data = PaymentRecord._base_dict(self)
+        data['metadata'] = self.payment_metadata or None
+        return data
+    
+    @classmethod
+    def by_stripe_payment_id(cls, stripe_payment_id):
+        """Look up a payment record by Stripe ID through ix_payment_records_stripe_payment_id"""
+        return db.session.execute(
+            select(cls).where(cls.stripe_payment_id == stripe_payment_id).limit(1)
+        ).scalar_one_or_none()
 
-class MinecraftServer(db.Model):
+class MinecraftServer(SerializerMixin, db.Model):
     __tablename__ = 'minecraft_servers'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -206,20 +289,12 @@ class MinecraftServer(db.Model):
     # Relationships
     server_status = db.relationship('ServerStatus', backref='server', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'host': self.host,
-            'port': self.port,
-            'rcon_host': self.rcon_host,
-            'rcon_port': self.rcon_port,
-            'is_active': self.is_active,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
+    to_dict = _dict_factory(
+        ('id', 'name', 'host', 'port', 'rcon_host', 'rcon_port', 'is_active', 'created_at', 'updated_at'),
+        ('created_at', 'updated_at')
+    )
 
-class ServerStatus(db.Model):
+class ServerStatus(SerializerMixin, db.Model):
     __tablename__ = 'server_status'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -229,21 +304,33 @@ class ServerStatus(db.Model):
     max_players = db.Column(db.Integer, default=0)
     version = db.Column(db.String(50))
     tps = db.Column(db.Numeric(4, 2))
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Epoch milliseconds: status ticks are written often and serialized in bulk
+    timestamp_ms = db.Column(db.BigInteger, default=_epoch_ms, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_server_status_server_ts', 'server_id', 'timestamp_ms'),
+        # MAX(timestamp_ms) probe behind the /server/status validators
+        db.Index('ix_server_status_ts', 'timestamp_ms'),
+    )
+    __mapper_args__ = {'eager_defaults': True}
+    
+    _base_dict = _dict_factory(
+        ('id', 'server_id', 'is_online', 'players_online', 'max_players', 'version', 'tps', 'timestamp_ms')
+    )
+    
+    @property
+    def timestamp(self):
+        """timestamp_ms as a naive UTC datetime"""
+        return datetime.utcfromtimestamp(self.timestamp_ms / 1000) if self.timestamp_ms is not None else None
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'server_id': self.server_id,
-            'is_online': self.is_online,
-            'players_online': self.players_online,
-            'max_players': self.max_players,
-            'version': self.version,
-            'tps': float(self.tps) if self.tps else None,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None
-        }
+        data = ServerStatus._base_dict(self)
+        data['tps'] = float(data['tps']) if data['tps'] else None
+        # API clients read the ISO 'timestamp'; timestamp_ms rides alongside
+        data['timestamp'] = _iso(self.timestamp)
+        return data
 
-class BotConfig(db.Model):
+class BotConfig(SerializerMixin, db.Model):
     __tablename__ = 'bot_config'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -252,16 +339,12 @@ class BotConfig(db.Model):
     description = db.Column(db.Text)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'key': self.key,
-            'value': self.value,
-            'description': self.description,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
+    to_dict = _dict_factory(
+        ('id', 'key', 'value', 'description', 'updated_at'),
+        ('updated_at',)
+    )
 
-class AuditLog(db.Model):
+class AuditLog(SerializerMixin, db.Model):
     __tablename__ = 'audit_logs'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -271,21 +354,79 @@ class AuditLog(db.Model):
     ip_address = db.Column(db.String(45))  # IPv6 compatible
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'action': self.action,
-            'details': self.details,
-            'ip_address': self.ip_address,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None
-        }
+    # Relationships
+    user = db.relationship('User', back_populates='audit_logs')
+    
+    __table_args__ = (
+        # id is the keyset tie-breaker, so ORDER BY timestamp DESC, id DESC
+        # LIMIT n reads n index entries with no sort step
+        db.Index('ix_audit_action_ts', 'action', timestamp.desc(), id.desc()),
+        db.Index('ix_audit_user_ts', 'user_id', timestamp.desc(), id.desc()),
+        db.Index('ix_audit_ts', timestamp.desc(), id.desc()),
+        # Trigram indexes for the audit search box (ILIKE '%term%')
+        db.Index('ix_audit_action_trgm', 'action', postgresql_using='gin',
+                 postgresql_ops={'action': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_audit_details_trgm', 'details', postgresql_using='gin',
+                 postgresql_ops={'details': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_audit_ip_address_trgm', 'ip_address', postgresql_using='gin',
+                 postgresql_ops={'ip_address': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+    
+    to_dict = _dict_factory(
+        ('id', 'user_id', 'action', 'details', 'ip_address', 'timestamp'),
+        ('timestamp',)
+    )
 
-class Gift(db.Model):
+class AuditHourlyCount(db.Model):
+    """Audit log rows per hour, kept current by a trigger on audit_logs"""
+    __tablename__ = 'audit_hourly_counts'
+    
+    hour = db.Column(db.DateTime, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+# Rollup triggers by dialect. SQLite bumps the hour per row; PostgreSQL
+# aggregates each INSERT statement's rows at once so batched audit writes
+# cost one upsert.
+AUDIT_ROLLUP_DDL = {
+    'sqlite': (
+        DDL(
+            "CREATE TRIGGER IF NOT EXISTS audit_logs_hourly_rollup "
+            "AFTER INSERT ON audit_logs WHEN NEW.timestamp IS NOT NULL "
+            "BEGIN "
+            "INSERT INTO audit_hourly_counts (hour, count) "
+            "VALUES (strftime('%%Y-%%m-%%d %%H:00:00.000000', NEW.timestamp), 1) "
+            "ON CONFLICT (hour) DO UPDATE SET count = count + 1; "
+            "END"
+        ),
+    ),
+    'postgresql': (
+        DDL(
+            "CREATE OR REPLACE FUNCTION audit_logs_hourly_rollup() RETURNS trigger "
+            "LANGUAGE plpgsql AS $$ BEGIN "
+            "INSERT INTO audit_hourly_counts (hour, count) "
+            "SELECT date_trunc('hour', timestamp), count(*) FROM new_rows "
+            "WHERE timestamp IS NOT NULL GROUP BY 1 "
+            "ON CONFLICT (hour) DO UPDATE SET count = audit_hourly_counts.count + EXCLUDED.count; "
+            "RETURN NULL; END $$"
+        ),
+        DDL("DROP TRIGGER IF EXISTS audit_logs_hourly_rollup ON audit_logs"),
+        DDL(
+            "CREATE TRIGGER audit_logs_hourly_rollup AFTER INSERT ON audit_logs "
+            "REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT "
+            "EXECUTE FUNCTION audit_logs_hourly_rollup()"
+        ),
+    ),
+}
+
+for _dialect, _statements in AUDIT_ROLLUP_DDL.items():
+    for _ddl in _statements:
+        event.listen(AuditLog.__table__, 'after_create', _ddl.execute_if(dialect=_dialect))
+
+class Gift(SerializerMixin, db.Model):
     __tablename__ = 'gifts'
     
     id = db.Column(db.Integer, primary_key=True)
-    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'))  # NULL for admin gifts
     recipient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     amount = db.Column(db.Integer, nullable=False)
     message = db.Column(db.Text)
@@ -301,17 +442,26 @@ class Gift(db.Model):
         CheckConstraint('amount > 0', name='check_gift_amount_positive'),
         CheckConstraint("status IN ('pending', 'completed', 'cancelled')", name='check_gift_status'),
         CheckConstraint('sender_id != recipient_id', name='check_gift_different_users'),
+        # Gift list (newest first), optionally filtered by status or by user;
+        # the user filter ORs both columns, which PostgreSQL answers with a
+        # BitmapOr over the sender and recipient indexes
+        db.Index('ix_gifts_created_id', created_at.desc(), id.desc()),
+        db.Index('ix_gifts_status_created', 'status', created_at.desc(), id.desc()),
+        db.Index('ix_gifts_sender_created', 'sender_id', created_at.desc(), id.desc()),
+        db.Index('ix_gifts_recipient_created', 'recipient_id', created_at.desc(), id.desc()),
+        # Top senders/recipients in the gift stats: partial indexes over
+        # completed gifts carrying the amount, so the per-user sums are
+        # index-only scans
+        db.Index('ix_gifts_completed_sender', 'sender_id', 'amount',
+                 postgresql_where=status == 'completed', sqlite_where=status == 'completed'),
+        db.Index('ix_gifts_completed_recipient', 'recipient_id', 'amount',
+                 postgresql_where=status == 'completed', sqlite_where=status == 'completed'),
     )
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'sender_id': self.sender_id,
-            'recipient_id': self.recipient_id,
-            'amount': self.amount,
-            'message': self.message,
-            'status': self.status,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'processed_at': self.processed_at.isoformat() if self.processed_at else None
-        }
+    to_dict = _dict_factory(
+        ('id', 'sender_id', 'recipient_id', 'amount', 'message', 'status', 'created_at', 'processed_at'),
+        ('created_at', 'processed_at')
+    )
+    # to_dict plus pre-serialized 'sender' and 'recipient' in one dict literal
+    to_dict_with_users = _dict_factory(to_dict.fields, to_dict.datetime_fields, extra=('sender', 'recipient'))
 
@@ -0,0 +1,183 @@
+from datetime import datetime
+from flask import current_app, request
+from sqlalchemy import func, select
+from src.models.database import db
+
+# Largest page a keyset listing serves, and the larger cap for the
+# streamed listings that exports page through
+MAX_PAGE_SIZE = 100
+MAX_EXPORT_PAGE_SIZE = 10000
+
+def clamp_page_size(value, default, maximum=MAX_PAGE_SIZE):
+    """
+    Normalize a requested keyset page size
+
+    Sizes below 1 fall back to ``default``: an empty page has no last row
+    to build the next cursor from, and a negative LIMIT means no limit at
+    all on SQLite. Larger sizes are capped at ``maximum``.
+    """
+    if value is None or value < 1:
+        return default
+    return min(value, maximum)
+
+def encode_cursor(timestamp, row_id):
+    """
+    Build an opaque keyset cursor from the last row of a page
+
+    Args:
+        timestamp: Sort timestamp of the last row
+        row_id: Primary key of the last row (tie-breaker)
+
+    Returns:
+        Cursor string, or None if there is no row to continue from
+    """
+    if timestamp is None or row_id is None:
+        return None
+    return f"{timestamp.isoformat()}_{row_id}"
+
+def decode_cursor(cursor):
+    """
+    Parse a cursor produced by encode_cursor
+
+    Returns:
+        (timestamp, row_id) tuple
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    timestamp, _, row_id = cursor.rpartition('_')
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+def apply_keyset(query, timestamp_column, id_column, cursor, limit):
+    """
+    Restrict a query to the page after ``cursor`` ordered newest first
+
+    Rows are ordered by (timestamp DESC, id DESC) and ``limit + 1`` rows are
+    requested so callers can tell whether another page exists.
+
+    Args:
+        query: Query to paginate
+        timestamp_column: Column the listing is sorted by
+        id_column: Primary key column used as tie-breaker
+        cursor: Cursor from the previous page, or None/'' for the first page
+        limit: Page size
+
+    Returns:
+        The paginated query
+    """
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.filter(db.or_(
+            timestamp_column < timestamp,
+            db.and_(timestamp_column == timestamp, id_column < row_id)
+        ))
+
+    return query.order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1)
+
+def apply_id_keyset(query, id_column, cursor, limit):
+    """
+    Restrict a query to the page after ``cursor`` ordered by ascending id
+
+    Cursors for this ordering are the stringified id of the last row.
+
+    Args:
+        query: Query to paginate
+        id_column: Primary key column
+        cursor: Cursor from the previous page, or None/'' for the first page
+        limit: Page size
+
+    Returns:
+        The paginated query
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    if cursor:
+        query = query.filter(id_column > int(cursor))
+
+    return query.order_by(id_column).limit(limit + 1)
+
+def split_page(rows, limit):
+    """
+    Split a ``limit + 1`` result into the page and a has-more flag
+
+    Returns:
+        (rows, has_more) tuple
+    """
+    return rows[:limit], len(rows) > limit
+
+def include_total_requested():
+    """
+    Whether the current list request should pay for a COUNT(*)
+
+    Clients opt in with ``?include_total=1``/``true``; the LIST_INCLUDE_TOTAL
+    setting restores totals by default for clients that still rely on them.
+    """
+    value = request.args.get('include_total')
+    if value is None:
+        return current_app.config.get('LIST_INCLUDE_TOTAL', False)
+    return value.lower() in ('1', 'true', 'yes')
+
+def count_rows(query, id_column):
+    """
+    Count the rows a list query matches
+
+    The count runs over an unordered id-only subquery, so the planner can
+    skip the sort and no eager-load joins or wide columns are carried along.
+
+    Args:
+        query: Filtered list query
+        id_column: Primary key column of the listed model
+
+    Returns:
+        Number of matching rows
+    """
+    ids = query.order_by(None).with_entities(id_column).subquery()
+    return db.session.execute(select(func.count()).select_from(ids)).scalar()
+
+def paginate_deferred(query, model, order_by, page, per_page, columns=None, include_total=False):
+    """
+    OFFSET pagination that walks only primary keys before loading full rows
+
+    The OFFSET scan runs on an id-only subquery (served from the ordering
+    index) and just the selected page is joined back to the wide rows. One
+    extra id is fetched to tell whether a next page exists, so no COUNT(*)
+    runs unless ``include_total`` is set. Page arguments are normalized like
+    ``paginate(error_out=False)``.
+
+    Args:
+        query: Filtered query over ``model``
+        model: Mapped class being listed
+        order_by: Tuple of ORDER BY clauses, ending with a unique tie-breaker
+        page: 1-based page number
+        per_page: Page size
+        columns: Columns to return as plain rows instead of ORM instances
+        include_total: Also count the matching rows
+
+    Returns:
+        (items, meta) tuple; meta holds current_page, per_page, has_next and,
+        with include_total, total and pages
+    """
+    page = max(page, 1)
+    if per_page < 1:
+        per_page = 20
+
+    ids = (
+        query.with_entities(model.id)
+        .order_by(*order_by)
+        .limit(per_page + 1)
+        .offset((page - 1) * per_page)
+        .subquery()
+    )
+    page_query = db.session.query(*columns) if columns else model.query
+    items, has_next = split_page(
+        page_query.join(ids, model.id == ids.c.id).order_by(*order_by).all(),
+        per_page
+    )
+
+    meta = {'current_page': page, 'per_page': per_page, 'has_next': has_next}
+    if include_total:
+        total = count_rows(query, model.id)
+        meta['total'] = total
+        meta['pages'] = -(-total // per_page)
+    return items, meta
@@ -1,7 +1,15 @@
 from flask import Blueprint, request, jsonify, current_app
 from src.models.database import db, User, MinecraftServer, AuditLog
-from src.minecraft_integration import MinecraftIntegration
+from src.minecraft_integration import MinecraftIntegration, run_coroutine
+from src.responses import ojsonify
+from src.cache import current_value, region, table_version
+from src.audit_queue import add_audit
+from src.security import get_user_or_404
+from src.tasks import backup_database, create_backup_task
+from src.pagination import apply_keyset, clamp_page_size, encode_cursor, split_page
+from sqlalchemy import select, func
 from datetime import datetime
+import asyncio
 import logging
 import os
 
@@ -9,18 +17,51 @@ admin_bp = Blueprint('admin', __name__)
 logger = logging.getLogger(__name__)
 minecraft = MinecraftIntegration()
 
+def _load_admin_ids():
+    """Parse ADMIN_USER_IDS into a set of IDs"""
+    return frozenset(s.strip() for s in os.getenv('ADMIN_USER_IDS', '').split(',') if s.strip())
+
+_ADMIN_IDS = _load_admin_ids()
+
+def reload_admin_ids():
+    """Re-read ADMIN_USER_IDS from the environment"""
+    global _ADMIN_IDS
+    _ADMIN_IDS = _load_admin_ids()
+
 def is_admin(user_id):
     """Check if user is admin"""
-    admin_ids = os.getenv('ADMIN_USER_IDS', '').split(',')
-    return str(user_id) in admin_ids
+    return str(user_id) in _ADMIN_IDS
+
+async def _gather_named(servers, coros):
+    """Await coroutines concurrently and map each server name to its success flag"""
+    values = await asyncio.gather(*coros, return_exceptions=True)
+    return {
+        server.name: (not isinstance(value, Exception)) and value
+        for server, value in zip(servers, values)
+    }
+
+@region.cache_on_arguments()
+def _list_servers():
+    version = table_version(MinecraftServer)
+    # Read-only listing: fetch plain rows instead of tracked ORM instances
+    rows = db.session.execute(select(*MinecraftServer.serialized_columns())).all()
+    
+    return version, MinecraftServer.rows_to_dicts(rows)
+
+def list_servers():
+    """Serialized list of all Minecraft servers (cached until the servers table changes)"""
+    return current_value(_list_servers, table_version(MinecraftServer))
+
+def invalidate_servers():
+    """Drop this process's cached server list after a write"""
+    _list_servers.invalidate()
 
 @admin_bp.route('/servers', methods=['GET'])
 def get_servers():
     """Get all Minecraft servers"""
     try:
-        servers = MinecraftServer.query.all()
-        return jsonify({
-            'servers': [server.to_dict() for server in servers]
+        return ojsonify({
+            'servers': list_servers()
         })
         
     except Exception as e:
@@ -44,16 +85,15 @@ def create_server():
         )
         
         db.session.add(server)
-        db.session.commit()
         
-        # Log the action
-        audit_log = AuditLog(
-            action='server_created',
+        # Log the action in the same transaction
+        add_audit(
+            'server_created',
             details=f"Created server: {server.name} ({server.host}:{server.port})",
             ip_address=request.remote_addr
         )
-        db.session.add(audit_log)
         db.session.commit()
+        invalidate_servers()
         
         return jsonify({
             'message': 'Server created successfully',
@@ -62,6 +102,7 @@ def create_server():
         
     except Exception as e:
         logger.error(f"Error creating server: {e}")
+        db.session.rollback()
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/servers/<int:server_id>', methods=['PUT'])
@@ -80,16 +121,14 @@ def update_server(server_id):
         server.is_active = data.get('is_active', server.is_active)
         server.updated_at = datetime.utcnow()
         
-        db.session.commit()
-        
-        # Log the action
-        audit_log = AuditLog(
-            action='server_updated',
+        # Log the action in the same transaction
+        add_audit(
+            'server_updated',
             details=f"Updated server: {server.name}",
             ip_address=request.remote_addr
         )
-        db.session.add(audit_log)
         db.session.commit()
+        invalidate_servers()
         
         return jsonify({
             'message': 'Server updated successfully',
@@ -98,6 +137,7 @@ def update_server(server_id):
         
     except Exception as e:
         logger.error(f"Error updating server: {e}")
+        db.session.rollback()
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/servers/<int:server_id>', methods=['DELETE'])
@@ -106,32 +146,36 @@ def delete_server(server_id):
     try:
         server = MinecraftServer.query.get_or_404(server_id)
         
-        # Log the action before deletion
-        audit_log = AuditLog(
-            action='server_deleted',
+        # Log the action in the same transaction, before deletion expires it
+        add_audit(
+            'server_deleted',
             details=f"Deleted server: {server.name} ({server.host}:{server.port})",
             ip_address=request.remote_addr
         )
-        db.session.add(audit_log)
         
         db.session.delete(server)
         db.session.commit()
+        invalidate_servers()
         
         return jsonify({'message': 'Server deleted successfully'})
         
     except Exception as e:
         logger.error(f"Error deleting server: {e}")
+        db.session.rollback()
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/servers/<int:server_id>/test', methods=['POST'])
 def test_server_connection(server_id):
     """Test connection to a Minecraft server"""
     try:
-        server = MinecraftServer.query.get_or_404(server_id)
+        server = db.session.execute(
+            select(*MinecraftServer.serialized_columns(), MinecraftServer.rcon_password).where(MinecraftServer.id == server_id)
+        ).one_or_none()
+        if server is None:
+            return jsonify({'error': 'Server not found'}), 404
         
         # Test server connection
-        import asyncio
-        results = asyncio.run(minecraft.test_connection(
+        results = run_coroutine(minecraft.test_connection(
             host=server.host,
             port=server.port,
             rcon_host=server.rcon_host,
@@ -140,7 +184,7 @@ def test_server_connection(server_id):
         ))
         
         return jsonify({
-            'server': server.to_dict(),
+            'server': MinecraftServer.to_dict(server),
             'test_results': results
         })
         
@@ -153,20 +197,18 @@ def ban_user(user_id):
     """Ban/unban a user"""
     try:
         data = request.get_json()
-        user = User.query.get_or_404(user_id)
+        user = get_user_or_404(user_id)
         
         user.is_active = not data.get('ban', True)
-        db.session.commit()
         
         action = 'banned' if not user.is_active else 'unbanned'
         
-        # Log the action
-        audit_log = AuditLog(
-            action=f'user_{action}',
+        # Log the action in the same transaction
+        add_audit(
+            f'user_{action}',
             details=f"User {user.username} ({user.discord_id}) was {action}",
             ip_address=request.remote_addr
         )
-        db.session.add(audit_log)
         db.session.commit()
         
         return jsonify({
@@ -176,6 +218,7 @@ def ban_user(user_id):
         
     except Exception as e:
         logger.error(f"Error banning user: {e}")
+        db.session.rollback()
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/users/<int:user_id>/admin', methods=['POST'])
@@ -183,20 +226,18 @@ def toggle_admin(user_id):
     """Toggle admin status for a user"""
     try:
         data = request.get_json()
-        user = User.query.get_or_404(user_id)
+        user = get_user_or_404(user_id)
         
         user.is_admin = data.get('is_admin', not user.is_admin)
-        db.session.commit()
         
         action = 'granted' if user.is_admin else 'revoked'
         
-        # Log the action
-        audit_log = AuditLog(
-            action=f'admin_{action}',
+        # Log the action in the same transaction
+        add_audit(
+            f'admin_{action}',
             details=f"Admin privileges {action} for user {user.username} ({user.discord_id})",
             ip_address=request.remote_addr
         )
-        db.session.add(audit_log)
         db.session.commit()
         
         return jsonify({
@@ -206,6 +247,7 @@ def toggle_admin(user_id):
         
     except Exception as e:
         logger.error(f"Error toggling admin: {e}")
+        db.session.rollback()
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/audit-logs', methods=['GET'])
@@ -216,25 +258,56 @@ def get_audit_logs():
         per_page = request.args.get('per_page', 50, type=int)
         action = request.args.get('action')
         user_id = request.args.get('user_id', type=int)
+        cursor = request.args.get('cursor')
         
-        query = AuditLog.query
+        # Plain rows straight from the columns to_dict reads; no ORM instances
+        stmt = select(*AuditLog.serialized_columns())
         
         if action:
-            query = query.filter_by(action=action)
+            stmt = stmt.where(AuditLog.action == action)
         
         if user_id:
-            query = query.filter_by(user_id=user_id)
-        
-        logs = query.order_by(AuditLog.timestamp.desc()).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
-        
-        return jsonify({
-            'logs': [log.to_dict() for log in logs.items],
-            'total': logs.total,
-            'pages': logs.pages,
+            stmt = stmt.where(AuditLog.user_id == user_id)
+        
+        # Keyset pagination: seek past the cursor instead of skipping OFFSET rows
+        if cursor is not None:
+            per_page = clamp_page_size(per_page, 50)
+            try:
+                rows = db.session.execute(apply_keyset(stmt, AuditLog.timestamp, AuditLog.id, cursor, per_page)).all()
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            
+            rows, has_more = split_page(rows, per_page)
+            
+            return ojsonify({
+                'logs': AuditLog.rows_to_dicts(rows),
+                'next_cursor': encode_cursor(rows[-1].timestamp, rows[-1].id) if has_more else None,
+                'has_more': has_more,
+                'per_page': per_page
+            })
+        
+        page = max(page, 1)
+        if per_page < 1:
+            per_page = 20
+        
+        # COUNT(*) OVER () returns the filtered total alongside the page
+        rows = db.session.execute(
+            stmt.add_columns(func.count().over().label('total'))
+            .order_by(AuditLog.timestamp.desc(), AuditLog.id.desc())
+            .limit(per_page)
+            .offset((page - 1) * per_page)
+        ).all()
+        
+        if rows:
+            total = rows[0].total
+        else:
+            # Past the last page the window has no rows to ride on
+            total = db.session.execute(select(func.count()).select_from(stmt.subquery())).scalar()
+        
+        return ojsonify({
+            'logs': AuditLog.rows_to_dicts(rows),
+            'total': total,
+            'pages': -(-total // per_page),
             'current_page': page,
             'per_page': per_page
         })
@@ -243,31 +316,39 @@ def get_audit_logs():
         logger.error(f"Error getting audit logs: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@region.cache_on_arguments(expiration_time=5)
+def _compute_system_info():
+    """Collect host and database statistics (cached briefly; psutil calls dominate)"""
+    import psutil
+    import platform
+    
+    # Get system info
+    memory = psutil.virtual_memory()
+    system_info = {
+        'platform': platform.platform(),
+        'python_version': platform.python_version(),
+        'cpu_count': psutil.cpu_count(),
+        'memory_total': memory.total,
+        'memory_available': memory.available,
+        'disk_usage': psutil.disk_usage('/').percent
+    }
+    
+    # Get database info
+    db_info = {
+        'total_users': db.session.execute(select(func.count()).select_from(User)).scalar(),
+        'total_servers': db.session.execute(select(func.count()).select_from(MinecraftServer)).scalar(),
+        'database_size': 'N/A'  # Would need specific implementation for different DB types
+    }
+    
+    return system_info, db_info
+
 @admin_bp.route('/system/info', methods=['GET'])
 def get_system_info():
     """Get system information"""
     try:
-        import psutil
-        import platform
-        
-        # Get system info
-        system_info = {
-            'platform': platform.platform(),
-            'python_version': platform.python_version(),
-            'cpu_count': psutil.cpu_count(),
-            'memory_total': psutil.virtual_memory().total,
-            'memory_available': psutil.virtual_memory().available,
-            'disk_usage': psutil.disk_usage('/').percent
-        }
-        
-        # Get database info
-        db_info = {
-            'total_users': User.query.count(),
-            'total_servers': MinecraftServer.query.count(),
-            'database_size': 'N/A'  # Would need specific implementation for different DB types
-        }
+        system_info, db_info = _compute_system_info()
         
-        return jsonify({
+        return ojsonify({
             'system': system_info,
             'database': db_info
         })
@@ -280,26 +361,31 @@ def get_system_info():
 def create_backup():
     """Create a database backup"""
     try:
-        import shutil
-        from datetime import datetime
-        
         # Create backup filename with timestamp
         timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-        backup_filename = f"backup_{timestamp}.db"
-        
-        # For SQLite, just copy the file
-        db_path = current_app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
+        url = db.engine.url
+        extension = 'db' if url.get_backend_name() == 'sqlite' else 'dump'
+        backup_filename = f"backup_{timestamp}.{extension}"
         backup_path = f"/tmp/{backup_filename}"
         
-        shutil.copy2(db_path, backup_path)
+        # Large databases take a while to dump; let callers hand it to a worker
+        data = request.get_json(silent=True) or {}
+        if data.get('async'):
+            create_backup_task.delay(backup_path, ip_address=request.remote_addr)
+            return jsonify({
+                'message': 'Backup queued',
+                'filename': backup_filename,
+                'path': backup_path
+            }), 202
+        
+        backup_database(url, backup_path)
         
         # Log the action
-        audit_log = AuditLog(
-            action='backup_created',
+        add_audit(
+            'backup_created',
             details=f"Database backup created: {backup_filename}",
             ip_address=request.remote_addr
         )
-        db.session.add(audit_log)
         db.session.commit()
         
         return jsonify({
@@ -310,6 +396,7 @@ def create_backup():
         
     except Exception as e:
         logger.error(f"Error creating backup: {e}")
+        db.session.rollback()
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/maintenance/mode', methods=['POST'])
@@ -321,12 +408,11 @@ def toggle_maintenance_mode():
         
         # This would typically set a flag in the database or config
         # For now, we'll just log it
-        audit_log = AuditLog(
-            action='maintenance_mode',
+        add_audit(
+            'maintenance_mode',
             details=f"Maintenance mode {'enabled' if maintenance_mode else 'disabled'}",
             ip_address=request.remote_addr
         )
-        db.session.add(audit_log)
         db.session.commit()
         
         return jsonify({
@@ -336,6 +422,7 @@ def toggle_maintenance_mode():
         
     except Exception as e:
         logger.error(f"Error toggling maintenance mode: {e}")
+        db.session.rollback()
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/broadcast', methods=['POST'])
@@ -348,26 +435,31 @@ def broadcast_message():
         if not message:
             return jsonify({'error': 'Message is required'}), 400
         
-        servers = MinecraftServer.query.filter_by(is_active=True).all()
-        results = {}
+        servers = db.session.execute(select(
+            MinecraftServer.name,
+            MinecraftServer.rcon_host,
+            MinecraftServer.rcon_port,
+            MinecraftServer.rcon_password
+        ).where(MinecraftServer.is_active.is_(True))).all()
         
-        for server in servers:
-            import asyncio
-            success = asyncio.run(minecraft.broadcast_message(
+        # Send to every server concurrently on a single event loop
+        coros = [
+            minecraft.broadcast_message(
                 message,
                 rcon_host=server.rcon_host,
                 rcon_port=server.rcon_port,
                 rcon_password=server.rcon_password
-            ))
-            results[server.name] = success
+            )
+            for server in servers
+        ]
+        results = run_coroutine(_gather_named(servers, coros))
         
         # Log the action
-        audit_log = AuditLog(
-            action='broadcast_message',
+        add_audit(
+            'broadcast_message',
             details=f"Broadcasted message: {message}",
             ip_address=request.remote_addr
         )
-        db.session.add(audit_log)
         db.session.commit()
         
         return jsonify({
@@ -377,5 +469,6 @@ def broadcast_message():
         
     except Exception as e:
         logger.error(f"Error broadcasting message: {e}")
+        db.session.rollback()
         return jsonify({'error': 'Internal server error'}), 500
 
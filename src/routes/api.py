@@ -1,6 +1,14 @@
-from flask import Blueprint, request, jsonify, current_app
-from src.models.database import db, User, Transaction, Item, Purchase, BotConfig, MinecraftServer, ServerStatus, PaymentRecord, AuditLog
-from src.minecraft_integration import MinecraftIntegration
+from flask import Blueprint, request, current_app, url_for
+from src.models.database import db, User, Transaction, Item, Purchase, BotConfig, MinecraftServer, ServerStatus, PaymentRecord, upsert_insert
+from src.minecraft_integration import MinecraftIntegration, run_coroutine, render_item_commands
+from src.security import get_user as load_user, get_user_or_404
+from src.responses import ojsonify, conditional_ojsonify, conditional_json_body, encode_json, not_modified, stream_ojsonify, version_etag
+from src.cache import current_value, region, table_version
+from src.audit_queue import add_audit
+from src.tasks import fulfill_purchase_task, execute_server_command_task
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import aliased
+from src.pagination import MAX_EXPORT_PAGE_SIZE, apply_keyset, apply_id_keyset, clamp_page_size, encode_cursor, include_total_requested, paginate_deferred, split_page
 from datetime import datetime, timedelta
 import logging
 import json
@@ -16,43 +24,61 @@ def get_users():
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
         search = request.args.get('search', '')
+        cursor = request.args.get('cursor')
+        include_total = include_total_requested()
         
         query = User.query
         
         if search:
+            # ILIKE is served by the trigram indexes on PostgreSQL; wildcards
+            # in the search term are matched literally
             query = query.filter(
-                (User.username.contains(search)) | 
-                (User.discord_id.contains(search))
+                User.username.icontains(search, autoescape=True) |
+                User.discord_id.icontains(search, autoescape=True)
             )
         
-        users = query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
+        # Keyset pagination on id when the client sends a cursor
+        if cursor is not None:
+            per_page = clamp_page_size(per_page, 20)
+            try:
+                rows = apply_id_keyset(query.with_entities(*User.serialized_columns()), User.id, cursor, per_page).all()
+            except ValueError:
+                return ojsonify({'error': 'Invalid cursor'}), 400
+            
+            rows, has_more = split_page(rows, per_page)
+            payload = {
+                'users': User.rows_to_dicts(rows),
+                'next_cursor': str(rows[-1].id) if has_more else None,
+                'has_more': has_more,
+                'per_page': per_page
+            }
+            if include_total:
+                payload['total'] = query.count()
+            return ojsonify(payload)
+        
+        users, meta = paginate_deferred(
+            query, User, (User.id,), page, per_page, User.serialized_columns(), include_total
         )
         
-        return jsonify({
-            'users': [user.to_dict() for user in users.items],
-            'total': users.total,
-            'pages': users.pages,
-            'current_page': page,
-            'per_page': per_page
+        return ojsonify({
+            'users': User.rows_to_dicts(users),
+            **meta
         })
         
     except Exception as e:
         logger.error(f"Error getting users: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
 
 @api_bp.route('/users/<int:user_id>', methods=['GET'])
 def get_user(user_id):
     """Get a specific user"""
     try:
-        user = User.query.get_or_404(user_id)
-        return jsonify(user.to_dict())
+        user = get_user_or_404(user_id)
+        return ojsonify(user.to_dict())
         
     except Exception as e:
         logger.error(f"Error getting user {user_id}: {e}")
-        return jsonify({'error': 'User not found'}), 404
+        return ojsonify({'error': 'User not found'}), 404
 
 @api_bp.route('/users/<int:user_id>/coins', methods=['POST'])
 def update_user_coins(user_id):
@@ -62,7 +88,7 @@ def update_user_coins(user_id):
         amount = data.get('amount', 0)
         description = data.get('description', 'Admin adjustment')
         
-        user = User.query.get_or_404(user_id)
+        user = get_user_or_404(user_id)
         
         # Update coins
         user.coins += amount
@@ -78,14 +104,14 @@ def update_user_coins(user_id):
         db.session.add(transaction)
         db.session.commit()
         
-        return jsonify({
+        return ojsonify({
             'message': 'Coins updated successfully',
             'new_balance': user.coins
         })
         
     except Exception as e:
         logger.error(f"Error updating user coins: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
 
 @api_bp.route('/transactions', methods=['GET'])
 def get_transactions():
@@ -95,6 +121,8 @@ def get_transactions():
         per_page = request.args.get('per_page', 50, type=int)
         user_id = request.args.get('user_id', type=int)
         transaction_type = request.args.get('type')
+        cursor = request.args.get('cursor')
+        include_total = include_total_requested()
         
         query = Transaction.query
         
@@ -104,23 +132,59 @@ def get_transactions():
         if transaction_type:
             query = query.filter_by(transaction_type=transaction_type)
         
-        transactions = query.order_by(Transaction.created_at.desc()).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
+        # Keyset pagination on (created_at, id) when the client sends a cursor
+        if cursor is not None:
+            # Normalized before the stream starts: once the 200 is sent a bad
+            # size can only surface as truncated JSON
+            per_page = clamp_page_size(per_page, 50, MAX_EXPORT_PAGE_SIZE)
+            try:
+                page_query = apply_keyset(
+                    query.with_entities(*Transaction.serialized_columns()),
+                    Transaction.created_at, Transaction.id, cursor, per_page
+                )
+            except ValueError:
+                return ojsonify({'error': 'Invalid cursor'}), 400
+            
+            def trailer(last_row, has_more):
+                meta = {
+                    'next_cursor': encode_cursor(last_row.created_at, last_row.id) if has_more else None,
+                    'has_more': has_more,
+                    'per_page': per_page
+                }
+                if include_total:
+                    meta['total'] = query.count()
+                return meta
+            
+            # Exports ask for large pages; stream rows instead of buffering them
+            return stream_ojsonify(
+                'transactions', page_query.yield_per(500), Transaction.to_dict, per_page, trailer
+            )
+        
+        transactions, meta = paginate_deferred(
+            query, Transaction, (Transaction.created_at.desc(), Transaction.id.desc()), page, per_page,
+            Transaction.serialized_columns(), include_total
         )
         
-        return jsonify({
-            'transactions': [t.to_dict() for t in transactions.items],
-            'total': transactions.total,
-            'pages': transactions.pages,
-            'current_page': page,
-            'per_page': per_page
+        return ojsonify({
+            'transactions': Transaction.rows_to_dicts(transactions),
+            **meta
         })
         
     except Exception as e:
         logger.error(f"Error getting transactions: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
+
+@region.cache_on_arguments(expiration_time=60)
+def _list_items():
+    version = table_version(Item)
+    rows = db.session.execute(
+        select(*Item.serialized_columns()).order_by(Item.category, Item.name)
+    ).all()
+    return version, Item.rows_to_dicts(rows)
+
+def list_items():
+    """Serialized items ordered by category and name (cached until the items table changes)"""
+    return current_value(_list_items, table_version(Item))
 
 @api_bp.route('/items', methods=['GET'])
 def get_items():
@@ -129,23 +193,21 @@ def get_items():
         category = request.args.get('category')
         active_only = request.args.get('active_only', 'true').lower() == 'true'
         
-        query = Item.query
+        items = list_items()
         
         if category:
-            query = query.filter_by(category=category)
+            items = [item for item in items if item['category'] == category]
         
         if active_only:
-            query = query.filter_by(is_active=True)
+            items = [item for item in items if item['is_available']]
         
-        items = query.order_by(Item.category, Item.name).all()
-        
-        return jsonify({
-            'items': [item.to_dict() for item in items]
+        return conditional_ojsonify({
+            'items': items
         })
         
     except Exception as e:
         logger.error(f"Error getting items: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
 
 @api_bp.route('/items', methods=['POST'])
 def create_item():
@@ -164,15 +226,16 @@ def create_item():
         
         db.session.add(item)
         db.session.commit()
+        _list_items.invalidate()
         
-        return jsonify({
+        return ojsonify({
             'message': 'Item created successfully',
             'item': item.to_dict()
         }), 201
         
     except Exception as e:
         logger.error(f"Error creating item: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
 
 @api_bp.route('/items/<int:item_id>', methods=['PUT'])
 def update_item(item_id):
@@ -190,38 +253,47 @@ def update_item(item_id):
         item.updated_at = datetime.utcnow()
         
         db.session.commit()
+        _list_items.invalidate()
         
-        return jsonify({
+        return ojsonify({
             'message': 'Item updated successfully',
             'item': item.to_dict()
         })
         
     except Exception as e:
         logger.error(f"Error updating item: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
 
 @api_bp.route('/items/<int:item_id>', methods=['DELETE'])
 def delete_item(item_id):
     """Delete an item"""
     try:
-        item = Item.query.get_or_404(item_id)
+        # EXISTS stops at the first purchase instead of counting them all
+        has_purchases = db.session.query(
+            Purchase.query.filter_by(item_id=item_id).exists()
+        ).scalar()
+        
+        if has_purchases:
+            # Don't delete, just take it off sale
+            result = db.session.execute(
+                update(Item).where(Item.id == item_id).values(is_available=False)
+            )
+            message = 'Item deactivated (has purchase history)'
+        else:
+            result = db.session.execute(delete(Item).where(Item.id == item_id))
+            message = 'Item deleted successfully'
         
-        # Check if item has purchases
-        purchase_count = Purchase.query.filter_by(item_id=item_id).count()
+        if not result.rowcount:
+            db.session.rollback()
+            return ojsonify({'error': 'Item not found'}), 404
         
-        if purchase_count > 0:
-            # Don't delete, just deactivate
-            item.is_active = False
-            db.session.commit()
-            return jsonify({'message': 'Item deactivated (has purchase history)'})
-        else:
-            db.session.delete(item)
-            db.session.commit()
-            return jsonify({'message': 'Item deleted successfully'})
+        db.session.commit()
+        _list_items.invalidate()
+        return ojsonify({'message': message})
         
     except Exception as e:
         logger.error(f"Error deleting item: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
 
 @api_bp.route('/purchases', methods=['GET'])
 def get_purchases():
@@ -231,6 +303,8 @@ def get_purchases():
         per_page = request.args.get('per_page', 50, type=int)
         user_id = request.args.get('user_id', type=int)
         status = request.args.get('status')
+        cursor = request.args.get('cursor')
+        include_total = include_total_requested()
         
         query = Purchase.query
         
@@ -240,84 +314,151 @@ def get_purchases():
         if status:
             query = query.filter_by(status=status)
         
-        purchases = query.order_by(Purchase.created_at.desc()).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
+        # Keyset pagination on (created_at, id) when the client sends a cursor
+        if cursor is not None:
+            # Normalized before the stream starts: once the 200 is sent a bad
+            # size can only surface as truncated JSON
+            per_page = clamp_page_size(per_page, 50, MAX_EXPORT_PAGE_SIZE)
+            try:
+                page_query = apply_keyset(
+                    query.with_entities(*Purchase.serialized_columns()),
+                    Purchase.created_at, Purchase.id, cursor, per_page
+                )
+            except ValueError:
+                return ojsonify({'error': 'Invalid cursor'}), 400
+            
+            def trailer(last_row, has_more):
+                meta = {
+                    'next_cursor': encode_cursor(last_row.created_at, last_row.id) if has_more else None,
+                    'has_more': has_more,
+                    'per_page': per_page
+                }
+                if include_total:
+                    meta['total'] = query.count()
+                return meta
+            
+            # Exports ask for large pages; stream rows instead of buffering them
+            return stream_ojsonify(
+                'purchases', page_query.yield_per(500), Purchase.to_dict, per_page, trailer
+            )
+        
+        purchases, meta = paginate_deferred(
+            query, Purchase, (Purchase.created_at.desc(), Purchase.id.desc()), page, per_page,
+            Purchase.serialized_columns(), include_total
         )
         
-        return jsonify({
-            'purchases': [p.to_dict() for p in purchases.items],
-            'total': purchases.total,
-            'pages': purchases.pages,
-            'current_page': page,
-            'per_page': per_page
+        return ojsonify({
+            'purchases': Purchase.rows_to_dicts(purchases),
+            **meta
         })
         
     except Exception as e:
         logger.error(f"Error getting purchases: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
+
+@api_bp.route('/purchases/<int:purchase_id>', methods=['GET'])
+def get_purchase(purchase_id):
+    """Get a single purchase (used to poll queued fulfillments)"""
+    purchase = Purchase.query.get_or_404(purchase_id)
+    return ojsonify(purchase.to_dict())
 
 @api_bp.route('/purchases/<int:purchase_id>/fulfill', methods=['POST'])
 def fulfill_purchase(purchase_id):
-    """Manually fulfill a purchase"""
+    """Queue a pending (or previously failed) purchase for fulfillment"""
     try:
-        purchase = Purchase.query.get_or_404(purchase_id)
-        
-        if purchase.status != 'pending':
-            return jsonify({'error': 'Purchase is not pending'}), 400
-        
-        # Get user and item
-        user = User.query.get(purchase.user_id)
-        item = Item.query.get(purchase.item_id)
-        
-        if not user or not item:
-            return jsonify({'error': 'User or item not found'}), 404
-        
-        # Generate command
-        minecraft_command = item.minecraft_command_template.format(
-            username=user.minecraft_uuid or user.username
+        previous = db.session.scalar(select(Purchase.status).where(Purchase.id == purchase_id))
+        if previous is None:
+            return ojsonify({'error': 'Purchase not found'}), 404
+        if previous not in ('pending', 'failed'):
+            return ojsonify({'error': 'Purchase is not pending'}), 400
+        
+        # Claim the purchase with a guarded UPDATE so that of two concurrent
+        # POSTs only one enqueues it. Clearing the command stamp lets the
+        # task run a retried purchase again.
+        claimed = db.session.scalar(
+            update(Purchase)
+            .where(Purchase.id == purchase_id, Purchase.status == previous)
+            .values(status='processing', minecraft_command=None)
+            .returning(Purchase.id)
         )
+        if claimed is None:
+            db.session.rollback()
+            return ojsonify({'error': 'Purchase is not pending'}), 400
+        db.session.commit()
         
-        # Execute command synchronously for now
-        import asyncio
-        success = asyncio.run(minecraft.execute_command(minecraft_command))
-        
-        if success:
-            purchase.status = 'fulfilled'
-            purchase.fulfilled_at = datetime.utcnow()
-            purchase.minecraft_command = minecraft_command
+        # The RCON round-trip runs on a worker; poll status_url for the outcome
+        try:
+            fulfill_purchase_task.delay(purchase_id)
+        except Exception:
+            # Nothing was queued: hand the purchase back so it can be retried
+            db.session.execute(
+                update(Purchase)
+                .where(Purchase.id == purchase_id, Purchase.status == 'processing')
+                .values(status=previous)
+            )
             db.session.commit()
-            
-            return jsonify({'message': 'Purchase fulfilled successfully'})
-        else:
-            return jsonify({'error': 'Failed to execute Minecraft command'}), 500
+            raise
+        
+        return ojsonify({
+            'message': 'Purchase queued for fulfillment',
+            'status_url': url_for('api.get_purchase', purchase_id=purchase_id)
+        }), 202
         
     except Exception as e:
         logger.error(f"Error fulfilling purchase: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        db.session.rollback()
+        return ojsonify({'error': 'Internal server error'}), 500
 
 @api_bp.route('/server/status', methods=['GET'])
 def get_server_status():
     """Get current server status"""
     try:
-        servers = MinecraftServer.query.filter_by(is_active=True).all()
-        server_statuses = []
+        # Status rows only change on refresh, so pollers are answered from a
+        # one-row probe of the newest status and server edits
+        status_ms, servers_updated, server_count = db.session.execute(select(
+            select(db.func.max(ServerStatus.timestamp_ms)).scalar_subquery(),
+            db.func.max(MinecraftServer.updated_at),
+            db.func.count(MinecraftServer.id)
+        )).one()
+        etag = version_etag(status_ms, servers_updated, server_count)
+        last_modified = max(filter(None, (
+            datetime.utcfromtimestamp(status_ms / 1000) if status_ms else None,
+            servers_updated
+        )), default=None)
+        
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+        
+        # Rank each server's status rows newest first; rank 1 is the latest
+        ranked = db.session.query(
+            ServerStatus,
+            db.func.row_number().over(
+                partition_by=ServerStatus.server_id,
+                order_by=(ServerStatus.timestamp_ms.desc(), ServerStatus.id.desc())
+            ).label('rank')
+        ).subquery()
+        latest = aliased(ServerStatus, ranked)
+        
+        rows = db.session.query(MinecraftServer, latest).outerjoin(
+            latest, db.and_(latest.server_id == MinecraftServer.id, ranked.c.rank == 1)
+        ).filter(MinecraftServer.is_active.is_(True)).all()
         
-        for server in servers:
-            # Get latest status from database
-            latest_status = ServerStatus.query.filter_by(server_id=server.id).order_by(ServerStatus.timestamp.desc()).first()
-            
+        server_statuses = []
+        for server, latest_status in rows:
             server_data = server.to_dict()
             server_data['status'] = latest_status.to_dict() if latest_status else None
             
             server_statuses.append(server_data)
         
-        return jsonify({'servers': server_statuses})
+        response = ojsonify({'servers': server_statuses})
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
         
     except Exception as e:
         logger.error(f"Error getting server status: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
 
 @api_bp.route('/server/refresh', methods=['POST'])
 def refresh_server_status():
@@ -325,30 +466,29 @@ def refresh_server_status():
     try:
         servers = MinecraftServer.query.filter_by(is_active=True).all()
         
-        for server in servers:
-            # Get fresh status synchronously
-            import asyncio
-            status = asyncio.run(minecraft.get_server_status(server.host, server.port))
-            
-            # Save to database
-            server_status = ServerStatus(
-                server_id=server.id,
-                is_online=status['online'],
-                players_online=status.get('players_online', 0),
-                max_players=status.get('max_players', 0),
-                version=status.get('version', ''),
-                timestamp=datetime.utcnow()
-            )
-            
-            db.session.add(server_status)
+        # Ping every server at once on the shared loop
+        statuses = run_coroutine(minecraft.get_servers_status([(server.host, server.port) for server in servers]))
+        
+        # Save to database in one executemany INSERT
+        if servers:
+            db.session.execute(insert(ServerStatus), [
+                {
+                    'server_id': server.id,
+                    'is_online': status['online'],
+                    'players_online': status.get('players_online', 0),
+                    'max_players': status.get('max_players', 0),
+                    'version': status.get('version', '')
+                }
+                for server, status in zip(servers, statuses)
+            ])
         
         db.session.commit()
         
-        return jsonify({'message': 'Server status refreshed successfully'})
+        return ojsonify({'message': 'Server status refreshed successfully'})
         
     except Exception as e:
         logger.error(f"Error refreshing server status: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
 
 @api_bp.route('/server/command', methods=['POST'])
 def execute_server_command():
@@ -358,43 +498,97 @@ def execute_server_command():
         command = data.get('command', '')
         
         if not command:
-            return jsonify({'error': 'Command is required'}), 400
+            return ojsonify({'error': 'Command is required'}), 400
+        
+        # Fire-and-forget callers don't wait on the RCON round-trip
+        if data.get('async'):
+            execute_server_command_task.delay(command, ip_address=request.remote_addr)
+            return ojsonify({'message': 'Command queued'}), 202
         
         # Execute command
-        import asyncio
-        success = asyncio.run(minecraft.execute_command(command))
+        success = run_coroutine(minecraft.execute_command(command))
         
         if success:
             # Log the action
-            audit_log = AuditLog(
+            add_audit(
                 action='server_command',
                 details=f"Executed command: {command}",
                 ip_address=request.remote_addr
             )
-            db.session.add(audit_log)
             db.session.commit()
             
-            return jsonify({'message': 'Command executed successfully'})
+            return ojsonify({'message': 'Command executed successfully'})
         else:
-            return jsonify({'error': 'Failed to execute command'}), 500
+            return ojsonify({'error': 'Failed to execute command'}), 500
         
     except Exception as e:
         logger.error(f"Error executing server command: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
+
+def bot_config_version():
+    """Fingerprint of the bot_config table, shared by every process"""
+    return table_version(BotConfig)
+
+@region.cache_on_arguments(expiration_time=60)
+def _bot_config_body():
+    version = bot_config_version()
+    rows = db.session.execute(select(*BotConfig.serialized_columns())).all()
+    configs = BotConfig.rows_to_dicts(rows)
+    return version, encode_json({
+        'config': {config['key']: config['value'] for config in configs},
+        'details': configs
+    })
+
+@region.cache_on_arguments(expiration_time=30)
+def _bot_config_entries():
+    version = bot_config_version()
+    rows = db.session.execute(select(*BotConfig.serialized_columns())).all()
+    configs = BotConfig.rows_to_dicts(rows)
+    return version, (encode_json(configs), {config['key']: encode_json(config) for config in configs})
+
+def bot_config_body():
+    """Encoded GET /config body and its ETag (cached until bot_config changes)"""
+    return current_value(_bot_config_body, bot_config_version())
+
+def bot_config_entries():
+    """
+    Encoded /bot-config list body and per-key bodies (cached until bot_config changes)
+
+    Returns:
+        (list_body, by_key) tuple; list_body is an encode_json (body, etag)
+        pair and by_key maps each key to its own pair
+    """
+    return current_value(_bot_config_entries, bot_config_version())
+
+@region.cache_on_arguments(expiration_time=5)
+def bot_config_values():
+    """
+    Mapping of every config key to its raw value (cached, invalidated on writes)
+
+    The Discord bots read their earning settings on every message; this
+    keeps that to one small query per process every few seconds. It is not
+    versioned: checking the version would cost the same query it saves, so
+    writes from other processes show up within the 5-second TTL.
+    """
+    return dict(db.session.execute(select(BotConfig.key, BotConfig.value)).all())
+
+def invalidate_bot_config():
+    """Drop this process's cached bot config bodies after a write"""
+    _bot_config_body.invalidate()
+    _bot_config_entries.invalidate()
+    bot_config_values.invalidate()
 
 @api_bp.route('/config', methods=['GET'])
 def get_bot_config():
     """Get bot configuration"""
     try:
-        configs = BotConfig.query.all()
-        return jsonify({
-            'config': {config.key: config.value for config in configs},
-            'details': [config.to_dict() for config in configs]
-        })
+        # Served from the pre-encoded body: each hit runs only the small
+        # bot_config_version() query, never the full select or JSON encoding
+        return conditional_json_body(*bot_config_body())
         
     except Exception as e:
         logger.error(f"Error getting bot config: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
 
 @api_bp.route('/config', methods=['POST'])
 def update_bot_config():
@@ -402,111 +596,127 @@ def update_bot_config():
     try:
         data = request.get_json()
         
-        for key, value in data.items():
-            config = BotConfig.query.filter_by(key=key).first()
-            
-            if config:
-                config.value = str(value)
-                config.updated_at = datetime.utcnow()
-            else:
-                config = BotConfig(
-                    key=key,
-                    value=str(value),
-                    description=f"Custom config: {key}"
-                )
-                db.session.add(config)
+        if data:
+            # One INSERT ... ON CONFLICT for every posted key
+            now = datetime.utcnow()
+            stmt = upsert_insert(BotConfig).values([
+                {'key': key, 'value': str(value), 'description': f"Custom config: {key}", 'updated_at': now}
+                for key, value in data.items()
+            ])
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=[BotConfig.key],
+                set_={'value': stmt.excluded.value, 'updated_at': stmt.excluded.updated_at}
+            ))
         
         db.session.commit()
+        invalidate_bot_config()
         
-        return jsonify({'message': 'Configuration updated successfully'})
+        return ojsonify({'message': 'Configuration updated successfully'})
         
     except Exception as e:
         logger.error(f"Error updating bot config: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
+
+@region.cache_on_arguments(expiration_time=30)
+def _compute_stats_overview():
+    """Aggregate dashboard counters (cached briefly; stats need not be real-time)"""
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    
+    # One pass per table: COUNT(*) FILTER (WHERE ...) for each counter
+    user_stats = db.session.query(
+        db.func.count(User.id),
+        db.func.count(User.id).filter(User.is_active.is_(True)),
+        db.func.count(User.id).filter(User.created_at >= week_ago),
+        db.func.sum(User.coins)
+    ).one()
+    purchase_stats = db.session.query(
+        db.func.count(Purchase.id),
+        db.func.count(Purchase.id).filter(Purchase.status == 'pending'),
+        db.func.count(Purchase.id).filter(Purchase.created_at >= week_ago)
+    ).one()
+    
+    total_users, active_users, recent_users, total_coins = user_stats
+    total_purchases, pending_purchases, recent_purchases = purchase_stats
+    
+    # Get top categories
+    category_stats = db.session.query(
+        Item.category,
+        db.func.count(Purchase.id).label('purchase_count')
+    ).join(Purchase).group_by(Item.category).all()
+    
+    return {
+        'overview': {
+            'total_users': total_users,
+            'active_users': active_users,
+            'total_purchases': total_purchases,
+            'pending_purchases': pending_purchases,
+            'recent_users': recent_users,
+            'recent_purchases': recent_purchases,
+            'total_coins': total_coins or 0
+        },
+        'categories': [
+            {'category': cat, 'purchases': count} 
+            for cat, count in category_stats
+        ]
+    }
 
 @api_bp.route('/stats/overview', methods=['GET'])
 def get_stats_overview():
     """Get overview statistics"""
     try:
-        # Get basic stats
-        total_users = User.query.count()
-        active_users = User.query.filter_by(is_active=True).count()
-        total_purchases = Purchase.query.count()
-        pending_purchases = Purchase.query.filter_by(status='pending').count()
-        
-        # Get recent activity (last 7 days)
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        recent_users = User.query.filter(User.created_at >= week_ago).count()
-        recent_purchases = Purchase.query.filter(Purchase.created_at >= week_ago).count()
-        
-        # Get total coins in circulation
-        total_coins = db.session.query(db.func.sum(User.coins)).scalar() or 0
-        
-        # Get top categories
-        category_stats = db.session.query(
-            Item.category,
-            db.func.count(Purchase.id).label('purchase_count')
-        ).join(Purchase).group_by(Item.category).all()
-        
-        return jsonify({
-            'overview': {
-                'total_users': total_users,
-                'active_users': active_users,
-                'total_purchases': total_purchases,
-                'pending_purchases': pending_purchases,
-                'recent_users': recent_users,
-                'recent_purchases': recent_purchases,
-                'total_coins': total_coins
-            },
-            'categories': [
-                {'category': cat, 'purchases': count} 
-                for cat, count in category_stats
-            ]
-        })
+        return ojsonify(_compute_stats_overview())
         
     except Exception as e:
         logger.error(f"Error getting stats overview: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
+
+@region.cache_on_arguments(expiration_time=300)
+def _compute_revenue_stats():
+    """Payment totals and the last 12 months of revenue (cached for 5 minutes)"""
+    # One GROUP BY over succeeded payments; totals are the sum of the groups
+    if db.engine.dialect.name == 'sqlite':
+        month = db.func.strftime('%Y-%m', PaymentRecord.created_at)
+    else:
+        month = db.func.to_char(db.func.date_trunc('month', PaymentRecord.created_at), 'YYYY-MM')
+    month = month.label('month')
+    
+    rows = db.session.query(
+        month,
+        db.func.count(PaymentRecord.id),
+        db.func.sum(PaymentRecord.amount_cents)
+    ).filter(PaymentRecord.status == 'succeeded').group_by(month).all()
+    
+    total_payments = sum(count for _, count, _ in rows)
+    total_revenue = sum(cents or 0 for _, _, cents in rows)
+    revenue_by_month = {key: cents or 0 for key, _, cents in rows}
+    
+    # Convert cents to dollars
+    total_revenue_dollars = total_revenue / 100
+    
+    # Last 12 calendar months, oldest first, zero-filled
+    now = datetime.utcnow()
+    monthly_revenue = []
+    for i in range(11, -1, -1):
+        year, month_index = divmod(now.year * 12 + now.month - 1 - i, 12)
+        key = f"{year:04d}-{month_index + 1:02d}"
+        monthly_revenue.append({
+            'month': key,
+            'revenue': revenue_by_month.get(key, 0) / 100
+        })
+    
+    return {
+        'total_payments': total_payments,
+        'total_revenue': total_revenue_dollars,
+        'monthly_revenue': monthly_revenue
+    }
 
 @api_bp.route('/stats/revenue', methods=['GET'])
 def get_revenue_stats():
     """Get revenue statistics"""
     try:
-        # Get payment statistics
-        total_payments = PaymentRecord.query.filter_by(status='succeeded').count()
-        total_revenue = db.session.query(
-            db.func.sum(PaymentRecord.amount_cents)
-        ).filter_by(status='succeeded').scalar() or 0
-        
-        # Convert cents to dollars
-        total_revenue_dollars = total_revenue / 100
-        
-        # Get monthly revenue (last 12 months)
-        monthly_revenue = []
-        for i in range(12):
-            month_start = datetime.utcnow().replace(day=1) - timedelta(days=30*i)
-            month_end = month_start + timedelta(days=30)
-            
-            revenue = db.session.query(
-                db.func.sum(PaymentRecord.amount_cents)
-            ).filter(
-                PaymentRecord.status == 'succeeded',
-                PaymentRecord.created_at >= month_start,
-                PaymentRecord.created_at < month_end
-            ).scalar() or 0
-            
-            monthly_revenue.append({
-                'month': month_start.strftime('%Y-%m'),
-                'revenue': revenue / 100
-            })
-        
-        return jsonify({
-            'total_payments': total_payments,
-            'total_revenue': total_revenue_dollars,
-            'monthly_revenue': list(reversed(monthly_revenue))
-        })
+        return ojsonify(_compute_revenue_stats())
         
     except Exception as e:
         logger.error(f"Error getting revenue stats: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojsonify({'error': 'Internal server error'}), 500
 
@@ -1,166 +1,265 @@
-from flask import Blueprint, request, jsonify, make_response
-from src.models.database import db, AuditLog, User
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from src.models.database import db, AuditLog, AuditHourlyCount, User
+from sqlalchemy import bindparam, delete, select
+from sqlalchemy.orm import contains_eager, joinedload
+from src.audit_queue import add_audit, log_audit
+from src.cache import region
+from src.responses import conditional_json_body, encode_json
+from src.audit_partitions import drop_partitions_before, is_partitioned
+from src.pagination import apply_keyset, clamp_page_size, count_rows, encode_cursor, include_total_requested, split_page
 from datetime import datetime, timedelta
 import csv
 import io
 import logging
+import queue
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
 audit_bp = Blueprint('audit', __name__)
 
+# Bytes of CSV buffered before each chunk of the export is sent
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Rows removed per DELETE/commit when pruning old audit logs
+CLEANUP_BATCH_SIZE = 5000
+
+def _log_with_user(log):
+    """Serialize an audit log with its (eager-loaded) user"""
+    log_dict = log.to_dict()
+    log_dict['user'] = log.user.to_dict() if log.user else None
+    return log_dict
+
+def _search_filter(search):
+    """
+    Match search anywhere in the username, action, details or IP address
+
+    Served by the pg_trgm indexes on PostgreSQL; wildcards in the search term
+    are matched literally. The escaped pattern is built once and bound as a
+    single parameter shared by all four ILIKEs.
+    """
+    escaped = search.replace('/', '//').replace('%', '/%').replace('_', '/_')
+    pattern = bindparam('search_pattern', f'%{escaped}%')
+    return db.or_(*(
+        column.ilike(pattern, escape='/')
+        for column in (User.username, AuditLog.action, AuditLog.details, AuditLog.ip_address)
+    ))
+
+# Lower bounds for the date_range filter; 'yesterday' is handled separately
+DATE_RANGE_DAYS = {'week': 7, 'month': 30, 'year': 365}
+
+def _apply_filters(query, args):
+    """
+    Apply the audit log list/export filters from request args
+
+    The search filter references User, so the caller must already have
+    outer-joined it when ``search`` is set.
+
+    Args:
+        query: Query over AuditLog
+        args: Request args with optional action, user_id, date_range, search
+
+    Returns:
+        The filtered query
+    """
+    action_filter = args.get('action')
+    user_id = args.get('user_id')
+    date_range = args.get('date_range')
+    search = args.get('search')
+    
+    if action_filter and action_filter != 'all':
+        query = query.filter(AuditLog.action == action_filter)
+    
+    if user_id and user_id != 'all':
+        query = query.filter(AuditLog.user_id == user_id)
+    
+    if date_range and date_range != 'all':
+        now = datetime.utcnow()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if date_range == 'today':
+            query = query.filter(AuditLog.timestamp >= today)
+        elif date_range == 'yesterday':
+            query = query.filter(AuditLog.timestamp >= today - timedelta(days=1), AuditLog.timestamp < today)
+        elif date_range in DATE_RANGE_DAYS:
+            query = query.filter(AuditLog.timestamp >= now - timedelta(days=DATE_RANGE_DAYS[date_range]))
+    
+    if search:
+        query = query.filter(_search_filter(search))
+    
+    return query
+
 @audit_bp.route('/audit-logs', methods=['GET'])
 def get_audit_logs():
     """Get audit logs with pagination and filtering"""
     try:
         page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 50))
-        action_filter = request.args.get('action')
-        user_id = request.args.get('user_id')
-        date_range = request.args.get('date_range')
+        limit = clamp_page_size(int(request.args.get('limit', 50)), 50)
         search = request.args.get('search')
+        cursor = request.args.get('cursor')
         
         query = AuditLog.query
-        
-        # Apply filters
-        if action_filter and action_filter != 'all':
-            query = query.filter(AuditLog.action == action_filter)
-        
-        if user_id and user_id != 'all':
-            query = query.filter(AuditLog.user_id == user_id)
-        
-        if date_range and date_range != 'all':
-            now = datetime.utcnow()
-            if date_range == 'today':
-                start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            elif date_range == 'yesterday':
-                start_date = (now - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-                end_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-                query = query.filter(AuditLog.timestamp >= start_date, AuditLog.timestamp < end_date)
-            elif date_range == 'week':
-                start_date = now - timedelta(days=7)
-            elif date_range == 'month':
-                start_date = now - timedelta(days=30)
-            elif date_range == 'year':
-                start_date = now - timedelta(days=365)
-            
-            if date_range != 'yesterday':
-                query = query.filter(AuditLog.timestamp >= start_date)
-        
         if search:
-            query = query.join(User, AuditLog.user_id == User.id, isouter=True).filter(
-                db.or_(
-                    User.username.ilike(f'%{search}%'),
-                    AuditLog.action.ilike(f'%{search}%'),
-                    AuditLog.details.ilike(f'%{search}%'),
-                    AuditLog.ip_address.ilike(f'%{search}%')
-                )
-            )
+            # Populate log.user from the search join instead of joining again
+            query = query.outerjoin(User, AuditLog.user_id == User.id).options(contains_eager(AuditLog.user))
+        else:
+            # Load each log's user in the same SELECT (many-to-one outer join)
+            query = query.options(joinedload(AuditLog.user))
+        query = _apply_filters(query, request.args)
+        
+        # Keyset pagination on (timestamp, id) when the client sends a cursor
+        if cursor is not None:
+            try:
+                logs = apply_keyset(query, AuditLog.timestamp, AuditLog.id, cursor, limit).all()
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            
+            logs, has_more = split_page(logs, limit)
+            return jsonify({
+                'logs': [_log_with_user(log) for log in logs],
+                'next_cursor': encode_cursor(logs[-1].timestamp, logs[-1].id) if has_more else None,
+                'has_more': has_more,
+                'limit': limit
+            })
         
         # Order by timestamp (newest first)
-        query = query.order_by(AuditLog.timestamp.desc())
+        query = query.order_by(AuditLog.timestamp.desc(), AuditLog.id.desc())
         
-        # Paginate
+        # Paginate; one extra row tells whether a next page exists
+        page = max(page, 1)
         offset = (page - 1) * limit
-        logs = query.offset(offset).limit(limit).all()
-        total = query.count()
+        logs, has_next = split_page(query.offset(offset).limit(limit + 1).all(), limit)
         
-        # Convert to dict with user information
-        logs_data = []
-        for log in logs:
-            log_dict = log.to_dict()
-            log_dict['user'] = log.user.to_dict() if log.user else None
-            logs_data.append(log_dict)
-        
-        return jsonify({
-            'logs': logs_data,
-            'total': total,
+        payload = {
+            'logs': [_log_with_user(log) for log in logs],
             'page': page,
             'limit': limit,
-            'total_pages': (total + limit - 1) // limit
-        })
+            'has_next': has_next
+        }
+        # The filtered COUNT(*) scans every match, so only run it on request
+        if include_total_requested():
+            total = count_rows(query, AuditLog.id)
+            payload['total'] = total
+            payload['total_pages'] = (total + limit - 1) // limit
+        
+        return jsonify(payload)
         
     except Exception as e:
         logger.error(f"Error fetching audit logs: {e}")
         return jsonify({'error': 'Failed to fetch audit logs'}), 500
 
+def _pg_copy_csv(statement):
+    """
+    Stream a SELECT as CSV through PostgreSQL's COPY ... TO STDOUT
+
+    The server formats the rows; this process only relays the bytes. COPY
+    runs on a helper thread feeding a small bounded queue, so a slow client
+    applies back-pressure instead of the export buffering up in memory.
+
+    Args:
+        statement: SELECT whose column labels become the CSV header
+
+    Yields:
+        CSV byte chunks
+    """
+    chunks = queue.Queue(maxsize=16)
+    cancelled = threading.Event()
+    failure = []
+    
+    class _QueueWriter:
+        def write(self, data):
+            while not cancelled.is_set():
+                try:
+                    chunks.put(data, timeout=1)
+                    return len(data)
+                except queue.Full:
+                    continue
+            raise IOError('Export cancelled by client')
+    
+    connection = db.engine.raw_connection()
+    
+    def copy():
+        try:
+            cursor = connection.cursor()
+            compiled = statement.compile(dialect=db.engine.dialect)
+            copy_sql = cursor.mogrify(f"COPY ({compiled}) TO STDOUT WITH CSV HEADER", compiled.params)
+            cursor.copy_expert(copy_sql, _QueueWriter(), size=EXPORT_CHUNK_SIZE)
+        except Exception as e:
+            failure.append(e)
+        finally:
+            chunks.put(None)
+    
+    thread = threading.Thread(target=copy, name='audit-export-copy', daemon=True)
+    thread.start()
+    try:
+        while (chunk := chunks.get()) is not None:
+            yield chunk
+        if failure:
+            logger.error(f"Error streaming audit log export: {failure[0]}")
+    finally:
+        cancelled.set()
+        thread.join()
+        connection.close()
+
 @audit_bp.route('/audit-logs/export', methods=['GET'])
 def export_audit_logs():
     """Export audit logs as CSV"""
     try:
-        action_filter = request.args.get('action')
-        user_id = request.args.get('user_id')
-        date_range = request.args.get('date_range')
-        search = request.args.get('search')
         format_type = request.args.get('format', 'csv')
         
-        query = AuditLog.query
-        
-        # Apply same filters as get_audit_logs
-        if action_filter and action_filter != 'all':
-            query = query.filter(AuditLog.action == action_filter)
-        
-        if user_id and user_id != 'all':
-            query = query.filter(AuditLog.user_id == user_id)
-        
-        if date_range and date_range != 'all':
-            now = datetime.utcnow()
-            if date_range == 'today':
-                start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            elif date_range == 'yesterday':
-                start_date = (now - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-                end_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-                query = query.filter(AuditLog.timestamp >= start_date, AuditLog.timestamp < end_date)
-            elif date_range == 'week':
-                start_date = now - timedelta(days=7)
-            elif date_range == 'month':
-                start_date = now - timedelta(days=30)
-            elif date_range == 'year':
-                start_date = now - timedelta(days=365)
-            
-            if date_range != 'yesterday':
-                query = query.filter(AuditLog.timestamp >= start_date)
-        
-        if search:
-            query = query.join(User, AuditLog.user_id == User.id, isouter=True).filter(
-                db.or_(
-                    User.username.ilike(f'%{search}%'),
-                    AuditLog.action.ilike(f'%{search}%'),
-                    AuditLog.details.ilike(f'%{search}%'),
-                    AuditLog.ip_address.ilike(f'%{search}%')
-                )
-            )
+        # Plain column rows with the username from an outer join; no ORM objects
+        query = db.session.query(
+            AuditLog.timestamp, AuditLog.user_id, User.username,
+            AuditLog.action, AuditLog.details, AuditLog.ip_address
+        ).outerjoin(User, AuditLog.user_id == User.id)
         
-        # Order by timestamp
-        logs = query.order_by(AuditLog.timestamp.desc()).limit(10000).all()  # Limit for performance
+        query = _apply_filters(query, request.args)
         
         if format_type == 'csv':
-            # Create CSV
-            output = io.StringIO()
-            writer = csv.writer(output)
+            headers = {'Content-Disposition': f'attachment; filename=audit-logs-{datetime.now().strftime("%Y%m%d")}.csv'}
+            query = query.order_by(AuditLog.timestamp.desc(), AuditLog.id.desc())
+            
+            if db.engine.dialect.driver == 'psycopg2':
+                # Let the server render the CSV; same columns as the fallback
+                statement = query.with_entities(
+                    db.func.to_char(AuditLog.timestamp, 'YYYY-MM-DD"T"HH24:MI:SS.US').label('Timestamp'),
+                    AuditLog.user_id.label('User ID'),
+                    db.func.coalesce(User.username, 'System').label('Username'),
+                    AuditLog.action.label('Action'),
+                    AuditLog.details.label('Details'),
+                    AuditLog.ip_address.label('IP Address')
+                ).statement
+                return Response(stream_with_context(_pg_copy_csv(statement)), mimetype='text/csv', headers=headers)
             
-            # Write header
-            writer.writerow([
-                'Timestamp', 'User ID', 'Username', 'Action', 'Details', 'IP Address'
-            ])
+            rows = query.yield_per(1000)
             
-            # Write data
-            for log in logs:
+            def generate():
+                # Rows are written from plain column tuples and flushed in
+                # ~64 KB chunks, so memory stays flat and the download starts
+                # before the query finishes
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
                 writer.writerow([
-                    log.timestamp.isoformat(),
-                    log.user_id or '',
-                    log.user.username if log.user else 'System',
-                    log.action,
-                    log.details or '',
-                    log.ip_address or ''
+                    'Timestamp', 'User ID', 'Username', 'Action', 'Details', 'IP Address'
                 ])
+                
+                for timestamp, log_user_id, username, action, details, ip_address in rows:
+                    writer.writerow((
+                        timestamp.isoformat(),
+                        log_user_id or '',
+                        username or 'System',
+                        action,
+                        details or '',
+                        ip_address or ''
+                    ))
+                    if buffer.tell() >= EXPORT_CHUNK_SIZE:
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate(0)
+                
+                yield buffer.getvalue()
             
-            # Create response
-            response = make_response(output.getvalue())
-            response.headers['Content-Type'] = 'text/csv'
-            response.headers['Content-Disposition'] = f'attachment; filename=audit-logs-{datetime.now().strftime("%Y%m%d")}.csv'
-            
-            return response
+            return Response(stream_with_context(generate()), mimetype='text/csv', headers=headers)
         
         else:
             return jsonify({'error': 'Unsupported format'}), 400
@@ -169,84 +268,93 @@ def export_audit_logs():
         logger.error(f"Error exporting audit logs: {e}")
         return jsonify({'error': 'Failed to export audit logs'}), 500
 
+@region.cache_on_arguments(expiration_time=60)
+def audit_stats_body():
+    """
+    Encoded audit statistics and their ETag (cached for a minute)
+
+    The dogpile lock lets one request recompute an expired entry while the
+    others keep getting the previous value.
+    """
+    day_ago = datetime.utcnow() - timedelta(days=1)
+    
+    # Scalar counters in one pass: COUNT(*) FILTER (WHERE ...) for each
+    total_logs, recent_logs, system_actions, error_logs = db.session.query(
+        db.func.count(AuditLog.id),
+        db.func.count(AuditLog.id).filter(AuditLog.timestamp >= day_ago),
+        db.func.count(AuditLog.id).filter(AuditLog.user_id.is_(None)),
+        # Error rate (actions containing 'error' or 'failed')
+        db.func.count(AuditLog.id).filter(db.or_(
+            AuditLog.action.like('%error%'),
+            AuditLog.action.like('%failed%')
+        ))
+    ).one()
+    # Every log is either a system action or a user action
+    user_actions = total_logs - system_actions
+    
+    # Logs by action type
+    action_stats = db.session.query(
+        AuditLog.action,
+        db.func.count(AuditLog.id).label('count')
+    ).group_by(AuditLog.action).order_by(
+        db.func.count(AuditLog.id).desc()
+    ).all()
+    
+    # User activity (top 10 most active users)
+    user_activity = db.session.query(
+        User.username,
+        db.func.count(AuditLog.id).label('activity_count')
+    ).join(AuditLog, User.id == AuditLog.user_id).group_by(
+        User.id
+    ).order_by(
+        db.func.count(AuditLog.id).desc()
+    ).limit(10).all()
+    
+    # Activity by hour (last 24 full hours) from the trigger-maintained
+    # rollup; hours without rows are filled in below
+    current_hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    hourly_counts = dict(db.session.query(AuditHourlyCount.hour, AuditHourlyCount.count).filter(
+        AuditHourlyCount.hour >= current_hour - timedelta(hours=24),
+        AuditHourlyCount.hour < current_hour
+    ).all())
+    
+    hourly_activity = []
+    for i in range(24):
+        hour_start = current_hour - timedelta(hours=i+1)
+        hourly_activity.append({
+            'hour': hour_start.strftime('%H:00'),
+            'count': hourly_counts.get(hour_start, 0)
+        })
+    
+    return encode_json({
+        'total_logs': total_logs,
+        'recent_logs': recent_logs,
+        'system_actions': system_actions,
+        'user_actions': user_actions,
+        'error_logs': error_logs,
+        'error_rate': (error_logs / total_logs * 100) if total_logs > 0 else 0,
+        'action_stats': [
+            {
+                'action': stat.action,
+                'count': stat.count
+            }
+            for stat in action_stats
+        ],
+        'user_activity': [
+            {
+                'username': activity.username,
+                'activity_count': activity.activity_count
+            }
+            for activity in user_activity
+        ],
+        'hourly_activity': list(reversed(hourly_activity))  # Most recent first
+    })
+
 @audit_bp.route('/audit-logs/stats', methods=['GET'])
 def get_audit_stats():
     """Get audit log statistics"""
     try:
-        # Total logs
-        total_logs = AuditLog.query.count()
-        
-        # Logs by action type
-        action_stats = db.session.query(
-            AuditLog.action,
-            db.func.count(AuditLog.id).label('count')
-        ).group_by(AuditLog.action).order_by(
-            db.func.count(AuditLog.id).desc()
-        ).all()
-        
-        # Recent activity (last 24 hours)
-        day_ago = datetime.utcnow() - timedelta(days=1)
-        recent_logs = AuditLog.query.filter(AuditLog.timestamp >= day_ago).count()
-        
-        # User activity (top 10 most active users)
-        user_activity = db.session.query(
-            User.username,
-            db.func.count(AuditLog.id).label('activity_count')
-        ).join(AuditLog, User.id == AuditLog.user_id).group_by(
-            User.id
-        ).order_by(
-            db.func.count(AuditLog.id).desc()
-        ).limit(10).all()
-        
-        # System vs user actions
-        system_actions = AuditLog.query.filter(AuditLog.user_id.is_(None)).count()
-        user_actions = AuditLog.query.filter(AuditLog.user_id.isnot(None)).count()
-        
-        # Error rate (actions containing 'error' or 'failed')
-        error_logs = AuditLog.query.filter(
-            db.or_(
-                AuditLog.action.like('%error%'),
-                AuditLog.action.like('%failed%')
-            )
-        ).count()
-        
-        # Activity by hour (last 24 hours)
-        hourly_activity = []
-        for i in range(24):
-            hour_start = (datetime.utcnow() - timedelta(hours=i+1)).replace(minute=0, second=0, microsecond=0)
-            hour_end = hour_start + timedelta(hours=1)
-            count = AuditLog.query.filter(
-                AuditLog.timestamp >= hour_start,
-                AuditLog.timestamp < hour_end
-            ).count()
-            hourly_activity.append({
-                'hour': hour_start.strftime('%H:00'),
-                'count': count
-            })
-        
-        return jsonify({
-            'total_logs': total_logs,
-            'recent_logs': recent_logs,
-            'system_actions': system_actions,
-            'user_actions': user_actions,
-            'error_logs': error_logs,
-            'error_rate': (error_logs / total_logs * 100) if total_logs > 0 else 0,
-            'action_stats': [
-                {
-                    'action': stat.action,
-                    'count': stat.count
-                }
-                for stat in action_stats
-            ],
-            'user_activity': [
-                {
-                    'username': activity.username,
-                    'activity_count': activity.activity_count
-                }
-                for activity in user_activity
-            ],
-            'hourly_activity': list(reversed(hourly_activity))  # Most recent first
-        })
+        return conditional_json_body(*audit_stats_body())
         
     except Exception as e:
         logger.error(f"Error fetching audit stats: {e}")
@@ -293,22 +401,30 @@ def cleanup_old_logs():
         # Calculate cutoff date
         cutoff_date = datetime.utcnow() - timedelta(days=days_to_keep)
         
-        # Delete old logs
-        deleted_count = AuditLog.query.filter(
-            AuditLog.timestamp < cutoff_date
-        ).delete()
-        
-        db.session.commit()
-        
-        # Create audit log for this action
-        cleanup_log = AuditLog(
+        # Whole expired months go with DROP TABLE when audit_logs is partitioned
+        deleted_count = drop_partitions_before(cutoff_date) if is_partitioned() else 0
+        
+        # Delete the remaining old logs in bounded batches, committing each one
+        # so locks and WAL stay small and queued audit inserts can interleave
+        batch = select(AuditLog.id).where(AuditLog.timestamp < cutoff_date).limit(CLEANUP_BATCH_SIZE)
+        while True:
+            result = db.session.execute(delete(AuditLog).where(AuditLog.id.in_(batch.scalar_subquery())))
+            db.session.commit()
+            deleted_count += result.rowcount
+            if result.rowcount < CLEANUP_BATCH_SIZE:
+                break
+            time.sleep(0)
+        db.session.execute(delete(AuditHourlyCount).where(AuditHourlyCount.hour < cutoff_date))
+        
+        # Audit the cleanup in the same transaction as its last step
+        add_audit(
             user_id=data.get('admin_user_id'),
             action='admin_action',
             details=f'{{"action": "audit_cleanup", "deleted_count": {deleted_count}, "days_kept": {days_to_keep}}}',
             ip_address=request.headers.get('X-Forwarded-For', request.remote_addr)
         )
-        db.session.add(cleanup_log)
         db.session.commit()
+        audit_stats_body.invalidate()
         
         return jsonify({
             'message': f'Deleted {deleted_count} old audit logs',
@@ -322,17 +438,10 @@ def cleanup_old_logs():
         return jsonify({'error': 'Failed to cleanup audit logs'}), 500
 
 def log_action(user_id, action, details=None, ip_address=None):
-    """Helper function to create audit log entries"""
-    try:
-        audit_log = AuditLog(
-            user_id=user_id,
-            action=action,
-            details=details,
-            ip_address=ip_address
-        )
-        db.session.add(audit_log)
-        db.session.commit()
-    except Exception as e:
-        logger.error(f"Error logging action {action}: {e}")
-        db.session.rollback()
-
+    """Helper function to queue audit log entries for the background writer"""
+    log_audit(
+        user_id=user_id,
+        action=action,
+        details=details,
+        ip_address=ip_address
+    )
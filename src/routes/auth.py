@@ -1,8 +1,13 @@
 from flask import Blueprint, request, jsonify, redirect, session, url_for
-from src.models.database import db, User, AuditLog
-from src.security import security_manager, require_auth, require_admin, security_check
+from src.models.database import db, User, AuditLog, upsert_insert
+from src.security import security_manager, require_auth, require_admin, security_check, get_user
+from src.audit_queue import log_audit
+import jwt
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+from urllib.parse import quote
 import logging
 from datetime import datetime
 
@@ -15,6 +20,56 @@ DISCORD_CLIENT_SECRET = os.getenv('DISCORD_CLIENT_SECRET')
 DISCORD_REDIRECT_URI = os.getenv('DISCORD_REDIRECT_URI')
 DISCORD_API_ENDPOINT = 'https://discord.com/api/v10'
 
+# (connect, read) timeout for Discord API calls
+DISCORD_TIMEOUT = (3.05, 10)
+
+# With DISCORD_OPENID enabled the authorize URL also asks for the openid
+# scope; a signed id_token in the token response then stands in for the
+# /users/@me round-trip
+DISCORD_OPENID = os.getenv('DISCORD_OPENID', 'false').lower() == 'true'
+DISCORD_SCOPES = 'openid identify email' if DISCORD_OPENID else 'identify email'
+DISCORD_ISSUER = 'https://discord.com'
+# Signing keys are fetched once and reused for an hour
+discord_jwks = jwt.PyJWKClient(f"{DISCORD_API_ENDPOINT}/oauth2/keys", lifespan=3600, timeout=3)
+
+# Shared keep-alive pool so logins reuse TLS connections to discord.com.
+# Retries cover idempotent requests only; the single-use code exchange POST
+# is never replayed.
+discord_http = requests.Session()
+discord_http.mount('https://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=(502, 503, 504), raise_on_status=False)
+))
+
+def _id_token_user(id_token):
+    """
+    Discord user fields from a verified OpenID Connect id_token
+
+    Returns:
+        Dict with id, username and email, or None when the token is missing,
+        invalid or lacks a username (the caller then asks /users/@me)
+    """
+    if not id_token:
+        return None
+    try:
+        signing_key = discord_jwks.get_signing_key_from_jwt(id_token)
+        claims = jwt.decode(
+            id_token,
+            signing_key.key,
+            algorithms=['RS256'],
+            audience=DISCORD_CLIENT_ID,
+            issuer=DISCORD_ISSUER
+        )
+    except Exception as e:
+        logger.warning(f"Discord id_token rejected: {e}")
+        return None
+    
+    username = claims.get('preferred_username') or claims.get('name')
+    if not username:
+        return None
+    return {'id': claims.get('sub'), 'username': username, 'email': claims.get('email')}
+
 @auth_bp.route('/login', methods=['GET'])
 @security_check
 def discord_login():
@@ -30,7 +85,7 @@ def discord_login():
             f"?client_id={DISCORD_CLIENT_ID}"
             f"&redirect_uri={DISCORD_REDIRECT_URI}"
             f"&response_type=code"
-            f"&scope=identify%20email"
+            f"&scope={quote(DISCORD_SCOPES)}"
             f"&state={state}"
         )
         
@@ -67,10 +122,11 @@ def discord_callback():
             'redirect_uri': DISCORD_REDIRECT_URI
         }
         
-        token_response = requests.post(
+        token_response = discord_http.post(
             f"{DISCORD_API_ENDPOINT}/oauth2/token",
             data=token_data,
-            headers={'Content-Type': 'application/x-www-form-urlencoded'}
+            headers={'Content-Type': 'application/x-www-form-urlencoded'},
+            timeout=DISCORD_TIMEOUT
         )
         
         if not token_response.ok:
@@ -80,17 +136,21 @@ def discord_callback():
         token_json = token_response.json()
         access_token = token_json.get('access_token')
         
-        # Get user information from Discord
-        user_response = requests.get(
-            f"{DISCORD_API_ENDPOINT}/users/@me",
-            headers={'Authorization': f"Bearer {access_token}"}
-        )
-        
-        if not user_response.ok:
-            logger.error(f"Discord user fetch failed: {user_response.text}")
-            return jsonify({'error': 'Failed to fetch user data'}), 400
+        # Take the user from the id_token when Discord sent one, else fetch it
+        discord_user = _id_token_user(token_json.get('id_token'))
+        if discord_user is None:
+            user_response = discord_http.get(
+                f"{DISCORD_API_ENDPOINT}/users/@me",
+                headers={'Authorization': f"Bearer {access_token}"},
+                timeout=DISCORD_TIMEOUT
+            )
+            
+            if not user_response.ok:
+                logger.error(f"Discord user fetch failed: {user_response.text}")
+                return jsonify({'error': 'Failed to fetch user data'}), 400
+            
+            discord_user = user_response.json()
         
-        discord_user = user_response.json()
         discord_id = discord_user.get('id')
         username = discord_user.get('username')
         email = discord_user.get('email')
@@ -99,20 +159,28 @@ def discord_callback():
         if not security_manager.validate_discord_id(discord_id):
             return jsonify({'error': 'Invalid Discord ID'}), 400
         
-        # Get or create user
-        user = User.query.filter_by(discord_id=discord_id).first()
-        
-        if not user:
-            # Create new user
-            user = User(
-                discord_id=discord_id,
-                username=security_manager.sanitize_input(username),
-                email=security_manager.sanitize_input(email) if email else None
-            )
-            db.session.add(user)
-            db.session.commit()
-            
-            # Log user creation
+        # Create or refresh the user in one INSERT ... ON CONFLICT; a row
+        # whose created_at is this request's timestamp was just inserted
+        now = datetime.utcnow()
+        stmt = upsert_insert(User).values(
+            discord_id=str(discord_id),
+            username=security_manager.sanitize_input(username),
+            email=security_manager.sanitize_input(email) if email else None,
+            created_at=now,
+            updated_at=now
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.discord_id],
+            set_={
+                'username': stmt.excluded.username,
+                'email': db.func.coalesce(stmt.excluded.email, User.email),
+                'updated_at': now
+            }
+        ).returning(User)
+        user = db.session.scalars(stmt, execution_options={'populate_existing': True}).one()
+        
+        # Audited in the same transaction as the upsert
+        if user.created_at == now:
             security_manager.audit_log(
                 user.id,
                 'user_created',
@@ -120,19 +188,13 @@ def discord_callback():
                 request.remote_addr
             )
         else:
-            # Update existing user info
-            user.username = security_manager.sanitize_input(username)
-            if email:
-                user.email = security_manager.sanitize_input(email)
-            db.session.commit()
-            
-            # Log login
             security_manager.audit_log(
                 user.id,
                 'user_login',
                 f"User logged in: {username}",
                 request.remote_addr
             )
+        db.session.commit()
         
         # Generate JWT token
         jwt_token = security_manager.generate_jwt_token(user.id)
@@ -155,10 +217,13 @@ def discord_callback():
 def verify_token():
     """Verify JWT token and return user info"""
     try:
-        user = User.query.get(request.user_id)
+        user = get_user(request.user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
+        if not user.is_active:
+            return jsonify({'error': 'Account disabled'}), 403
+        
         return jsonify({
             'valid': True,
             'user': user.to_dict()
@@ -173,13 +238,14 @@ def verify_token():
 def logout():
     """Logout user (invalidate token on client side)"""
     try:
-        user = User.query.get(request.user_id)
+        user = get_user(request.user_id)
         if user:
-            security_manager.audit_log(
-                user.id,
-                'user_logout',
-                f"User logged out: {user.username}",
-                request.remote_addr
+            # Access log only; no state changed, so it can go through the queue
+            log_audit(
+                user_id=user.id,
+                action='user_logout',
+                details=f"User logged out: {user.username}",
+                ip_address=request.remote_addr
             )
         
         return jsonify({'message': 'Logout successful'})
@@ -188,34 +254,43 @@ def logout():
         logger.error(f"Error during logout: {e}")
         return jsonify({'error': 'Logout failed'}), 500
 
+def _recent_with_total(model, user_id, limit=5):
+    """
+    Newest rows of model for a user together with the user's total row count
+
+    COUNT(*) OVER () is evaluated before LIMIT, so every returned row carries
+    the full total and no separate COUNT query is needed.
+
+    Returns:
+        (rows, total) tuple
+    """
+    rows = db.session.query(model, db.func.count().over().label('total')).filter(
+        model.user_id == user_id
+    ).order_by(model.created_at.desc(), model.id.desc()).limit(limit).all()
+    
+    return [row[0] for row in rows], rows[0].total if rows else 0
+
 @auth_bp.route('/profile', methods=['GET'])
 @require_auth
 def get_profile():
     """Get user profile information"""
     try:
-        user = User.query.get(request.user_id)
+        user = get_user(request.user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
         # Get additional profile data
         from src.models.database import Transaction, Purchase
         
-        # Recent transactions
-        recent_transactions = Transaction.query.filter_by(
-            user_id=user.id
-        ).order_by(Transaction.created_at.desc()).limit(5).all()
-        
-        # Recent purchases
-        recent_purchases = Purchase.query.filter_by(
-            user_id=user.id
-        ).order_by(Purchase.created_at.desc()).limit(5).all()
+        recent_transactions, total_transactions = _recent_with_total(Transaction, user.id)
+        recent_purchases, total_purchases = _recent_with_total(Purchase, user.id)
         
         profile_data = user.to_dict()
         profile_data.update({
             'recent_transactions': [t.to_dict() for t in recent_transactions],
             'recent_purchases': [p.to_dict() for p in recent_purchases],
-            'total_transactions': Transaction.query.filter_by(user_id=user.id).count(),
-            'total_purchases': Purchase.query.filter_by(user_id=user.id).count()
+            'total_transactions': total_transactions,
+            'total_purchases': total_purchases
         })
         
         return jsonify(profile_data)
@@ -230,7 +305,7 @@ def update_profile():
     """Update user profile"""
     try:
         data = request.get_json()
-        user = User.query.get(request.user_id)
+        user = get_user(request.user_id)
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -251,15 +326,15 @@ def update_profile():
                 user.email = email
         
         user.updated_at = datetime.utcnow()
-        db.session.commit()
         
-        # Log profile update
+        # Log profile update in the same transaction
         security_manager.audit_log(
             user.id,
             'profile_updated',
             "User profile updated",
             request.remote_addr
         )
+        db.session.commit()
         
         return jsonify({
             'message': 'Profile updated successfully',
@@ -275,7 +350,7 @@ def update_profile():
 def check_admin():
     """Check if user has admin privileges"""
     try:
-        user = User.query.get(request.user_id)
+        user = get_user(request.user_id)
         return jsonify({
             'is_admin': True,
             'user': user.to_dict()
@@ -292,8 +367,6 @@ def get_active_sessions():
     try:
         # In a real implementation, you'd track active sessions
         # For now, just return current session info
-        user = User.query.get(request.user_id)
-        
         sessions = [{
             'id': 'current',
             'ip_address': request.remote_addr,
@@ -1,18 +1,108 @@
 from flask import Blueprint, request, jsonify
-from src.models.database import db, BotConfig
+from src.models.database import db, BotConfig, upsert_insert
+from src.routes.api import bot_config_entries, invalidate_bot_config
+from src.responses import conditional_json_body, encode_json
 from datetime import datetime
+from sqlalchemy import delete, insert
 import logging
 
 logger = logging.getLogger(__name__)
 
 bot_config_bp = Blueprint('bot_config', __name__)
 
+# Default bot configuration as (key, value, description)
+DEFAULT_CONFIGS = (
+    ('currency_name', 'Coins', 'Name of the currency'),
+    ('currency_symbol', '💰', 'Symbol representing the currency'),
+    ('currency_emoji', '🪙', 'Emoji for the currency'),
+    ('coins_per_message', '1', 'Coins earned per message'),
+    ('message_cooldown', '60', 'Cooldown between coin earnings (seconds)'),
+    ('max_daily_coins', '100', 'Maximum coins per day from messages'),
+    ('welcome_message', 'Welcome to the server! You can earn coins by chatting and use them to buy items!', 'Bot welcome message'),
+    ('purchase_channel', '', 'Channel ID for purchase notifications'),
+    ('status_update_interval', '300', 'Server status update interval (seconds)'),
+    ('enable_daily_bonus', 'false', 'Enable daily login bonus'),
+    ('daily_bonus_amount', '50', 'Amount of daily bonus coins'),
+    ('enable_level_multiplier', 'false', 'Enable level-based earning multiplier'),
+    ('level_multiplier_rate', '0.1', 'Multiplier rate per level'),
+)
+
+# Configuration categories for the dashboard; encoded once at import
+CATEGORIES_BODY, CATEGORIES_ETAG = encode_json({
+    'currency': {
+        'name': 'Currency Settings',
+        'description': 'Configure currency appearance and behavior',
+        'keys': ['currency_name', 'currency_symbol', 'currency_emoji']
+    },
+    'earning': {
+        'name': 'Earning Settings',
+        'description': 'Configure how users earn currency',
+        'keys': ['coins_per_message', 'message_cooldown', 'max_daily_coins']
+    },
+    'bonuses': {
+        'name': 'Bonus Features',
+        'description': 'Additional earning mechanics',
+        'keys': ['enable_daily_bonus', 'daily_bonus_amount', 'enable_level_multiplier', 'level_multiplier_rate']
+    },
+    'bot': {
+        'name': 'Bot Configuration',
+        'description': 'General bot settings',
+        'keys': ['welcome_message', 'purchase_channel', 'status_update_interval']
+    }
+})
+
+def _number_validator(cast, minimum, maximum, type_message):
+    """
+    Validator for a numeric setting: parse with cast, then range-check
+
+    JSON numbers of the target type are range-checked as they are; only
+    strings and other types go through cast.
+    """
+    def validate(value):
+        if type(value) is cast:
+            number = value
+        else:
+            try:
+                number = cast(value)
+            except (TypeError, ValueError):
+                return type_message
+        if number < minimum:
+            return f'Value must be at least {minimum}'
+        if number > maximum:
+            return f'Value must be at most {maximum}'
+        return None
+    return validate
+
+def _length_validator(max_length):
+    """Validator for a text setting with a maximum length"""
+    def validate(value):
+        if len(str(value)) > max_length:
+            return f'Value must be at most {max_length} characters'
+        return None
+    return validate
+
+# Per-key validators built once; each returns an error message or None
+CONFIG_VALIDATORS = {
+    'coins_per_message': _number_validator(int, 0, 100, 'Value must be a valid integer'),
+    'message_cooldown': _number_validator(int, 0, 3600, 'Value must be a valid integer'),
+    'max_daily_coins': _number_validator(int, 0, 10000, 'Value must be a valid integer'),
+    'status_update_interval': _number_validator(int, 60, 3600, 'Value must be a valid integer'),
+    'daily_bonus_amount': _number_validator(int, 0, 1000, 'Value must be a valid integer'),
+    'level_multiplier_rate': _number_validator(float, 0, 1, 'Value must be a valid number'),
+    'currency_name': _length_validator(50),
+    'currency_symbol': _length_validator(10),
+    'currency_emoji': _length_validator(10),
+    'welcome_message': _length_validator(500),
+    'purchase_channel': _length_validator(20)
+}
+
 @bot_config_bp.route('/bot-config', methods=['GET'])
 def get_bot_config():
     """Get all bot configuration settings"""
     try:
-        configs = BotConfig.query.all()
-        return jsonify([config.to_dict() for config in configs])
+        # Served from the cached, pre-encoded list
+        list_body, _ = bot_config_entries()
+        return conditional_json_body(*list_body)
     except Exception as e:
         logger.error(f"Error fetching bot config: {e}")
         return jsonify({'error': 'Failed to fetch configuration'}), 500
@@ -21,11 +111,12 @@ def get_bot_config():
 def get_config_by_key(key):
     """Get a specific configuration by key"""
     try:
-        config = BotConfig.query.filter_by(key=key).first()
-        if not config:
+        _, by_key = bot_config_entries()
+        entry = by_key.get(key)
+        if entry is None:
             return jsonify({'error': 'Configuration not found'}), 404
         
-        return jsonify(config.to_dict())
+        return conditional_json_body(*entry)
     except Exception as e:
         logger.error(f"Error fetching config {key}: {e}")
         return jsonify({'error': 'Failed to fetch configuration'}), 500
@@ -39,24 +130,25 @@ def update_config(key):
         if 'value' not in data:
             return jsonify({'error': 'Value is required'}), 400
         
-        config = BotConfig.query.filter_by(key=key).first()
-        
-        if not config:
-            # Create new config if it doesn't exist
-            config = BotConfig(
-                key=key,
-                value=str(data['value']),
-                description=data.get('description', '')
-            )
-            db.session.add(config)
-        else:
-            # Update existing config
-            config.value = str(data['value'])
-            if 'description' in data:
-                config.description = data['description']
-            config.updated_at = datetime.utcnow()
+        # Create or update in one INSERT ... ON CONFLICT ... RETURNING; the
+        # description only changes when the request sends one
+        now = datetime.utcnow()
+        stmt = upsert_insert(BotConfig).values(
+            key=key,
+            value=str(data['value']),
+            description=data.get('description', ''),
+            updated_at=now
+        )
+        updates = {'value': stmt.excluded.value, 'updated_at': now}
+        if 'description' in data:
+            updates['description'] = stmt.excluded.description
+        config = db.session.scalars(
+            stmt.on_conflict_do_update(index_elements=[BotConfig.key], set_=updates).returning(BotConfig),
+            execution_options={'populate_existing': True}
+        ).one()
         
         db.session.commit()
+        invalidate_bot_config()
         return jsonify(config.to_dict())
         
     except Exception as e:
@@ -73,36 +165,58 @@ def bulk_update_config():
         if 'configs' not in data or not isinstance(data['configs'], list):
             return jsonify({'error': 'configs array is required'}), 400
         
-        updated_configs = []
-        
+        # Last entry wins for a repeated key; one statement may not touch a
+        # row twice. Every value is checked against its key's rules before
+        # the DB is touched.
+        now = datetime.utcnow()
+        rows = {}
+        errors = {}
         for config_data in data['configs']:
-            if 'key' not in config_data or 'value' not in config_data:
+            if not isinstance(config_data, dict) or 'key' not in config_data or 'value' not in config_data:
+                continue
+            key, value = config_data['key'], config_data['value']
+            if not isinstance(key, str) or not key:
+                errors[str(key)] = 'Key must be a non-empty string'
+                continue
+            validator = CONFIG_VALIDATORS.get(key)
+            error = validator(value) if validator else None
+            if error:
+                errors[key] = error
                 continue
-            
-            key = config_data['key']
-            value = str(config_data['value'])
-            description = config_data.get('description', '')
-            
-            config = BotConfig.query.filter_by(key=key).first()
-            
-            if not config:
-                # Create new config
-                config = BotConfig(
-                    key=key,
-                    value=value,
-                    description=description
-                )
-                db.session.add(config)
-            else:
-                # Update existing config
-                config.value = value
-                if description:
-                    config.description = description
-                config.updated_at = datetime.utcnow()
-            
-            updated_configs.append(config)
+            errors.pop(key, None)
+            rows[key] = {
+                'key': key,
+                'value': str(value),
+                'description': config_data.get('description', ''),
+                'updated_at': now
+            }
+        
+        if errors:
+            return jsonify({'error': 'Invalid configuration values', 'details': errors}), 400
+        
+        # Nothing to write: skip the transaction and keep the caches warm
+        if not rows:
+            return jsonify([])
+        
+        # One INSERT ... ON CONFLICT ... RETURNING for every posted key; an
+        # empty description leaves the stored one in place
+        stmt = upsert_insert(BotConfig).values(list(rows.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[BotConfig.key],
+            set_={
+                'value': stmt.excluded.value,
+                'description': db.func.coalesce(db.func.nullif(stmt.excluded.description, ''), BotConfig.description),
+                'updated_at': stmt.excluded.updated_at
+            }
+        ).returning(BotConfig)
+        configs = {
+            config.key: config
+            for config in db.session.scalars(stmt, execution_options={'populate_existing': True})
+        }
+        updated_configs = [configs[key] for key in rows]
         
         db.session.commit()
+        invalidate_bot_config()
         return jsonify([config.to_dict() for config in updated_configs])
         
     except Exception as e:
@@ -114,13 +228,14 @@ def bulk_update_config():
 def delete_config(key):
     """Delete a configuration"""
     try:
-        config = BotConfig.query.filter_by(key=key).first()
-        
-        if not config:
+        # One DELETE; no row matched means the key does not exist
+        result = db.session.execute(delete(BotConfig).where(BotConfig.key == key))
+        if result.rowcount == 0:
+            db.session.rollback()
             return jsonify({'error': 'Configuration not found'}), 404
         
-        db.session.delete(config)
         db.session.commit()
+        invalidate_bot_config()
         
         return jsonify({'message': 'Configuration deleted successfully'})
         
@@ -133,35 +248,21 @@ def delete_config(key):
 def reset_to_defaults():
     """Reset all configurations to default values"""
     try:
-        # Default bot configuration
-        default_configs = [
-            ('currency_name', 'Coins', 'Name of the currency'),
-            ('currency_symbol', '💰', 'Symbol representing the currency'),
-            ('currency_emoji', '🪙', 'Emoji for the currency'),
-            ('coins_per_message', '1', 'Coins earned per message'),
-            ('message_cooldown', '60', 'Cooldown between coin earnings (seconds)'),
-            ('max_daily_coins', '100', 'Maximum coins per day from messages'),
-            ('welcome_message', 'Welcome to the server! You can earn coins by chatting and use them to buy items!', 'Bot welcome message'),
-            ('purchase_channel', '', 'Channel ID for purchase notifications'),
-            ('status_update_interval', '300', 'Server status update interval (seconds)'),
-            ('enable_daily_bonus', 'false', 'Enable daily login bonus'),
-            ('daily_bonus_amount', '50', 'Amount of daily bonus coins'),
-            ('enable_level_multiplier', 'false', 'Enable level-based earning multiplier'),
-            ('level_multiplier_rate', '0.1', 'Multiplier rate per level'),
-        ]
-        
         # Delete all existing configs
         BotConfig.query.delete()
         
-        # Add default configs
-        for key, value, description in default_configs:
-            config = BotConfig(key=key, value=value, description=description)
-            db.session.add(config)
+        # Add every default in one multi-row INSERT that also returns them
+        now = datetime.utcnow()
+        configs = db.session.scalars(
+            insert(BotConfig).values([
+                {'key': key, 'value': value, 'description': description, 'updated_at': now}
+                for key, value, description in DEFAULT_CONFIGS
+            ]).returning(BotConfig)
+        ).all()
         
         db.session.commit()
+        invalidate_bot_config()
         
-        # Return all configs
-        configs = BotConfig.query.all()
         return jsonify([config.to_dict() for config in configs])
         
     except Exception as e:
@@ -172,30 +273,11 @@ def reset_to_defaults():
 @bot_config_bp.route('/bot-config/categories', methods=['GET'])
 def get_config_categories():
     """Get configuration categories for organization"""
-    categories = {
-        'currency': {
-            'name': 'Currency Settings',
-            'description': 'Configure currency appearance and behavior',
-            'keys': ['currency_name', 'currency_symbol', 'currency_emoji']
-        },
-        'earning': {
-            'name': 'Earning Settings',
-            'description': 'Configure how users earn currency',
-            'keys': ['coins_per_message', 'message_cooldown', 'max_daily_coins']
-        },
-        'bonuses': {
-            'name': 'Bonus Features',
-            'description': 'Additional earning mechanics',
-            'keys': ['enable_daily_bonus', 'daily_bonus_amount', 'enable_level_multiplier', 'level_multiplier_rate']
-        },
-        'bot': {
-            'name': 'Bot Configuration',
-            'description': 'General bot settings',
-            'keys': ['welcome_message', 'purchase_channel', 'status_update_interval']
-        }
-    }
-    
-    return jsonify(categories)
+    response = conditional_json_body(CATEGORIES_BODY, CATEGORIES_ETAG)
+    # Static for the lifetime of a deploy
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response
 
 @bot_config_bp.route('/bot-config/validate', methods=['POST'])
 def validate_config():
@@ -209,50 +291,13 @@ def validate_config():
         key = data['key']
         value = data['value']
         
-        # Validation rules
-        validation_rules = {
-            'coins_per_message': {'type': 'int', 'min': 0, 'max': 100},
-            'message_cooldown': {'type': 'int', 'min': 0, 'max': 3600},
-            'max_daily_coins': {'type': 'int', 'min': 0, 'max': 10000},
-            'status_update_interval': {'type': 'int', 'min': 60, 'max': 3600},
-            'daily_bonus_amount': {'type': 'int', 'min': 0, 'max': 1000},
-            'level_multiplier_rate': {'type': 'float', 'min': 0, 'max': 1},
-            'currency_name': {'type': 'str', 'max_length': 50},
-            'currency_symbol': {'type': 'str', 'max_length': 10},
-            'currency_emoji': {'type': 'str', 'max_length': 10},
-            'welcome_message': {'type': 'str', 'max_length': 500},
-            'purchase_channel': {'type': 'str', 'max_length': 20}
-        }
-        
-        if key not in validation_rules:
+        validator = CONFIG_VALIDATORS.get(key)
+        if validator is None:
             return jsonify({'valid': True, 'message': 'No validation rules for this key'})
         
-        rule = validation_rules[key]
-        
-        # Type validation
-        if rule['type'] == 'int':
-            try:
-                int_value = int(value)
-                if 'min' in rule and int_value < rule['min']:
-                    return jsonify({'valid': False, 'message': f'Value must be at least {rule["min"]}'})
-                if 'max' in rule and int_value > rule['max']:
-                    return jsonify({'valid': False, 'message': f'Value must be at most {rule["max"]}'})
-            except ValueError:
-                return jsonify({'valid': False, 'message': 'Value must be a valid integer'})
-        
-        elif rule['type'] == 'float':
-            try:
-                float_value = float(value)
-                if 'min' in rule and float_value < rule['min']:
-                    return jsonify({'valid': False, 'message': f'Value must be at least {rule["min"]}'})
-                if 'max' in rule and float_value > rule['max']:
-                    return jsonify({'valid': False, 'message': f'Value must be at most {rule["max"]}'})
-            except ValueError:
-                return jsonify({'valid': False, 'message': 'Value must be a valid number'})
-        
-        elif rule['type'] == 'str':
-            if 'max_length' in rule and len(str(value)) > rule['max_length']:
-                return jsonify({'valid': False, 'message': f'Value must be at most {rule["max_length"]} characters'})
+        error = validator(value)
+        if error:
+            return jsonify({'valid': False, 'message': error})
         
         return jsonify({'valid': True, 'message': 'Value is valid'})
         
@@ -1,12 +1,34 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from src.models.database import db, Gift, User, Transaction, AuditLog
-from datetime import datetime
+from src.security import get_user
+from src.audit_queue import add_audit
+from src.pagination import count_rows
+from sqlalchemy import insert, update
+from sqlalchemy.orm import joinedload
+from datetime import datetime, timedelta
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
 gifts_bp = Blueprint('gifts', __name__)
 
+# Load both users in the gift's SELECT (many-to-one outer joins)
+GIFT_USERS = (joinedload(Gift.sender), joinedload(Gift.recipient))
+
+def _details(**fields):
+    """Audit log details as JSON; orjson escapes quotes in user-supplied text"""
+    return orjson.dumps(fields).decode()
+
+def _gift_with_users(gift):
+    """Serialize a gift with its (eager-loaded) sender and recipient"""
+    sender, recipient = gift.sender, gift.recipient
+    return Gift.to_dict_with_users(
+        gift,
+        sender.to_dict() if sender else None,
+        recipient.to_dict() if recipient else None
+    )
+
 @gifts_bp.route('/gifts', methods=['GET'])
 def get_gifts():
     """Get all gifts with pagination and filtering"""
@@ -27,24 +49,17 @@ def get_gifts():
                 (Gift.sender_id == user_id) | (Gift.recipient_id == user_id)
             )
         
-        # Order by creation date (newest first)
-        query = query.order_by(Gift.created_at.desc())
+        # Count the filtered rows without the ORDER BY
+        total = count_rows(query, Gift.id)
         
-        # Paginate
+        # Order by creation date (newest first); id keeps pages stable
         offset = (page - 1) * limit
-        gifts = query.offset(offset).limit(limit).all()
-        total = query.count()
-        
-        # Convert to dict with user information
-        gifts_data = []
-        for gift in gifts:
-            gift_dict = gift.to_dict()
-            gift_dict['sender'] = gift.sender.to_dict() if gift.sender else None
-            gift_dict['recipient'] = gift.recipient.to_dict() if gift.recipient else None
-            gifts_data.append(gift_dict)
+        gifts = query.options(*GIFT_USERS).order_by(
+            Gift.created_at.desc(), Gift.id.desc()
+        ).offset(offset).limit(limit).all()
         
         return jsonify({
-            'gifts': gifts_data,
+            'gifts': [_gift_with_users(gift) for gift in gifts],
             'total': total,
             'page': page,
             'limit': limit,
@@ -59,15 +74,11 @@ def get_gifts():
 def get_gift(gift_id):
     """Get a specific gift by ID"""
     try:
-        gift = Gift.query.get(gift_id)
+        gift = db.session.get(Gift, gift_id, options=GIFT_USERS)
         if not gift:
             return jsonify({'error': 'Gift not found'}), 404
         
-        gift_dict = gift.to_dict()
-        gift_dict['sender'] = gift.sender.to_dict() if gift.sender else None
-        gift_dict['recipient'] = gift.recipient.to_dict() if gift.recipient else None
-        
-        return jsonify(gift_dict)
+        return jsonify(_gift_with_users(gift))
         
     except Exception as e:
         logger.error(f"Error fetching gift {gift_id}: {e}")
@@ -96,76 +107,99 @@ def send_gift():
         if sender_id == recipient_id:
             return jsonify({'error': 'Cannot send gift to yourself'}), 400
         
-        # Get users
-        sender = User.query.get(sender_id)
-        recipient = User.query.get(recipient_id)
-        
-        if not sender:
-            return jsonify({'error': 'Sender not found'}), 404
-        
-        if not recipient:
-            return jsonify({'error': 'Recipient not found'}), 404
-        
-        # Check if sender has enough coins
-        if sender.coins < amount:
+        # Pin the level before the first statement. Under READ COMMITTED the
+        # guarded UPDATE re-checks the balance against the newest row version,
+        # which is what prevents double-spends; REPEATABLE READ would abort a
+        # concurrent send with a serialization error instead. SQLite
+        # serializes writers regardless.
+        if db.engine.dialect.name == 'postgresql':
+            db.session.connection(execution_options={'isolation_level': 'READ COMMITTED'})
+        
+        # Debit the sender only if the balance still covers the gift. The
+        # guarded UPDATE closes the race between concurrent sends, and
+        # RETURNING hands back both users without separate SELECTs.
+        sender = db.session.scalars(
+            update(User)
+            .where(User.id == sender_id, User.coins >= amount)
+            .values(coins=User.coins - amount)
+            .returning(User),
+            execution_options={'populate_existing': True}
+        ).one_or_none()
+        if sender is None:
+            db.session.rollback()
+            if not get_user(sender_id):
+                return jsonify({'error': 'Sender not found'}), 404
             return jsonify({'error': 'Insufficient coins'}), 400
         
-        # Create gift record
-        gift = Gift(
-            sender_id=sender_id,
-            recipient_id=recipient_id,
-            amount=amount,
-            message=message,
-            status='completed',
-            processed_at=datetime.utcnow()
-        )
-        
-        # Transfer coins
-        sender.coins -= amount
-        recipient.coins += amount
-        
-        # Create transaction records
-        sender_transaction = Transaction(
-            user_id=sender_id,
-            transaction_type='gift_sent',
-            amount=-amount,
-            description=f'Gift sent to {recipient.username}',
-            reference_id=f'gift_{gift.id}'
-        )
-        
-        recipient_transaction = Transaction(
-            user_id=recipient_id,
-            transaction_type='gift_received',
-            amount=amount,
-            description=f'Gift received from {sender.username}',
-            reference_id=f'gift_{gift.id}'
-        )
-        
-        # Create audit log entries
-        sender_audit = AuditLog(
-            user_id=sender_id,
-            action='gift_sent',
-            details=f'{{"amount": {amount}, "recipient": "{recipient.username}", "message": "{message}"}}'
-        )
-        
-        recipient_audit = AuditLog(
-            user_id=recipient_id,
-            action='gift_received',
-            details=f'{{"amount": {amount}, "sender": "{sender.username}", "message": "{message}"}}'
-        )
-        
-        db.session.add(gift)
-        db.session.add(sender_transaction)
-        db.session.add(recipient_transaction)
-        db.session.add(sender_audit)
-        db.session.add(recipient_audit)
-        db.session.commit()
+        recipient = db.session.scalars(
+            update(User)
+            .where(User.id == recipient_id)
+            .values(coins=User.coins + amount)
+            .returning(User),
+            execution_options={'populate_existing': True}
+        ).one_or_none()
+        if recipient is None:
+            db.session.rollback()
+            return jsonify({'error': 'Recipient not found'}), 404
         
-        # Return gift with user information
+        # Gift row as a plain INSERT ... RETURNING rather than a unit-of-work
+        # flush, so the transactions below can reference its id
+        gift = db.session.scalars(
+            insert(Gift)
+            .values(
+                sender_id=sender_id,
+                recipient_id=recipient_id,
+                amount=amount,
+                message=message,
+                status='completed',
+                processed_at=datetime.utcnow()
+            )
+            .returning(Gift)
+        ).one()
+        
+        # Both transaction records in one executemany, and both audit rows in
+        # another, so the audit trail commits with the transfer
+        db.session.execute(insert(Transaction), [
+            {
+                'user_id': sender_id,
+                'transaction_type': 'gift_sent',
+                'amount': -amount,
+                'description': f'Gift sent to {recipient.username}',
+                'reference_id': f'gift_{gift.id}'
+            },
+            {
+                'user_id': recipient_id,
+                'transaction_type': 'gift_received',
+                'amount': amount,
+                'description': f'Gift received from {sender.username}',
+                'reference_id': f'gift_{gift.id}'
+            }
+        ])
+        
+        db.session.execute(insert(AuditLog), [
+            {
+                'user_id': sender_id,
+                'action': 'gift_sent',
+                'details': _details(amount=amount, recipient=recipient.username, message=message),
+                'timestamp': gift.processed_at
+            },
+            {
+                'user_id': recipient_id,
+                'action': 'gift_received',
+                'details': _details(amount=amount, sender=sender.username, message=message),
+                'timestamp': gift.processed_at
+            }
+        ])
+        
+        # Serialize from the RETURNING rows before commit expires them
         gift_dict = gift.to_dict()
         gift_dict['sender'] = sender.to_dict()
         gift_dict['recipient'] = recipient.to_dict()
         
+        # The only commit: both balance updates, the gift, its transactions
+        # and its audit rows land together or not at all
+        db.session.commit()
+        
         return jsonify(gift_dict), 201
         
     except Exception as e:
@@ -193,7 +227,7 @@ def admin_send_gift():
             return jsonify({'error': 'Amount must be positive'}), 400
         
         # Get recipient
-        recipient = User.query.get(recipient_id)
+        recipient = get_user(recipient_id)
         if not recipient:
             return jsonify({'error': 'Recipient not found'}), 404
         
@@ -206,6 +240,8 @@ def admin_send_gift():
             status='completed',
             processed_at=datetime.utcnow()
         )
+        db.session.add(gift)
+        db.session.flush()  # Get the ID
         
         # Add coins to recipient
         recipient.coins += amount
@@ -223,10 +259,9 @@ def admin_send_gift():
         audit = AuditLog(
             user_id=recipient_id,
             action='gift_received',
-            details=f'{{"amount": {amount}, "sender": "Admin", "message": "{message}"}}'
+            details=_details(amount=amount, sender='Admin', message=message)
         )
         
-        db.session.add(gift)
         db.session.add(transaction)
         db.session.add(audit)
         db.session.commit()
@@ -247,98 +282,111 @@ def admin_send_gift():
 def cancel_gift(gift_id):
     """Cancel a pending gift"""
     try:
-        gift = Gift.query.get(gift_id)
-        if not gift:
-            return jsonify({'error': 'Gift not found'}), 404
-        
-        if gift.status != 'pending':
+        # Cancel only a still-pending gift; the guard makes concurrent
+        # cancels refund once, and RETURNING supplies the refund details
+        cancelled = db.session.execute(
+            update(Gift)
+            .where(Gift.id == gift_id, Gift.status == 'pending')
+            .values(status='cancelled', processed_at=datetime.utcnow())
+            .returning(Gift.sender_id, Gift.amount)
+        ).first()
+        if cancelled is None:
+            db.session.rollback()
+            if db.session.get(Gift, gift_id) is None:
+                return jsonify({'error': 'Gift not found'}), 404
             return jsonify({'error': 'Can only cancel pending gifts'}), 400
         
-        # Update gift status
-        gift.status = 'cancelled'
-        gift.processed_at = datetime.utcnow()
-        
-        # If there was a sender, refund the coins
-        if gift.sender_id:
-            sender = User.query.get(gift.sender_id)
-            if sender:
-                sender.coins += gift.amount
-                
-                # Create refund transaction
-                refund_transaction = Transaction(
-                    user_id=gift.sender_id,
-                    transaction_type='refund',
-                    amount=gift.amount,
-                    description=f'Gift cancelled - refund to {sender.username}',
-                    reference_id=f'gift_cancel_{gift.id}'
-                )
-                db.session.add(refund_transaction)
-        
-        # Create audit log entry
-        audit = AuditLog(
-            user_id=gift.sender_id,
+        sender_id, amount = cancelled
+        
+        # If there was a sender, refund the coins in place
+        sender_name = None
+        if sender_id:
+            sender_name = db.session.execute(
+                update(User)
+                .where(User.id == sender_id)
+                .values(coins=User.coins + amount)
+                .returning(User.username)
+            ).scalar()
+        
+        if sender_name is not None:
+            db.session.add(Transaction(
+                user_id=sender_id,
+                transaction_type='refund',
+                amount=amount,
+                description=f'Gift cancelled - refund to {sender_name}',
+                reference_id=f'gift_cancel_{gift_id}'
+            ))
+        
+        # Audit entry commits with the refund
+        add_audit(
+            user_id=sender_id,
             action='admin_action',
-            details=f'{{"action": "gift_cancelled", "gift_id": {gift.id}, "amount": {gift.amount}}}'
+            details=_details(action='gift_cancelled', gift_id=gift_id, amount=amount)
         )
-        db.session.add(audit)
-        
         db.session.commit()
         
-        # Return updated gift
-        gift_dict = gift.to_dict()
-        gift_dict['sender'] = gift.sender.to_dict() if gift.sender else None
-        gift_dict['recipient'] = gift.recipient.to_dict() if gift.recipient else None
-        
-        return jsonify(gift_dict)
+        # Return updated gift, reloaded with both users in one SELECT
+        gift = db.session.get(Gift, gift_id, options=GIFT_USERS, populate_existing=True)
+        return jsonify(_gift_with_users(gift))
         
     except Exception as e:
         logger.error(f"Error cancelling gift {gift_id}: {e}")
         db.session.rollback()
         return jsonify({'error': 'Failed to cancel gift'}), 500
 
+def _top_gift_users(user_column, total_label, limit=5):
+    """
+    Users with the largest completed-gift totals on one side of the gift
+
+    Args:
+        user_column: Gift.sender_id or Gift.recipient_id
+        total_label: Name of the summed amount column in the result rows
+
+    Returns:
+        Rows of (username, gift_count, <total_label>), largest total first
+    """
+    total = db.func.sum(Gift.amount)
+    top = db.session.query(
+        user_column.label('user_id'),
+        db.func.count(Gift.id).label('gift_count'),
+        total.label(total_label)
+    ).filter(
+        # Admin gifts have no sender; keep their NULL group out of the ranking
+        Gift.status == 'completed', user_column.isnot(None)
+    ).group_by(user_column).order_by(
+        total.desc()
+    ).limit(limit).subquery()
+    
+    return db.session.query(
+        User.username, top.c.gift_count, top.c[total_label]
+    ).join(top, User.id == top.c.user_id).order_by(top.c[total_label].desc()).all()
+
 @gifts_bp.route('/gifts/stats', methods=['GET'])
 def get_gift_stats():
     """Get gift statistics"""
     try:
-        # Total gifts
-        total_gifts = Gift.query.count()
-        
-        # Gifts by status
-        completed_gifts = Gift.query.filter_by(status='completed').count()
-        pending_gifts = Gift.query.filter_by(status='pending').count()
-        cancelled_gifts = Gift.query.filter_by(status='cancelled').count()
-        
-        # Total value of completed gifts
-        total_value = db.session.query(db.func.sum(Gift.amount)).filter(
-            Gift.status == 'completed'
-        ).scalar() or 0
-        
-        # Recent activity (last 7 days)
-        from datetime import timedelta
         week_ago = datetime.utcnow() - timedelta(days=7)
-        recent_gifts = Gift.query.filter(Gift.created_at >= week_ago).count()
-        
-        # Top gift senders (excluding admin gifts)
-        top_senders = db.session.query(
-            User.username,
-            db.func.count(Gift.id).label('gift_count'),
-            db.func.sum(Gift.amount).label('total_sent')
-        ).join(Gift, User.id == Gift.sender_id).filter(
-            Gift.status == 'completed'
-        ).group_by(User.id).order_by(
-            db.func.sum(Gift.amount).desc()
-        ).limit(5).all()
-        
-        # Top gift recipients
-        top_recipients = db.session.query(
-            User.username,
-            db.func.count(Gift.id).label('gift_count'),
-            db.func.sum(Gift.amount).label('total_received')
-        ).join(Gift, User.id == Gift.recipient_id).filter(
-            Gift.status == 'completed'
-        ).group_by(User.id).order_by(
-            db.func.sum(Gift.amount).desc()
-        ).limit(5).all()
+        
+        # Per-status counts, completed value and the last 7 days in one GROUP BY
+        rows = db.session.query(
+            Gift.status,
+            db.func.count(Gift.id),
+            db.func.sum(Gift.amount),
+            db.func.count(Gift.id).filter(Gift.created_at >= week_ago)
+        ).group_by(Gift.status).all()
+        by_status = {status: (count, value) for status, count, value, _ in rows}
+        
+        total_gifts = sum(count for _, count, _, _ in rows)
+        completed_gifts = by_status.get('completed', (0, 0))[0]
+        pending_gifts = by_status.get('pending', (0, 0))[0]
+        cancelled_gifts = by_status.get('cancelled', (0, 0))[0]
+        total_value = by_status.get('completed', (0, 0))[1] or 0
+        recent_gifts = sum(recent for _, _, _, recent in rows)
+        
+        # Top gift senders and recipients: rank per-user sums over the
+        # completed-gift indexes first, then join only the top five to users
+        top_senders = _top_gift_users(Gift.sender_id, 'total_sent')
+        top_recipients = _top_gift_users(Gift.recipient_id, 'total_received')
         
         return jsonify({
             'total_gifts': total_gifts,
@@ -373,34 +421,45 @@ def get_gift_stats():
 def get_user_gifts(user_id):
     """Get gifts for a specific user (sent and received)"""
     try:
-        user = User.query.get(user_id)
+        user = get_user(user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # Get sent gifts
-        sent_gifts = Gift.query.filter_by(sender_id=user_id).order_by(Gift.created_at.desc()).all()
-        
-        # Get received gifts
-        received_gifts = Gift.query.filter_by(recipient_id=user_id).order_by(Gift.created_at.desc()).all()
-        
-        # Convert to dict with user information
-        sent_data = []
-        for gift in sent_gifts:
+        # Optional paging applied to each list; without ?limit= every gift
+        # is returned, streamed so memory stays flat either way
+        limit = request.args.get('limit', type=int)
+        page = max(request.args.get('page', 1, type=int), 1)
+        
+        sent_gifts = Gift.query.options(joinedload(Gift.recipient)).filter_by(
+            sender_id=user_id
+        ).order_by(Gift.created_at.desc(), Gift.id.desc())
+        received_gifts = Gift.query.options(joinedload(Gift.sender)).filter_by(
+            recipient_id=user_id
+        ).order_by(Gift.created_at.desc(), Gift.id.desc())
+        if limit is not None:
+            sent_gifts = sent_gifts.offset((page - 1) * limit).limit(limit)
+            received_gifts = received_gifts.offset((page - 1) * limit).limit(limit)
+        
+        def sent_dict(gift):
             gift_dict = gift.to_dict()
             gift_dict['recipient'] = gift.recipient.to_dict()
-            sent_data.append(gift_dict)
+            return gift_dict
         
-        received_data = []
-        for gift in received_gifts:
+        def received_dict(gift):
             gift_dict = gift.to_dict()
             gift_dict['sender'] = gift.sender.to_dict() if gift.sender else None
-            received_data.append(gift_dict)
-        
-        return jsonify({
-            'user': user.to_dict(),
-            'sent_gifts': sent_data,
-            'received_gifts': received_data
-        })
+            return gift_dict
+        
+        def generate():
+            yield b'{"user":' + orjson.dumps(user.to_dict()) + b',"sent_gifts":['
+            for count, gift in enumerate(sent_gifts.yield_per(500)):
+                yield (b',' if count else b'') + orjson.dumps(sent_dict(gift))
+            yield b'],"received_gifts":['
+            for count, gift in enumerate(received_gifts.yield_per(500)):
+                yield (b',' if count else b'') + orjson.dumps(received_dict(gift))
+            yield b']}'
+        
+        return Response(stream_with_context(generate()), mimetype='application/json')
         
     except Exception as e:
         logger.error(f"Error fetching user gifts for {user_id}: {e}")
@@ -1,9 +1,11 @@
 from flask import Blueprint, request, jsonify, current_app
 from src.models.database import db, User, PaymentRecord, Transaction, AuditLog
+from src.security import get_user
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
 import stripe
 import os
 import logging
-import json
 from datetime import datetime
 
 payments_bp = Blueprint('payments', __name__)
@@ -12,6 +14,17 @@ logger = logging.getLogger(__name__)
 # Configure Stripe
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 
+# Stripe calls block the worker thread for a full HTTPS round trip. One
+# process-wide client reuses keep-alive connections, and the (connect, read)
+# timeout stops a stalled call from pinning a worker for the SDK's default 80s.
+# Retries carry idempotency keys, so a repeated create cannot double-charge.
+STRIPE_TIMEOUT = (
+    float(os.getenv('STRIPE_CONNECT_TIMEOUT', '5')),
+    float(os.getenv('STRIPE_READ_TIMEOUT', '30'))
+)
+stripe.default_http_client = stripe.RequestsClient(timeout=STRIPE_TIMEOUT)
+stripe.max_network_retries = int(os.getenv('STRIPE_MAX_RETRIES', '2'))
+
 @payments_bp.route('/create-payment-intent', methods=['POST'])
 def create_payment_intent():
     """Create a Stripe payment intent for coin purchase"""
@@ -25,24 +38,28 @@ def create_payment_intent():
             return jsonify({'error': 'Missing required fields'}), 400
             
         # Get user
-        user = User.query.get(user_id)
+        user = get_user(user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
             
         # Convert USD to cents for Stripe
         amount_cents = int(float(amount_usd) * 100)
+        metadata = {
+            'user_id': str(user_id),
+            'discord_id': user.discord_id,
+            'username': user.username,
+            'coins_to_purchase': str(coins_to_purchase)
+        }
+        
+        # Hand the pooled connection back while Stripe is on the wire
+        db.session.rollback()
         
         # Create payment intent
         intent = stripe.PaymentIntent.create(
             amount=amount_cents,
             currency='usd',
-            metadata={
-                'user_id': str(user_id),
-                'discord_id': user.discord_id,
-                'username': user.username,
-                'coins_to_purchase': str(coins_to_purchase)
-            },
-            description=f"Coin purchase for {user.username}"
+            metadata=metadata,
+            description=f"Coin purchase for {metadata['username']}"
         )
         
         # Create payment record
@@ -52,10 +69,10 @@ def create_payment_intent():
             amount_cents=amount_cents,
             currency='USD',
             status='pending',
-            payment_metadata=json.dumps({
+            payment_metadata={
                 'coins_to_purchase': coins_to_purchase,
                 'amount_usd': amount_usd
-            })
+            }
         )
         
         db.session.add(payment_record)
@@ -113,37 +130,58 @@ def stripe_webhook():
     
     return jsonify({'status': 'success'})
 
+def _claim_payment(payment_id, from_statuses, status):
+    """
+    Move a payment record out of from_statuses in one guarded UPDATE
+
+    Stripe retries webhooks and deliveries can overlap, so only the caller
+    whose UPDATE matches the row may act on it.
+
+    Returns:
+        The updated PaymentRecord, or None if it is unknown or already moved on
+    """
+    return db.session.scalars(
+        update(PaymentRecord)
+        .where(
+            PaymentRecord.stripe_payment_id == payment_id,
+            PaymentRecord.status.in_(from_statuses)
+        )
+        .values(status=status, updated_at=datetime.utcnow())
+        .returning(PaymentRecord),
+        execution_options={'populate_existing': True}
+    ).one_or_none()
+
 def handle_successful_payment(payment_intent):
     """Handle successful payment and award coins"""
     try:
         payment_id = payment_intent['id']
         
-        # Find payment record
-        payment_record = PaymentRecord.query.filter_by(stripe_payment_id=payment_id).first()
+        # A payment that failed once can still succeed on a later attempt
+        payment_record = _claim_payment(payment_id, ('pending', 'failed'), 'succeeded')
         if not payment_record:
-            logger.error(f"Payment record not found for {payment_id}")
-            return
-            
-        # Update payment status
-        payment_record.status = 'succeeded'
-        payment_record.updated_at = datetime.utcnow()
-        
-        # Get user and metadata
-        user = User.query.get(payment_record.user_id)
-        if not user:
-            logger.error(f"User not found for payment {payment_id}")
+            db.session.rollback()
+            logger.info(f"Payment {payment_id} unknown or already processed")
             return
             
-        metadata = json.loads(payment_record.payment_metadata) if payment_record.payment_metadata else {}
+        metadata = payment_record.payment_metadata or {}
         coins_to_award = int(metadata.get('coins_to_purchase', 0))
         
         if coins_to_award > 0:
             # Award coins to user
-            user.coins += coins_to_award
+            username = db.session.scalar(
+                update(User)
+                .where(User.id == payment_record.user_id)
+                .values(coins=User.coins + coins_to_award)
+                .returning(User.username)
+            )
+            if username is None:
+                db.session.rollback()
+                logger.error(f"User not found for payment {payment_id}")
+                return
             
             # Create transaction record
             transaction = Transaction(
-                user_id=user.id,
+                user_id=payment_record.user_id,
                 transaction_type='purchase',
                 amount=coins_to_award,
                 description=f"Coin purchase via payment (${payment_record.amount_cents / 100})",
@@ -154,15 +192,19 @@ def handle_successful_payment(payment_intent):
             
             # Log the action
             audit_log = AuditLog(
-                user_id=user.id,
+                user_id=payment_record.user_id,
                 action='payment_succeeded',
                 details=f"Payment succeeded: {coins_to_award} coins awarded for ${payment_record.amount_cents / 100}"
             )
             db.session.add(audit_log)
             
         db.session.commit()
-        logger.info(f"Successfully processed payment {payment_id} for user {user.username}")
+        logger.info(f"Successfully processed payment {payment_id} for user {payment_record.user_id}")
         
+    except IntegrityError:
+        # ix_transactions_reference_type already holds this payment's grant
+        db.session.rollback()
+        logger.info(f"Duplicate grant for payment {payment_id} ignored")
     except Exception as e:
         logger.error(f"Error handling successful payment: {e}")
         db.session.rollback()
@@ -172,15 +214,12 @@ def handle_failed_payment(payment_intent):
     try:
         payment_id = payment_intent['id']
         
-        # Find payment record
-        payment_record = PaymentRecord.query.filter_by(stripe_payment_id=payment_id).first()
+        # Only a pending payment can fail; a late event never undoes a success
+        payment_record = _claim_payment(payment_id, ('pending',), 'failed')
         if not payment_record:
-            logger.error(f"Payment record not found for {payment_id}")
+            db.session.rollback()
+            logger.info(f"Payment {payment_id} unknown or already processed")
             return
-            
-        # Update payment status
-        payment_record.status = 'failed'
-        payment_record.updated_at = datetime.utcnow()
         
         # Log the action
         audit_log = AuditLog(
@@ -201,7 +240,7 @@ def handle_failed_payment(payment_intent):
 def get_payment_status(payment_intent_id):
     """Get payment status"""
     try:
-        payment_record = PaymentRecord.query.filter_by(stripe_payment_id=payment_intent_id).first()
+        payment_record = PaymentRecord.by_stripe_payment_id(payment_intent_id)
         
         if not payment_record:
             return jsonify({'error': 'Payment not found'}), 404
@@ -305,35 +344,41 @@ def process_refund():
             return jsonify({'error': 'Payment intent ID required'}), 400
             
         # Find payment record
-        payment_record = PaymentRecord.query.filter_by(stripe_payment_id=payment_intent_id).first()
+        payment_record = PaymentRecord.by_stripe_payment_id(payment_intent_id)
         if not payment_record:
             return jsonify({'error': 'Payment not found'}), 404
             
         if payment_record.status != 'succeeded':
             return jsonify({'error': 'Can only refund succeeded payments'}), 400
             
-        # Process refund with Stripe
+        # Hand the pooled connection back while Stripe is on the wire
+        db.session.rollback()
+        
+        # Process refund with Stripe; the idempotency key makes a repeated or
+        # concurrent request get the same refund back instead of a second one
         refund = stripe.Refund.create(
             payment_intent=payment_intent_id,
-            reason='requested_by_customer'
+            reason='requested_by_customer',
+            idempotency_key=f'refund_{payment_intent_id}'
         )
         
-        # Update payment record
-        payment_record.status = 'refunded'
-        payment_record.updated_at = datetime.utcnow()
-        
-        # Get user and deduct coins if they still have them
-        user = User.query.get(payment_record.user_id)
-        if user:
-            metadata = json.loads(payment_record.payment_metadata) if payment_record.payment_metadata else {}
+        # Only the request that moves the record to 'refunded' deducts coins
+        payment_record = _claim_payment(payment_intent_id, ('succeeded',), 'refunded')
+        if payment_record:
+            metadata = payment_record.payment_metadata or {}
             coins_to_deduct = int(metadata.get('coins_to_purchase', 0))
             
-            if user.coins >= coins_to_deduct:
-                user.coins -= coins_to_deduct
-                
+            # Deduct coins if the user still has them
+            deducted = db.session.scalar(
+                update(User)
+                .where(User.id == payment_record.user_id, User.coins >= coins_to_deduct)
+                .values(coins=User.coins - coins_to_deduct)
+                .returning(User.id)
+            )
+            if deducted is not None:
                 # Create transaction record
                 transaction = Transaction(
-                    user_id=user.id,
+                    user_id=payment_record.user_id,
                     transaction_type='refund',
                     amount=-coins_to_deduct,
                     description=f"Refund: {reason}",
@@ -343,7 +388,7 @@ def process_refund():
             
             # Log the action
             audit_log = AuditLog(
-                user_id=user.id,
+                user_id=payment_record.user_id,
                 action='payment_refunded',
                 details=f"Payment refunded: ${payment_record.amount_cents / 100} - {reason}"
             )
@@ -361,5 +406,6 @@ def process_refund():
         return jsonify({'error': 'Refund processing failed'}), 500
     except Exception as e:
         logger.error(f"Error processing refund: {e}")
+        db.session.rollback()
         return jsonify({'error': 'Internal server error'}), 500
 
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
-from src.models.database import db, MinecraftServer, AuditLog
-from src.minecraft_integration import MinecraftIntegration
+from src.models.database import db, MinecraftServer
+from src.minecraft_integration import MinecraftIntegration, run_coroutine
+from src.audit_queue import add_audit
+from src.routes.admin import invalidate_servers
 from datetime import datetime
 import logging
 
@@ -20,7 +22,7 @@ def get_servers():
             # Add real-time status if available
             try:
                 mc_integration = MinecraftIntegration()
-                status = mc_integration.get_server_status(server.host, server.port)
+                status = run_coroutine(mc_integration.get_server_status(server.host, server.port))
                 if status:
                     server_dict.update({
                         'status': 'online' if status.get('online') else 'offline',
@@ -57,7 +59,7 @@ def get_server(server_id):
         # Get real-time status
         try:
             mc_integration = MinecraftIntegration()
-            status = mc_integration.get_server_status(server.host, server.port)
+            status = run_coroutine(mc_integration.get_server_status(server.host, server.port))
             if status:
                 server_dict.update({
                     'status': 'online' if status.get('online') else 'offline',
@@ -110,17 +112,16 @@ def create_server():
         )
         
         db.session.add(server)
-        db.session.commit()
         
-        # Create audit log
-        audit = AuditLog(
+        # Create audit log in the same transaction
+        add_audit(
             user_id=data.get('admin_user_id'),
             action='server_created',
             details=f'{{"server_name": "{server.name}", "host": "{server.host}", "port": {server.port}}}',
             ip_address=request.headers.get('X-Forwarded-For', request.remote_addr)
         )
-        db.session.add(audit)
         db.session.commit()
+        invalidate_servers()
         
         return jsonify(server.to_dict()), 201
         
@@ -157,17 +158,15 @@ def update_server(server_id):
         
         server.updated_at = datetime.utcnow()
         
-        db.session.commit()
-        
-        # Create audit log
-        audit = AuditLog(
+        # Create audit log in the same transaction
+        add_audit(
             user_id=data.get('admin_user_id'),
             action='server_updated',
             details=f'{{"server_name": "{server.name}", "server_id": {server.id}}}',
             ip_address=request.headers.get('X-Forwarded-For', request.remote_addr)
         )
-        db.session.add(audit)
         db.session.commit()
+        invalidate_servers()
         
         return jsonify(server.to_dict())
         
@@ -184,19 +183,16 @@ def delete_server(server_id):
         if not server:
             return jsonify({'error': 'Server not found'}), 404
         
-        server_name = server.name
-        
-        db.session.delete(server)
-        db.session.commit()
-        
-        # Create audit log
-        audit = AuditLog(
+        # Create audit log in the same transaction
+        add_audit(
             action='server_deleted',
-            details=f'{{"server_name": "{server_name}", "server_id": {server_id}}}',
+            details=f'{{"server_name": "{server.name}", "server_id": {server_id}}}',
             ip_address=request.headers.get('X-Forwarded-For', request.remote_addr)
         )
-        db.session.add(audit)
+        
+        db.session.delete(server)
         db.session.commit()
+        invalidate_servers()
         
         return jsonify({'message': 'Server deleted successfully'})
         
@@ -214,7 +210,7 @@ def refresh_server_status(server_id):
             return jsonify({'error': 'Server not found'}), 404
         
         mc_integration = MinecraftIntegration()
-        status = mc_integration.get_server_status(server.host, server.port)
+        status = run_coroutine(mc_integration.get_server_status(server.host, server.port))
         
         if status:
             # Update server record with latest status
@@ -264,38 +260,37 @@ def execute_command(server_id):
         command = data['command']
         
         mc_integration = MinecraftIntegration()
-        result = mc_integration.execute_command(
-            server.rcon_host or server.host,
-            server.rcon_port,
-            server.rcon_password,
-            command
-        )
-        
-        if result['success']:
+        success = run_coroutine(mc_integration.execute_command(
+            command,
+            rcon_host=server.rcon_host or server.host,
+            rcon_port=server.rcon_port,
+            rcon_password=server.rcon_password
+        ))
+        
+        if success:
             # Create audit log
-            audit = AuditLog(
+            add_audit(
                 user_id=data.get('admin_user_id'),
                 action='server_command_executed',
-                details=f'{{"server_name": "{server.name}", "command": "{command}", "result": "{result.get("response", "")}"}}',
+                details=f'{{"server_name": "{server.name}", "command": "{command}"}}',
                 ip_address=request.headers.get('X-Forwarded-For', request.remote_addr)
             )
-            db.session.add(audit)
             db.session.commit()
             
             return jsonify({
                 'success': True,
-                'response': result.get('response', ''),
                 'command': command
             })
         else:
             return jsonify({
                 'success': False,
-                'error': result.get('error', 'Command execution failed'),
+                'error': 'Command execution failed',
                 'command': command
             }), 400
         
     except Exception as e:
         logger.error(f"Error executing command on server {server_id}: {e}")
+        db.session.rollback()
         return jsonify({'error': 'Failed to execute command'}), 500
 
 @servers_bp.route('/servers/stats', methods=['GET'])
@@ -345,10 +340,12 @@ def refresh_all_servers():
         
         updated_count = 0
         
-        for server in servers:
+        statuses = run_coroutine(mc_integration.get_servers_status(
+            [(server.host, server.port) for server in servers]
+        ))
+
+        for server, status in zip(servers, statuses):
             try:
-                status = mc_integration.get_server_status(server.host, server.port)
-                
                 if status:
                     server.status = 'online' if status.get('online') else 'offline'
                     server.players_online = status.get('players', {}).get('online', 0)
@@ -0,0 +1,117 @@
+import logging
+import time
+from sqlalchemy import inspect, text
+from src.models.database import db, ServerStatus, Transaction
+
+logger = logging.getLogger(__name__)
+
+# Epoch milliseconds from the legacy naive-UTC DateTime column, per dialect
+# Index definitions as stored by each dialect, to spot indexes built before
+# they were made partial
+_INDEX_DEFINITION = {
+    'sqlite': "SELECT sql FROM sqlite_master WHERE type = 'index' AND name = :name",
+    'postgresql': "SELECT indexdef FROM pg_indexes WHERE indexname = :name",
+}
+
+_EPOCH_MS_FROM_TIMESTAMP = {
+    'sqlite': "CAST(ROUND((julianday(\"timestamp\") - 2440587.5) * 86400000) AS INTEGER)",
+    'postgresql': "CAST(EXTRACT(EPOCH FROM \"timestamp\") * 1000 AS BIGINT)",
+}
+
+def upgrade_server_status():
+    """
+    Move a server_status table from the DateTime 'timestamp' column to timestamp_ms
+
+    Databases created before ServerStatus stored epoch milliseconds still
+    have the old column. This adds timestamp_ms, backfills it from the old
+    values (rows without one get the current time), drops the old column and
+    creates the indexes ServerStatus declares. Runs in one transaction.
+
+    Returns:
+        True if the table was upgraded, False if it was already current
+    """
+    columns = {column['name'] for column in inspect(db.engine).get_columns('server_status')}
+    if 'timestamp_ms' in columns:
+        logger.info('server_status already stores timestamp_ms')
+        return False
+
+    dialect = db.engine.dialect.name
+    if dialect not in _EPOCH_MS_FROM_TIMESTAMP:
+        raise RuntimeError(f'No server_status upgrade for {dialect}')
+
+    session = db.session
+    session.execute(text("ALTER TABLE server_status ADD COLUMN timestamp_ms BIGINT"))
+    session.execute(text(
+        f"UPDATE server_status SET timestamp_ms = {_EPOCH_MS_FROM_TIMESTAMP[dialect]} "
+        "WHERE \"timestamp\" IS NOT NULL"
+    ))
+    session.execute(
+        text("UPDATE server_status SET timestamp_ms = :now WHERE timestamp_ms IS NULL"),
+        {'now': int(time.time() * 1000)}
+    )
+    if dialect == 'postgresql':
+        session.execute(text("ALTER TABLE server_status ALTER COLUMN timestamp_ms SET NOT NULL"))
+    session.execute(text("ALTER TABLE server_status DROP COLUMN \"timestamp\""))
+    for index in ServerStatus.__table__.indexes:
+        index.create(bind=session.connection(), checkfirst=True)
+    session.commit()
+    return True
+
+def upgrade_indexes():
+    """
+    Create the named indexes an existing database is missing
+
+    create_all only builds indexes together with a new table, so databases
+    created before an index was declared never get it. This creates every
+    declared index that is absent. ix_transactions_reference_type is rebuilt
+    if it predates its purchase/refund WHERE clause, since the old full
+    unique index would keep rejecting other ledger types. On PostgreSQL,
+    gifts.sender_id also loses its NOT NULL so admin gifts can be stored;
+    SQLite cannot drop the constraint in place. Indexes on columns a table
+    does not have yet are skipped with a warning (see upgrade_server_status).
+    Runs in one transaction.
+
+    Returns:
+        Names of the indexes created
+    """
+    dialect = db.engine.dialect.name
+    session = db.session
+    connection = session.connection()
+
+    if dialect == 'postgresql':
+        session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        if inspect(connection).has_table('gifts'):
+            session.execute(text("ALTER TABLE gifts ALTER COLUMN sender_id DROP NOT NULL"))
+
+    reference_index = next(
+        index for index in Transaction.__table__.indexes if index.name == 'ix_transactions_reference_type'
+    )
+    if dialect in _INDEX_DEFINITION:
+        definition = session.execute(
+            text(_INDEX_DEFINITION[dialect]), {'name': reference_index.name}
+        ).scalar()
+        if definition and ' WHERE ' not in definition.upper():
+            reference_index.drop(bind=connection)
+            logger.info(f'Dropped {reference_index.name} to rebuild it as a partial index')
+
+    inspector = inspect(connection)
+    created = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            missing = [column.name for column in index.columns if column.name not in columns]
+            if missing:
+                logger.warning(f'Skipping {index.name}: {table.name} has no column {", ".join(missing)}')
+                continue
+            # Indexes limited to another dialect with ddl_if() are not emitted
+            index.create(bind=connection, checkfirst=True)
+            if inspect(connection).has_index(table.name, index.name):
+                created.append(index.name)
+                logger.info(f'Created index {index.name}')
+    session.commit()
+    return created
@@ -4,8 +4,9 @@ import jwt
 import bcrypt
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import request, jsonify, current_app
-from src.models.database import User, AuditLog, db
+from flask import request, jsonify, current_app, g, abort
+from src.models.database import User, db
+from src.audit_queue import add_audit, log_audit
 import logging
 import re
 from collections import defaultdict
@@ -122,14 +123,12 @@ class SecurityManager:
         if self.failed_attempts[identifier] >= 5:
             self.block_ip(ip_address, f"Too many failed attempts for {identifier}")
             
-        # Log the attempt
-        audit_log = AuditLog(
+        # Log the attempt; nothing to commit it with, so it is queued like an access log
+        log_audit(
             action='failed_auth_attempt',
             details=f"Failed attempt for {identifier}",
             ip_address=ip_address
         )
-        db.session.add(audit_log)
-        db.session.commit()
     
     def validate_coin_amount(self, amount):
         """Validate coin amount for transactions"""
@@ -164,15 +163,13 @@ class SecurityManager:
         return hashlib.sha256(data.encode()).hexdigest()
     
     def audit_log(self, user_id, action, details, ip_address=None):
-        """Create an audit log entry"""
-        log_entry = AuditLog(
+        """Add an audit log entry to the caller's transaction; it is written by the caller's commit"""
+        add_audit(
             user_id=user_id,
             action=action,
             details=details,
             ip_address=ip_address
         )
-        db.session.add(log_entry)
-        db.session.commit()
 
 # Global security manager instance
 security_manager = SecurityManager()
@@ -198,6 +195,31 @@ def require_auth(f):
     
     return decorated_function
 
+def get_user(user_id):
+    """
+    Load a user by primary key, memoized for the current request
+    
+    Repeat lookups of the same ID within a request (auth decorator, then the
+    view) return the same instance without another identity-map lookup.
+    
+    Args:
+        user_id: User primary key
+        
+    Returns:
+        User instance, or None if it does not exist
+    """
+    cache = g.setdefault('_user_cache', {})
+    if user_id not in cache:
+        cache[user_id] = db.session.get(User, user_id)
+    return cache[user_id]
+
+def get_user_or_404(user_id):
+    """Like get_user, but abort with 404 when the user does not exist"""
+    user = get_user(user_id)
+    if user is None:
+        abort(404)
+    return user
+
 def require_admin(f):
     """Decorator to require admin privileges"""
     @wraps(f)
@@ -214,9 +236,9 @@ def require_admin(f):
         if not payload:
             return jsonify({'error': 'Invalid or expired token'}), 401
         
-        # Check if user is admin
-        user = User.query.get(payload['user_id'])
-        if not user or not user.is_admin:
+        # Check if user still exists, is active and is admin
+        user = get_user(payload['user_id'])
+        if not user or not user.is_active or not user.is_admin:
             return jsonify({'error': 'Admin privileges required'}), 403
         
         request.user_id = payload['user_id']
@@ -0,0 +1,179 @@
+import logging
+import os
+import sqlite3
+import subprocess
+from datetime import datetime
+from celery import Celery, Task, shared_task
+from sqlalchemy import text, update
+from sqlalchemy.engine import URL
+from sqlalchemy.orm import joinedload
+from src.models.database import db, Purchase
+from src.minecraft_integration import MinecraftIntegration, run_coroutine, render_item_commands
+from src.audit_queue import add_audit
+from src.audit_partitions import create_partitions, is_partitioned
+
+logger = logging.getLogger(__name__)
+minecraft = MinecraftIntegration()
+
+def celery_init_app(app):
+    """
+    Create the Celery application for app and make it the default
+
+    Tasks run inside an app context so they can use db.session. Without a
+    CELERY_BROKER_URL tasks execute eagerly in the calling process, which
+    keeps development and tests working without Redis.
+
+    Returns:
+        The configured Celery instance
+    """
+    class FlaskTask(Task):
+        def __call__(self, *args, **kwargs):
+            with app.app_context():
+                return self.run(*args, **kwargs)
+
+    broker_url = app.config.get('CELERY_BROKER_URL')
+    celery_app = Celery(app.name, task_cls=FlaskTask)
+    celery_app.conf.update(
+        broker_url=broker_url,
+        task_ignore_result=True,
+        task_always_eager=not broker_url,
+        # Acknowledge after the task finishes so a worker crash re-delivers it
+        task_acks_late=True,
+        worker_prefetch_multiplier=1,
+        # Run with `celery -A src.main.celery_app beat` alongside the worker
+        beat_schedule={
+            'audit-log-partitions': {
+                'task': 'src.tasks.maintain_audit_partitions',
+                'schedule': 24 * 60 * 60
+            },
+            'sqlite-optimize': {
+                'task': 'src.tasks.optimize_database',
+                'schedule': 24 * 60 * 60
+            }
+        }
+    )
+    celery_app.set_default()
+    app.extensions['celery'] = celery_app
+    return celery_app
+
+@shared_task
+def fulfill_purchase_task(purchase_id):
+    """
+    Run a purchase's Minecraft commands and record the outcome
+
+    The purchase is marked 'fulfilled' when every command succeeds and
+    'failed' otherwise, so it can be retried from the fulfill endpoint.
+    
+    Give commands are not idempotent, so the commands are stamped on the
+    purchase before they run. A redelivered task (acks_late) that finds the
+    stamp marks the purchase 'failed' for a manual retry instead of running
+    the commands a second time.
+    """
+    # One SELECT for the purchase together with its user and item
+    purchase = db.session.get(
+        Purchase, purchase_id,
+        options=[joinedload(Purchase.user), joinedload(Purchase.item)]
+    )
+    if not purchase or purchase.status != 'processing':
+        return
+
+    user, item = purchase.user, purchase.item
+    commands = render_item_commands(item, username=user.minecraft_uuid or user.username) if user and item else []
+
+    stamped = db.session.execute(
+        update(Purchase)
+        .where(
+            Purchase.id == purchase_id,
+            Purchase.status == 'processing',
+            Purchase.minecraft_command.is_(None)
+        )
+        .values(minecraft_command='; '.join(commands))
+    ).rowcount
+    if not stamped:
+        db.session.rollback()
+        logger.error(f"Purchase {purchase_id} was already attempted; marking it failed for a manual retry")
+        db.session.execute(
+            update(Purchase)
+            .where(Purchase.id == purchase_id, Purchase.status == 'processing')
+            .values(status='failed')
+        )
+        db.session.commit()
+        return
+    db.session.commit()
+
+    success = False
+    if user and item:
+        try:
+            results = run_coroutine(minecraft.execute_multiple_commands(commands))
+            success = bool(results) and all(results.values())
+        except Exception as e:
+            logger.error(f"Error fulfilling purchase {purchase_id}: {e}")
+    else:
+        logger.error(f"User or item missing for purchase {purchase_id}")
+
+    if success:
+        purchase.status = 'fulfilled'
+        purchase.fulfilled_at = datetime.utcnow()
+    else:
+        purchase.status = 'failed'
+    db.session.commit()
+
+@shared_task
+def execute_server_command_task(command, ip_address=None):
+    """Run a console command on the default server and audit it on success"""
+    if run_coroutine(minecraft.execute_command(command)):
+        add_audit('server_command', details=f"Executed command: {command}", ip_address=ip_address)
+        db.session.commit()
+    else:
+        logger.error(f"Queued server command failed: {command}")
+
+def backup_database(url, backup_path):
+    """
+    Write a consistent copy of the database to backup_path
+
+    SQLite uses the online backup API so pages are copied under SQLite's own
+    locking while writers keep going; PostgreSQL is dumped with pg_dump -Fc.
+    The password is handed to pg_dump through PGPASSWORD rather than argv,
+    where any local user could read it from the process list.
+    """
+    if url.get_backend_name() == 'sqlite':
+        src = sqlite3.connect(url.database)
+        dst = sqlite3.connect(backup_path)
+        try:
+            src.backup(dst, pages=1024, sleep=0.001)
+        finally:
+            dst.close()
+            src.close()
+        return
+
+    dsn = URL.create(
+        'postgresql', username=url.username, host=url.host, port=url.port,
+        database=url.database, query=url.query
+    ).render_as_string(hide_password=False)
+    env = dict(os.environ)
+    if url.password is not None:
+        env['PGPASSWORD'] = url.password
+    with subprocess.Popen(['pg_dump', '-Fc', '-f', backup_path, dsn], stderr=subprocess.PIPE, env=env) as proc:
+        _, stderr = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(f"pg_dump failed: {stderr.decode(errors='replace').strip()}")
+
+@shared_task
+def create_backup_task(backup_path, ip_address=None):
+    """Back up the database to backup_path and audit it"""
+    backup_database(db.engine.url, backup_path)
+    add_audit('backup_created', details=f"Database backup created: {os.path.basename(backup_path)}", ip_address=ip_address)
+    db.session.commit()
+
+@shared_task
+def maintain_audit_partitions():
+    """Keep next month's audit log partition created ahead of time"""
+    if is_partitioned():
+        create_partitions(months_ahead=1)
+
+@shared_task
+def optimize_database():
+    """Refresh SQLite planner statistics so lookups keep choosing the unique indexes"""
+    if db.engine.url.get_backend_name() == 'sqlite':
+        db.session.execute(text("PRAGMA optimize"))
+        db.session.commit()